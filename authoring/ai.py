@@ -1,12 +1,20 @@
+import hashlib
 import json
 import logging
-from typing import Any, Dict, List, Optional
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 
 from . import SCHEMA_VERSION
 
 logger = logging.getLogger(__name__)
 
 
+PROMPT_VERSION = "authoring_v1"
+CACHE_FILENAME = ".ai_suggest_cache.json"
+DEFAULT_MAX_WORKERS = 4
+
 SUGGESTION_SCHEMA_FIELDS = {
     "prompt_version": str,
     "suggested_class": int,
@@ -57,7 +65,7 @@ def _basic_classifier(text: str) -> Dict[str, Any]:
                 required_elements.append(token)
 
     return {
-        "prompt_version": "authoring_v1",
+        "prompt_version": PROMPT_VERSION,
         "suggested_class": suggested_class,
         "confidence": float(confidence),
         "suggested_check_type": suggested_check_type,
@@ -95,14 +103,109 @@ def suggest_for_rule(rule: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         return None
 
 
-def apply_suggestions(rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def rule_cache_key(rule: Dict[str, Any], prompt_version: str = PROMPT_VERSION) -> str:
+    text = rule.get("text", "") or ""
+    return hashlib.sha256(f"{prompt_version}\x1f{text}".encode("utf-8")).hexdigest()
+
+
+class SuggestionCache:
+    """Suggestion cache keyed by sha256(prompt_version + rule text).
+
+    Stored as JSON next to rules.json so re-running ``ai-suggest`` after a small
+    Excel edit only sends new or changed rules through ``suggest_for_rule``.
+    Bumping PROMPT_VERSION invalidates every entry.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._used: set = set()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    payload = json.load(f)
+                self._entries = payload.get("entries", {})
+            except (OSError, ValueError) as exc:
+                logger.warning("Ignoring unreadable suggestion cache %s: %s", path, exc)
+
+    @classmethod
+    def for_rulepack(cls, rulepack_dir: str) -> "SuggestionCache":
+        return cls(os.path.join(rulepack_dir, CACHE_FILENAME))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used.add(key)
+            return dict(entry)
+
+    def put(self, key: str, suggestion: Dict[str, Any]):
+        with self._lock:
+            self._entries[key] = dict(suggestion)
+            self._used.add(key)
+
+    def save(self):
+        """Persist entries used in this run (stale entries for removed/edited rules are dropped)."""
+        if not self.path:
+            return
+        with self._lock:
+            entries = {k: v for k, v in self._entries.items() if k in self._used}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"prompt_version": PROMPT_VERSION, "entries": entries}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def stats(self) -> Dict[str, int]:
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
+
+
+def apply_suggestions(
+    rules: List[Dict[str, Any]],
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    cache: Optional[SuggestionCache] = None,
+    suggest_fn: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]] = suggest_for_rule,
+) -> List[Dict[str, Any]]:
+    """Attach suggestions to every rule.
+
+    Cached rules are resolved first; the remaining rules run through ``suggest_fn``
+    on a bounded thread pool (the LLM-backed suggester is I/O bound). Output order
+    always matches input order. Failed suggestions are not cached.
+    """
+    suggestions: List[Optional[Dict[str, Any]]] = [None] * len(rules)
+    pending: List[int] = []
+    keys = [rule_cache_key(rule) for rule in rules]
+    for index, key in enumerate(keys):
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            suggestions[index] = cached
+        else:
+            pending.append(index)
+
+    def _run(index: int) -> Optional[Dict[str, Any]]:
+        suggestion = suggest_fn(rules[index])
+        if suggestion and cache:
+            cache.put(keys[index], suggestion)
+        return suggestion
+
+    if pending:
+        workers = max(1, min(max_workers or 1, len(pending)))
+        if workers == 1:
+            results = [_run(index) for index in pending]
+        else:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ai-suggest") as pool:
+                results = list(pool.map(_run, pending))
+        for index, suggestion in zip(pending, results):
+            suggestions[index] = suggestion
+
     updated: List[Dict[str, Any]] = []
-    for rule in rules:
-        suggestion = suggest_for_rule(rule)
+    for rule, suggestion in zip(rules, suggestions):
         rule_copy = dict(rule)
-        if suggestion:
-            rule_copy["suggestions"] = suggestion
-        else:
-            rule_copy["suggestions"] = None
+        rule_copy["suggestions"] = suggestion if suggestion else None
         updated.append(rule_copy)
     return updated
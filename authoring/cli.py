@@ -6,7 +6,7 @@ from typing import List
 
 import sys
 from . import SCHEMA_VERSION
-from .ai import apply_suggestions
+from .ai import CACHE_FILENAME, DEFAULT_MAX_WORKERS, SuggestionCache, apply_suggestions
 from .converter import ConversionError, convert
 from .exporter import export_rules
 from .validator import validate
@@ -29,6 +29,8 @@ def _parse_args() -> argparse.Namespace:
 
     suggest_parser = subparsers.add_parser("ai-suggest", help="Apply AI suggestions to rules")
     suggest_parser.add_argument("rulepack_dir", help="Rulepack directory containing rules.json")
+    suggest_parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Max concurrent suggestion requests")
+    suggest_parser.add_argument("--no-cache", action="store_true", dest="no_cache", help="Ignore and do not write the suggestion cache")
 
     validate_parser = subparsers.add_parser("validate", help="Validate a rulepack directory")
     validate_parser.add_argument("rulepack_dir", help="Rulepack directory to validate")
@@ -73,9 +75,15 @@ def cmd_ai_suggest(args: argparse.Namespace):
     rules_path = os.path.join(args.rulepack_dir, "rules.json")
     with open(rules_path, "r", encoding="utf-8") as f:
         rules = json.load(f)
-    updated = apply_suggestions(rules)
+    cache = None if args.no_cache else SuggestionCache.for_rulepack(args.rulepack_dir)
+    updated = apply_suggestions(rules, max_workers=args.workers, cache=cache)
     _save_rules(args.rulepack_dir, updated)
-    print(json.dumps({"ok": True, "updated": len(updated)}))
+    if cache:
+        cache.save()
+    result = {"ok": True, "updated": len(updated)}
+    if cache:
+        result.update(cache.stats())
+    print(json.dumps(result))
 
 
 def cmd_validate(args: argparse.Namespace):
@@ -103,7 +111,7 @@ def cmd_build(args: argparse.Namespace):
     try:
         if os.path.exists(output):
             shutil.rmtree(output)
-        shutil.copytree(workdir, output)
+        shutil.copytree(workdir, output, ignore=shutil.ignore_patterns(CACHE_FILENAME, f"{CACHE_FILENAME}.tmp"))
         print(json.dumps({"ok": True, "output": output}, ensure_ascii=False, indent=2))
     except Exception as e:
         print(json.dumps({"ok": False, "error": str(e)}))
@@ -1,16 +1,32 @@
 import os
 import logging
 import time
-from typing import Dict, List, Optional
-from dataclasses import dataclass, field
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import asdict, dataclass, field
 from datetime import datetime
 
+from .ai_ledger import InvocationLedger, RollingMetrics, render_audit_report
+from .field_extractors import FieldHitStats, extract_local
+from .passage_selector import PassageSelector, build_query_terms, html_to_text
+from .provider_router import ProviderRouter
+from .singleflight import SingleFlight, make_key
+from .token_budget import Reservation, TokenBudget
+from .token_estimator import TokenEstimator, fit_prompt_budget
+
 # ✅ 加载环境变量（确保.env中的API KEY被读取）
 from dotenv import load_dotenv
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# system消息及对话格式的token开销（预留估算用）
+SYSTEM_PROMPT_TOKENS = 40
+
+# ModelScope OpenAI兼容接口（可用AI_BASE_URL指向本地模拟服务做离线压测）
+MODELSCOPE_BASE_URL = "https://api-inference.modelscope.cn/v1"
+
 
 # 尝试导入AI Provider
 try:
@@ -36,6 +52,9 @@ class AiInvocation:
     success: bool = False
     error: Optional[str] = None
     result: Optional[Dict] = None
+    hedged: bool = False      # 对冲请求（主Provider超时后并发发出）
+    cancelled: bool = False   # 对冲竞争中落败，结果被丢弃
+    estimated_input_tokens: int = 0  # 发送前的输入token估算（与input_tokens对比校准）
 
 
 class AIExtractor:
@@ -47,23 +66,65 @@ class AIExtractor:
         fallback_provider="qwen",      # Qwen作为备选（最快响应）
         max_tokens=2000,
         timeout_seconds=30,
-        max_cost_per_batch=None  # 从环境变量读取
+        max_cost_per_batch=None,  # 从环境变量读取
+        budget: Optional[TokenBudget] = None,  # 批次共享预算（BatchRunner创建）
+        site_id: Optional[str] = None,
+        router: Optional[ProviderRouter] = None,  # 批次共享路由统计（BatchRunner创建）
+        ledger: Optional[InvocationLedger] = None,  # 批次调用流水账（BatchRunner创建）
+        singleflight: Optional[SingleFlight] = None,  # 批次共享的进行中请求合并（BatchRunner创建）
+        token_estimator: Optional[TokenEstimator] = None  # 批次共享的token估算校准（BatchRunner创建）
     ):
         self.primary_provider = primary_provider
         self.fallback_provider = fallback_provider
         self.max_tokens = max_tokens
         self.timeout_seconds = timeout_seconds
+        self.site_id = site_id
+        
+        # ✅ 批次级预算：调用前预留、调用后结算；未传入时使用实例独立预算
+        if budget is None:
+            # 从环境变量读取token限额，默认50000（足够复核大量规则）
+            if max_cost_per_batch is None:
+                max_cost_per_batch = int(os.environ.get("AI_MAX_TOKENS_PER_BATCH", "50000"))
+            budget = TokenBudget(max_cost_per_batch)
+        self.budget = budget
+        self.max_cost_per_batch = budget.total_tokens
+        
+        # 预留时按此估算输出token（JSON结果通常较短）
+        self.reserve_output_tokens = int(os.environ.get("AI_RESERVE_OUTPUT_TOKENS", "300"))
+        
+        # ✅ 相关段落选择 + 按目标token数装填prompt（整个prompt，含模板）
+        self.passage_selector = PassageSelector()
+        self.token_estimator = token_estimator or TokenEstimator()
+        self.extract_prompt_tokens = int(os.environ.get("AI_EXTRACT_PROMPT_TOKENS", "1500"))
+        self.review_prompt_tokens = int(os.environ.get("AI_REVIEW_PROMPT_TOKENS", "2000"))
+        # 剩余预算不足时prompt可收缩到的最小token数，低于此值直接放弃调用
+        self.min_prompt_tokens = int(os.environ.get("AI_MIN_PROMPT_TOKENS", "400"))
+        
+        # ✅ AI调用记录：常量内存的滚动指标 + 批次JSONL流水账（调用结束即落盘）
+        self.metrics = RollingMetrics()
+        self.ledger = ledger
+        
+        # ✅ 相同prompt的并发请求合并（跨站点共享时才能合并不同站点的相同模板页）
+        self.singleflight = singleflight or SingleFlight()
+        
+        # ✅ 字段本地提取命中率
+        self.field_stats = FieldHitStats()
+        
+        # ✅ Provider路由：按滚动延迟/错误率排序，失败过多时熔断
+        if router is None:
+            router = ProviderRouter(
+                window=int(os.environ.get("AI_ROUTER_WINDOW", "20")),
+                failure_threshold=int(os.environ.get("AI_CIRCUIT_FAILURE_THRESHOLD", "5")),
+                cooldown_sec=float(os.environ.get("AI_CIRCUIT_COOLDOWN_SEC", "60")),
+            )
+        self.router = router
         
-        # ✅ 从环境变量读取token限额，默认50000（足够复核大量规则）
-        if max_cost_per_batch is None:
-            max_cost_per_batch = int(os.environ.get("AI_MAX_TOKENS_PER_BATCH", "50000"))
-        self.max_cost_per_batch = max_cost_per_batch
-        
-        # 当前批次token消耗
-        self.batch_tokens_used = 0
-        
-        # AI调用记录
-        self.invocations: List[AiInvocation] = []
+        # ✅ 对冲请求（opt-in）：主Provider超过其延迟分位数仍未返回时，并发请求下一个Provider
+        self.hedge_enabled = os.environ.get("AI_HEDGE_ENABLED", "false").lower() == "true"
+        self.hedge_percentile = float(os.environ.get("AI_HEDGE_PERCENTILE", "90"))
+        self.hedge_min_samples = int(os.environ.get("AI_HEDGE_MIN_SAMPLES", "5"))
+        self.hedge_default_delay_ms = int(os.environ.get("AI_HEDGE_DEFAULT_DELAY_MS", "8000"))
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
         
         # 初始化Providers
         self.deepseek_client = None
@@ -72,13 +133,19 @@ class AIExtractor:
         
         # ModelScope API Key（所有模型共用）
         modelscope_key = os.environ.get("DEEPSEEK_API_KEY")
+        base_url = os.environ.get("AI_BASE_URL") or MODELSCOPE_BASE_URL
+        max_retries = int(os.environ.get("AI_CLIENT_MAX_RETRIES", "2"))  # openai客户端内置重试次数
+        if base_url != MODELSCOPE_BASE_URL:
+            logger.info(f"AI base_url: {base_url}")
         
         # DeepSeek（魔搭）初始化 - 主要Provider
         if MODELSCOPE_AVAILABLE and modelscope_key:
             try:
                 self.deepseek_client = OpenAI(
                     api_key=modelscope_key,
-                    base_url="https://api-inference.modelscope.cn/v1"
+                    base_url=base_url,
+                    timeout=self.timeout_seconds,
+                    max_retries=max_retries
                 )
                 logger.info("DeepSeek provider initialized (ModelScope) - Primary")
             except Exception as e:
@@ -89,7 +156,9 @@ class AIExtractor:
             try:
                 self.qwen_client = OpenAI(
                     api_key=modelscope_key,
-                    base_url="https://api-inference.modelscope.cn/v1"
+                    base_url=base_url,
+                    timeout=self.timeout_seconds,
+                    max_retries=max_retries
                 )
                 logger.info("Qwen3-32B provider initialized (ModelScope) - Fallback")
             except Exception as e:
@@ -100,57 +169,285 @@ class AIExtractor:
             try:
                 self.glm_client = OpenAI(
                     api_key=modelscope_key,
-                    base_url="https://api-inference.modelscope.cn/v1"
+                    base_url=base_url,
+                    timeout=self.timeout_seconds,
+                    max_retries=max_retries
                 )
                 logger.info("GLM-4.7 provider initialized (ModelScope) - Special Cases")
             except Exception as e:
                 logger.error(f"Failed to initialize GLM: {e}")
 
     
-    def extract_fields(self, html_body: str, fields: List[str]) -> Dict[str, Optional[str]]:
+    @property
+    def batch_tokens_used(self) -> int:
+        """当前批次token消耗（已结算）"""
+        return self.budget.used
+    
+    @batch_tokens_used.setter
+    def batch_tokens_used(self, value: int):
+        self.budget.used = value
+    
+    def _record_invocation(self, invocation: AiInvocation, reservation: Optional[Reservation] = None):
+        """记录调用并更新路由统计"""
+        if reservation is not None:
+            invocation.hedged = reservation.hedged
+            invocation.cancelled = reservation.cancelled
+            invocation.estimated_input_tokens = reservation.estimated_input_tokens
+            # ✅ 估算 vs 实际输入token，持续校准估算器
+            if invocation.success and invocation.input_tokens:
+                self.token_estimator.observe(
+                    invocation.provider, reservation.estimated_input_tokens, invocation.input_tokens
+                )
+        self.metrics.record(asdict(invocation))
+        if self.ledger is not None:
+            self.ledger.append(invocation)
+        self.router.record(invocation)
+    
+    def _route_providers(self) -> List[str]:
+        """本次调用的Provider尝试顺序（仅包含已初始化的Provider）"""
+        clients = {
+            "deepseek": self.deepseek_client,
+            "qwen": self.qwen_client,
+            "glm": self.glm_client,
+        }
+        candidates = []
+        for provider in [self.primary_provider, self.fallback_provider]:
+            if provider not in clients:
+                logger.error(f"Unknown provider: {provider}")
+            elif clients[provider] is None:
+                logger.warning(f"{provider} client not available")
+            elif provider not in candidates:
+                candidates.append(provider)
+        return self.router.route(candidates) if candidates else []
+    
+    def _reserve(self, prompt: str, rule_class: Optional[int] = None, hedged: bool = False) -> Optional[Reservation]:
+        """按prompt估算token并向批次预算预留"""
+        estimated_input = self.token_estimator.estimate(prompt) + SYSTEM_PROMPT_TOKENS
+        reservation = self.budget.reserve(
+            estimated_input + self.reserve_output_tokens,
+            site_id=self.site_id, rule_class=rule_class, hedged=hedged
+        )
+        if reservation is not None:
+            reservation.estimated_input_tokens = estimated_input
+        return reservation
+    
+    def _fit_prompt_target(self, target_tokens: int, rule_class: Optional[int] = None) -> Optional[int]:
+        """
+        按剩余预算确定prompt目标token数：预算不足时收缩，收缩后仍低于min_prompt_tokens则拒绝（返回None）
+        """
+        available = (
+            self.budget.available(self.site_id, rule_class)
+            - SYSTEM_PROMPT_TOKENS - self.reserve_output_tokens
+        )
+        fitted = fit_prompt_budget(target_tokens, available, self.min_prompt_tokens)
+        if fitted is None:
+            logger.warning(f"剩余预算仅够{max(available, 0)} tokens的prompt（最小{self.min_prompt_tokens}），放弃AI调用")
+        elif fitted < target_tokens:
+            logger.info(f"剩余预算不足，prompt由{target_tokens}收缩到{fitted} tokens")
+        return fitted
+    
+    def _pack_prompt(self, render: Callable[[str], str], texts: List[str], query_terms: List[str], target_tokens: int) -> str:
+        """按相关性挑选段落填入prompt模板，使整个prompt不超过target_tokens"""
+        overhead = self.token_estimator.estimate(render(""))
+        content_budget = self.token_estimator.to_raw(max(target_tokens - overhead, 0))
+        selected = self.passage_selector.select(texts, query_terms, content_budget)
+        return render("\n\n---\n\n".join(text for text in selected if text))
+    
+    def _request(self, kind: str, try_fn: Callable, prompt: str, rule_class: Optional[int] = None) -> Tuple[str, Optional[Dict]]:
+        """
+        预留预算并调用Provider；相同prompt已在进行中时等待其结果（不重复调用、不重复预留）
+        
+        Returns:
+            (状态, 结果)：状态为 "ok" | "denied"（预算不足）| "failed"（全部Provider失败）
+        """
+        def run():
+            reservation = self._reserve(prompt, rule_class)
+            if reservation is None:
+                return "denied", None
+            result = self._call_providers(try_fn, prompt, reservation)
+            return ("ok", result) if result else ("failed", None)
+        
+        key = make_key(kind, self.primary_provider, self.fallback_provider, prompt)
+        outcome, shared = self.singleflight.do(key, run, kind=kind)
+        if shared and outcome[0] == "denied":
+            # 预算拒绝取决于发起方站点的份额，合并方按自己的份额重试
+            return run()
+        return outcome
+    
+    def _call_providers(self, try_fn: Callable, prompt: str, reservation: Reservation) -> Optional[Dict]:
+        """
+        按路由顺序调用Provider，返回第一个有效JSON结果
+        
+        Args:
+            try_fn: _try_provider 或 _try_review_provider
+        """
+        providers = self._route_providers()
+        
+        if self.hedge_enabled and len(providers) > 1:
+            result = self._call_hedged(try_fn, providers, prompt, reservation)
+        else:
+            result = None
+            for provider in providers:
+                result = try_fn(provider, prompt, reservation)
+                if result:
+                    break
+                logger.warning(f"Provider {provider} failed, trying next provider")
+        
+        if not result:
+            self.budget.release(reservation)
+        return result
+    
+    def _call_hedged(self, try_fn: Callable, providers: List[str], prompt: str, reservation: Reservation) -> Optional[Dict]:
+        """
+        对冲调用：主Provider超过其p{hedge_percentile}延迟仍未返回时，
+        向下一个Provider发出相同请求，先返回有效JSON者胜出，另一方取消
+        """
+        primary, hedge_provider = providers[0], providers[1]
+        delay_ms = self.router.latency_percentile(primary, self.hedge_percentile, self.hedge_min_samples)
+        if delay_ms is None:
+            delay_ms = self.hedge_default_delay_ms
+        
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("AI_HEDGE_MAX_WORKERS", "8")),
+                thread_name_prefix="ai_hedge"
+            )
+        
+        primary_future = self._hedge_executor.submit(try_fn, primary, prompt, reservation)
+        try:
+            result = primary_future.result(timeout=delay_ms / 1000)
+        except FutureTimeout:
+            result = None
+        else:
+            if result:
+                return result
+            # 主Provider在对冲延迟内就失败了，按顺序降级
+            for provider in providers[1:]:
+                result = try_fn(provider, prompt, reservation)
+                if result:
+                    return result
+            return None
+        
+        # 对冲请求单独预留预算
+        hedge_reservation = self._reserve(prompt, reservation.rule_class, hedged=True)
+        if hedge_reservation is None:
+            logger.warning("Token reservation denied for hedged request, waiting for primary")
+            result = primary_future.result()
+            if result:
+                return result
+            for provider in providers[1:]:
+                result = try_fn(provider, prompt, reservation)
+                if result:
+                    return result
+            return None
+        
+        logger.info(
+            f"对冲请求: {primary}超过p{self.hedge_percentile:.0f}延迟({delay_ms:.0f}ms)未返回，"
+            f"并发请求{hedge_provider}"
+        )
+        hedge_future = self._hedge_executor.submit(try_fn, hedge_provider, prompt, hedge_reservation)
+        reservations = {primary_future: reservation, hedge_future: hedge_reservation}
+        
+        pending = {primary_future, hedge_future}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result:
+                    # 胜出：取消落败方（已在执行的请求结果将被丢弃，完成后按实际用量结算）
+                    for loser in pending:
+                        loser_reservation = reservations[loser]
+                        loser_reservation.cancelled = True
+                        loser.cancel()
+                        loser.add_done_callback(
+                            lambda f, r=loser_reservation: self.budget.release(r)
+                        )
+                    winner = primary if future is primary_future else hedge_provider
+                    logger.info(f"对冲请求完成，{winner}胜出")
+                    return result
+                if future is hedge_future:
+                    self.budget.release(hedge_reservation)
+        return None
+    
+    def extract_fields(self, html_body: str, fields: List[str], query_terms: Optional[List[str]] = None, rule_class: Optional[int] = None) -> Dict[str, Optional[str]]:
         """
         从HTML中提取指定字段（支持双Provider）
         
         Args:
             html_body: 页面HTML内容
             fields: 要提取的字段列表，如["phone", "address"]
+            query_terms: 额外检索词（如规则locator关键词），用于挑选相关段落
+            rule_class: 规则类别，用于预算优先级
         
         Returns:
             {"phone": "025-12345", "address": "南京市..."}
         """
+        text = html_to_text(html_body)
+        
+        # ✅ 本地正则预提取，只有提取不到的字段才调用LLM
+        local = extract_local(text, fields)
+        missing = [field for field in fields if not local.get(field)]
+        if not missing:
+            for field in fields:
+                self.field_stats.record(field, local_hit=True)
+            logger.info(f"Local extractors filled all fields, skipping AI: {local}")
+            return local
+        
+        llm_result = self._extract_with_llm(text, missing, query_terms, rule_class)
+        
+        for field in fields:
+            if local.get(field):
+                self.field_stats.record(field, local_hit=True)
+            else:
+                self.field_stats.record(
+                    field, local_hit=False,
+                    llm_called=llm_result is not None,
+                    llm_hit=bool(llm_result and llm_result.get(field))
+                )
+        
+        merged = dict(local)
+        if llm_result:
+            merged.update({field: llm_result.get(field) for field in missing})
+        return merged
+    
+    def _extract_with_llm(self, text: str, fields: List[str], query_terms: Optional[List[str]], rule_class: Optional[int]) -> Optional[Dict]:
+        """调用LLM提取字段；预算不足或全部Provider失败时返回None"""
         # Cost Control检查
         if self.batch_tokens_used >= self.max_cost_per_batch:
             logger.warning(f"Batch token limit reached ({self.batch_tokens_used}/{self.max_cost_per_batch}), skipping AI extraction")
-            return {field: None for field in fields}
+            return None
         
-        # 尝试主Provider
-        result = self._try_provider(self.primary_provider, html_body, fields)
-        if result:
-            return result
+        # ✅ 按剩余预算确定prompt大小（不足时收缩或放弃）
+        target_tokens = self._fit_prompt_target(self.extract_prompt_tokens, rule_class)
+        if target_tokens is None:
+            return None
+        prompt = self._build_extraction_prompt(text, fields, query_terms, target_tokens)
         
-        # 降级到副Provider
-        logger.warning(f"Primary provider {self.primary_provider} failed, trying fallback {self.fallback_provider}")
-        result = self._try_provider(self.fallback_provider, html_body, fields)
+        # ✅ 调用前预留token（避免并发站点超支），按路由顺序尝试（可选对冲），相同prompt并发时合并
+        status, result = self._request("extract", self._try_provider, prompt, rule_class)
+        if status == "denied":
+            logger.warning("Token reservation denied, skipping AI extraction")
+            return None
         if result:
             return result
         
         # 所有Provider都失败
         logger.error("All AI providers failed")
-        return {field: None for field in fields}
+        return None
     
-    def _try_provider(self, provider: str, html_body: str, fields: List[str]) -> Optional[Dict]:
+    def _try_provider(self, provider: str, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """尝试使用指定Provider"""
         if provider == "deepseek":
-            return self._extract_with_deepseek(html_body, fields)
+            return self._extract_with_deepseek(prompt, reservation)
         elif provider == "qwen":
-            return self._extract_with_qwen(html_body, fields)
+            return self._extract_with_qwen(prompt, reservation)
         elif provider == "glm":
-            return self._extract_with_glm(html_body, fields)
+            return self._extract_with_glm(prompt, reservation)
         else:
             logger.error(f"Unknown provider: {provider}")
             return None
     
-    def _extract_with_glm(self, html_body: str, fields: List[str]) -> Optional[Dict]:
+    def _extract_with_glm(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用GLM-4.7提取"""
         if not self.glm_client:
             logger.warning("GLM client not available")
@@ -162,9 +459,8 @@ class AIExtractor:
             model="ZhipuAI/GLM-4.7"
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_extraction_prompt(html_body, fields)
-            start_time = time.time()
             
             # GLM调用（非流式）
             response = self.glm_client.chat.completions.create(
@@ -195,8 +491,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"GLM extraction successful ({elapsed_ms}ms, {invocation.total_tokens} tokens)")
             return extracted
@@ -204,11 +500,12 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"GLM extraction failed: {e}")
             return None
     
-    def _extract_with_qwen(self, html_body: str, fields: List[str]) -> Optional[Dict]:
+    def _extract_with_qwen(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用Qwen3-32B提取（支持thinking模式）"""
         if not self.qwen_client:
             logger.warning("Qwen client not available")
@@ -220,9 +517,8 @@ class AIExtractor:
             model="Qwen/Qwen3-32B"
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_extraction_prompt(html_body, fields)
-            start_time = time.time()
             
             # Qwen3调用（非流式，显式禁用thinking）
             response = self.qwen_client.chat.completions.create(
@@ -254,8 +550,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"Qwen extraction successful ({elapsed_ms}ms, {invocation.total_tokens} tokens)")
             return extracted
@@ -263,12 +559,13 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"Qwen extraction failed: {e}")
             return None
     
     
-    def _extract_with_deepseek(self, html_body: str, fields: List[str]) -> Optional[Dict]:
+    def _extract_with_deepseek(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用DeepSeek提取（魔搭社区）"""
         if not self.deepseek_client:
             logger.warning("DeepSeek client not available")
@@ -280,9 +577,8 @@ class AIExtractor:
             model="deepseek-ai/DeepSeek-V3.2"  # 魔搭ModelScope Model-Id
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_extraction_prompt(html_body, fields)
-            start_time = time.time()
             
             # 魔搭DeepSeek调用（非流式）
             response = self.deepseek_client.chat.completions.create(
@@ -313,8 +609,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"DeepSeek (魔搭) extraction successful ({elapsed_ms}ms, {invocation.total_tokens} tokens)")
             return extracted
@@ -322,34 +618,34 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"DeepSeek extraction failed: {e}")
             return None
     
-    def _build_extraction_prompt(self, html_body: str, fields: List[str]) -> str:
-        """构建提取prompt"""
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(html_body, 'html.parser')
-        for script in soup(["script", "style"]):
-            script.decompose()
-        text = soup.get_text(separator="\n", strip=True)
-        
-        # 限制长度
-        text = text[:5000]
-        
+    def _build_extraction_prompt(
+        self,
+        text: str,
+        fields: List[str],
+        query_terms: Optional[List[str]] = None,
+        target_tokens: Optional[int] = None
+    ) -> str:
+        """构建提取prompt（text为已去除标签的页面文本，按字段相关性装填到target_tokens）"""
         field_descriptions = {
             "phone": "联系电话（如：025-12345678或010-12345678）",
             "address": "办公地址（如：江苏省南京市玄武区XX路XX号）",
             "email": "电子邮件",
-            "fax": "传真号码"
+            "fax": "传真号码",
+            "office_hours": "办公时间（如：周一至周五 上午8:30-12:00，下午14:00-17:30）"
         }
         
         fields_str = "\n".join([f"- {field}: {field_descriptions.get(field, field)}" for field in fields])
         
-        return f"""从以下政府网站内容中提取指定字段。
+        def render(content: str) -> str:
+            return f"""从以下政府网站内容中提取指定字段。
 
 内容:
-{text}
+{content}
 
 需要提取的字段:
 {fields_str}
@@ -359,6 +655,10 @@ class AIExtractor:
 
 如果某个字段找不到，返回null。只返回JSON，不要其他解释。
 """
+        
+        # ✅ 按字段相关性挑选段落（替代text[:5000]截断）
+        terms = build_query_terms(fields=fields, extra_terms=query_terms)
+        return self._pack_prompt(render, [text], terms, target_tokens or self.extract_prompt_tokens)
     
     def _clean_json_response(self, text: str) -> str:
         """清理JSON响应（移除markdown标记）"""
@@ -397,14 +697,22 @@ class AIExtractor:
                 "suggested_action": "increase_token_limit"
             }
         
-        # 尝试主Provider
-        result = self._try_review_provider(self.primary_provider, rule, pages, reason)
-        if result:
-            return result
+        # ✅ 按剩余预算确定prompt大小（不足时收缩，过小则放弃）
+        target_tokens = self._fit_prompt_target(self.review_prompt_tokens, rule.get("class"))
+        if target_tokens is None:
+            status, result = "denied", None
+        else:
+            prompt = self._build_review_prompt(rule, pages, reason, target_tokens)
+            status, result = self._request("review", self._try_review_provider, prompt, rule.get("class"))
+        if status == "denied":
+            logger.warning(f"Token reservation denied, skipping AI review")
+            return {
+                "status": "UNCERTAIN",
+                "confidence": 0.0,
+                "reasoning": "Token预算不足，无法进行AI复核",
+                "suggested_action": "increase_token_limit"
+            }
         
-        # 降级到副Provider
-        logger.warning(f"Primary provider {self.primary_provider} failed for review, trying fallback")
-        result = self._try_review_provider(self.fallback_provider, rule, pages, reason)
         if result:
             return result
         
@@ -417,19 +725,19 @@ class AIExtractor:
             "suggested_action": "manual_review"
         }
     
-    def _try_review_provider(self, provider: str, rule: Dict, pages: List[Dict], reason: str) -> Optional[Dict]:
+    def _try_review_provider(self, provider: str, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """尝试使用指定Provider进行复核"""
         if provider == "deepseek":
-            return self._review_with_deepseek(rule, pages, reason)
+            return self._review_with_deepseek(prompt, reservation)
         elif provider == "qwen":
-            return self._review_with_qwen(rule, pages, reason)
+            return self._review_with_qwen(prompt, reservation)
         elif provider == "glm":
-            return self._review_with_glm(rule, pages, reason)
+            return self._review_with_glm(prompt, reservation)
         else:
             logger.error(f"Unknown provider: {provider}")
             return None
     
-    def _review_with_deepseek(self, rule: Dict, pages: List[Dict], reason: str) -> Optional[Dict]:
+    def _review_with_deepseek(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用DeepSeek复核UNCERTAIN规则"""
         if not self.deepseek_client:
             logger.warning("DeepSeek client not available")
@@ -441,9 +749,8 @@ class AIExtractor:
             model="deepseek-ai/DeepSeek-V3.2"
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_review_prompt(rule, pages, reason)
-            start_time = time.time()
             
             response = self.deepseek_client.chat.completions.create(
                 model="deepseek-ai/DeepSeek-V3.2",
@@ -473,8 +780,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"DeepSeek review successful: {review_result['status']} (confidence: {review_result['confidence']:.2f})")
             return review_result
@@ -482,11 +789,12 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"DeepSeek review failed: {e}")
             return None
     
-    def _review_with_qwen(self, rule: Dict, pages: List[Dict], reason: str) -> Optional[Dict]:
+    def _review_with_qwen(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用Qwen复核UNCERTAIN规则"""
         if not self.qwen_client:
             return None
@@ -497,9 +805,8 @@ class AIExtractor:
             model="Qwen/Qwen3-32B"
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_review_prompt(rule, pages, reason)
-            start_time = time.time()
             
             response = self.qwen_client.chat.completions.create(
                 model="Qwen/Qwen3-32B",
@@ -527,8 +834,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"Qwen review successful: {review_result['status']} (confidence: {review_result['confidence']:.2f})")
             return review_result
@@ -536,11 +843,12 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"Qwen review failed: {e}")
             return None
     
-    def _review_with_glm(self, rule: Dict, pages: List[Dict], reason: str) -> Optional[Dict]:
+    def _review_with_glm(self, prompt: str, reservation: Reservation) -> Optional[Dict]:
         """使用GLM复核UNCERTAIN规则"""
         if not self.glm_client:
             return None
@@ -551,9 +859,8 @@ class AIExtractor:
             model="ZhipuAI/GLM-4.7"
         )
         
+        start_time = time.time()
         try:
-            prompt = self._build_review_prompt(rule, pages, reason)
-            start_time = time.time()
             
             response = self.glm_client.chat.completions.create(
                 model="ZhipuAI/GLM-4.7",
@@ -580,8 +887,8 @@ class AIExtractor:
             invocation.output_tokens = response.usage.completion_tokens
             invocation.total_tokens = response.usage.total_tokens
             
-            self.batch_tokens_used += invocation.total_tokens
-            self.invocations.append(invocation)
+            self.budget.settle(reservation, invocation.total_tokens)
+            self._record_invocation(invocation, reservation)
             
             logger.info(f"GLM review successful: {review_result['status']} (confidence: {review_result['confidence']:.2f})")
             return review_result
@@ -589,25 +896,13 @@ class AIExtractor:
         except Exception as e:
             invocation.success = False
             invocation.error = str(e)
-            self.invocations.append(invocation)
+            invocation.latency_ms = int((time.time() - start_time) * 1000)
+            self._record_invocation(invocation, reservation)
             logger.error(f"GLM review failed: {e}")
             return None
     
-    def _build_review_prompt(self, rule: Dict, pages: List[Dict], reason: str) -> str:
-        """构建AI复核prompt"""
-        from bs4 import BeautifulSoup
-        
-        # 提取所有页面的文本内容（最多3个页面）
-        page_texts = []
-        for page in pages[:3]:
-            soup = BeautifulSoup(page.get("body", ""), 'html.parser')
-            for script in soup(["script", "style"]):
-                script.decompose()
-            text = soup.get_text(separator="\n", strip=True)
-            page_texts.append(text[:2000])  # 每个页面最多2000字符
-        
-        combined_text = "\n\n---\n\n".join(page_texts)
-        
+    def _build_review_prompt(self, rule: Dict, pages: List[Dict], reason: str, target_tokens: Optional[int] = None) -> str:
+        """构建AI复核prompt（跨所有页面按规则相关性装填到target_tokens）"""
         # 构建规则描述
         rule_desc = rule.get("description", "")
         locator = rule.get("locator", {})
@@ -616,7 +911,8 @@ class AIExtractor:
         locator_keywords = locator.get("keywords", [])
         evaluator_keywords = evaluator.get("keywords", [])
         
-        return f"""你是政务公开评估专家。一条规则被标记为UNCERTAIN（不确定），需要你复核。
+        def render(combined_text: str) -> str:
+            return f"""你是政务公开评估专家。一条规则被标记为UNCERTAIN（不确定），需要你复核。
 
 **规则描述**: {rule_desc}
 
@@ -645,61 +941,39 @@ class AIExtractor:
 - 如果confidence <= 0.8，应保持UNCERTAIN
 - reasoning要具体，指出在哪里找到（或未找到）相关内容
 """
+        
+        # ✅ 在所有页面中按规则相关性挑选段落（替代前3页×2000字符截断）
+        page_texts = [html_to_text(page.get("body", "")) for page in pages]
+        terms = build_query_terms(rule=rule)
+        return self._pack_prompt(render, page_texts, terms, target_tokens or self.review_prompt_tokens)
     
     def get_invocation_stats(self) -> Dict:
-        """获取AI调用统计"""
-        total = len(self.invocations)
-        success = sum(1 for inv in self.invocations if inv.success)
-        
-        total_tokens = sum(inv.total_tokens for inv in self.invocations)
-        avg_latency = sum(inv.latency_ms for inv in self.invocations) / total if total > 0 else 0
-        
-        provider_stats = {}
-        for inv in self.invocations:
-            if inv.provider not in provider_stats:
-                provider_stats[inv.provider] = {"total": 0, "success": 0}
-            provider_stats[inv.provider]["total"] += 1
-            if inv.success:
-                provider_stats[inv.provider]["success"] += 1
-        
-        return {
-            "total_invocations": total,
-            "successful_invocations": success,
-            "success_rate": success / total if total > 0 else 0,
-            "total_tokens_used": total_tokens,
-            "batch_tokens_remaining": self.max_cost_per_batch - self.batch_tokens_used,
-            "average_latency_ms": int(avg_latency),
-            "provider_stats": provider_stats
-        }
+        """获取AI调用统计（本实例，常量内存滚动指标）"""
+        stats = self.metrics.snapshot()
+        stats.update({
+            "field_stats": self.field_stats.snapshot(),
+            "coalesce_stats": self.singleflight.snapshot(),
+            "token_estimator": self.token_estimator.snapshot(),
+            "batch_tokens_remaining": self.budget.remaining,
+            "batch_tokens_reserved": self.budget.reserved,
+        })
+        return stats
     
     def generate_audit_report(self) -> str:
-        """生成AI审计报告（Markdown）"""
-        stats = self.get_invocation_stats()
-        
-        md = []
-        md.append("# AI调用审计报告\n\n")
-        md.append(f"**生成时间**: {datetime.utcnow().isoformat()}Z\n\n")
-        
-        md.append("## 📊 调用统计\n\n")
-        md.append(f"- **总调用次数**: {stats['total_invocations']}\n")
-        md.append(f"- **成功次数**: {stats['successful_invocations']}\n")
-        md.append(f"- **成功率**: {stats['success_rate']:.1%}\n")
-        md.append(f"- **Token消耗**: {stats['total_tokens_used']} / {self.max_cost_per_batch}\n")
-        md.append(f"- **平均延迟**: {stats['average_latency_ms']}ms\n\n")
-        
-        md.append("## 🔌 Provider统计\n\n")
-        md.append("| Provider | 调用次数 | 成功次数 | 成功率 |\n")
-        md.append("|----------|----------|----------|--------|\n")
-        for provider, ps in stats['provider_stats'].items():
-            rate = ps['success'] / ps['total'] if ps['total'] > 0 else 0
-            md.append(f"| {provider} | {ps['total']} | {ps['success']} | {rate:.1%} |\n")
-        md.append("\n")
-        
-        md.append("## 📋 详细调用记录\n\n")
-        md.append("| 时间 | Provider | 延迟 | Tokens | 状态 |\n")
-        md.append("|------|----------|------|--------|------|\n")
-        for inv in self.invocations[-50:]:  # 最多显示50条
-            status = "✅" if inv.success else f"❌ {inv.error[:30]}"
-            md.append(f"| {inv.timestamp} | {inv.provider} | {inv.latency_ms}ms | {inv.total_tokens} | {status} |\n")
-        
-        return "".join(md)
+        """
+        生成AI审计报告（Markdown）
+        
+        有批次流水账时流式读取ai_invocations.jsonl汇总整个批次，否则使用本实例的内存统计
+        """
+        if self.ledger is not None:
+            summary = self.ledger.summarize()
+        else:
+            summary = dict(self.metrics.snapshot(), recent=list(self.metrics.recent))
+        return render_audit_report(
+            summary,
+            self.max_cost_per_batch,
+            routing=self.router.snapshot(),
+            field_stats=self.field_stats.snapshot(),
+            coalesce_stats=self.singleflight.snapshot(),
+            estimator=self.token_estimator.snapshot(),
+        )
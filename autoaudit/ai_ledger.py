@@ -0,0 +1,379 @@
+"""
+AI调用流水账
+每次AI调用结束即追加一行到 runs/<batch_id>/ai_invocations.jsonl，
+按Provider在常量内存中维护滚动p50/p95延迟、每分钟token数和错误率；
+审计报告通过流式读取流水账生成，不再依赖内存中的全部调用记录
+"""
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict, is_dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ROLLING_WINDOW = 200     # 每个Provider保留最近N次调用用于分位数/错误率
+TOKENS_WINDOW_SEC = 60   # tokens/min 统计窗口
+RECENT_ROWS = 50         # 报告中展示的最近调用条数
+
+
+def percentile(values, pct: float) -> float:
+    """最近秩分位数（流水账滚动指标与Provider路由共用）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))]
+
+
+def _epoch(timestamp: Optional[str]) -> float:
+    """ISO时间戳（带Z）转秒"""
+    try:
+        return datetime.fromisoformat(timestamp.rstrip("Z")).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class _ProviderWindow:
+    """单个Provider的累计计数 + 固定大小滚动窗口"""
+
+    def __init__(self, window: int):
+        self.calls = 0
+        self.successes = 0
+        self.tokens = 0
+        self.latency_sum = 0
+        self.model = None
+        self.samples = deque(maxlen=window)  # (latency_ms, success)
+        self.token_buckets = deque()          # (second, tokens)，最多TOKENS_WINDOW_SEC个
+
+    def add(self, record: Dict, now: float):
+        self.calls += 1
+        self.successes += int(bool(record.get("success")))
+        self.tokens += record.get("total_tokens", 0)
+        self.latency_sum += record.get("latency_ms", 0)
+        self.model = record.get("model") or self.model
+        self.samples.append((record.get("latency_ms", 0), bool(record.get("success"))))
+
+        second = int(now)
+        if self.token_buckets and self.token_buckets[-1][0] == second:
+            self.token_buckets[-1] = (second, self.token_buckets[-1][1] + record.get("total_tokens", 0))
+        else:
+            self.token_buckets.append((second, record.get("total_tokens", 0)))
+        self._trim(second)
+
+    def _trim(self, second: int):
+        while self.token_buckets and self.token_buckets[0][0] <= second - TOKENS_WINDOW_SEC:
+            self.token_buckets.popleft()
+
+    def snapshot(self, now: float) -> Dict:
+        self._trim(int(now))
+        latencies = [lat for lat, ok in self.samples if ok]
+        errors = sum(1 for _, ok in self.samples if not ok)
+        return {
+            "model": self.model,
+            "total": self.calls,
+            "success": self.successes,
+            "total_tokens": self.tokens,
+            "average_latency_ms": int(self.latency_sum / self.calls) if self.calls else 0,
+            "rolling_calls": len(self.samples),
+            "rolling_p50_latency_ms": int(percentile(latencies, 50)),
+            "rolling_p95_latency_ms": int(percentile(latencies, 95)),
+            "rolling_error_rate": round(errors / len(self.samples), 3) if self.samples else 0.0,
+            "tokens_per_minute": sum(tokens for _, tokens in self.token_buckets),
+        }
+
+
+class RollingMetrics:
+    """AI调用指标（常量内存：累计计数 + 每Provider固定窗口）"""
+
+    def __init__(self, window: int = ROLLING_WINDOW, recent_rows: int = RECENT_ROWS):
+        self.window = window
+        self._lock = threading.Lock()
+        self._providers: Dict[str, _ProviderWindow] = {}
+        self.recent = deque(maxlen=recent_rows)
+        self.total = 0
+        self.successes = 0
+        self.tokens = 0
+        self.latency_sum = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedged_tokens = 0
+        self.cancelled = 0
+        self.cancelled_tokens = 0
+        self._latest = 0.0
+
+    def record(self, record: Dict):
+        """记录一次调用（record为AiInvocation的字典形式）"""
+        now = _epoch(record.get("timestamp")) + record.get("latency_ms", 0) / 1000
+        tokens = record.get("total_tokens", 0)
+        with self._lock:
+            self._latest = max(self._latest, now)
+            provider = self._providers.get(record.get("provider"))
+            if provider is None:
+                provider = self._providers[record.get("provider")] = _ProviderWindow(self.window)
+            provider.add(record, now)
+
+            self.total += 1
+            self.successes += int(bool(record.get("success")))
+            self.tokens += tokens
+            self.latency_sum += record.get("latency_ms", 0)
+            if record.get("hedged"):
+                self.hedged += 1
+                self.hedged_tokens += tokens
+                if record.get("success") and not record.get("cancelled"):
+                    self.hedge_wins += 1
+            if record.get("cancelled"):
+                self.cancelled += 1
+                self.cancelled_tokens += tokens
+            self.recent.append({
+                "timestamp": record.get("timestamp"),
+                "provider": record.get("provider"),
+                "latency_ms": record.get("latency_ms", 0),
+                "total_tokens": tokens,
+                "success": record.get("success"),
+                "error": record.get("error"),
+                "hedged": record.get("hedged", False),
+                "cancelled": record.get("cancelled", False),
+            })
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "total_invocations": self.total,
+                "successful_invocations": self.successes,
+                "success_rate": self.successes / self.total if self.total else 0,
+                "total_tokens_used": self.tokens,
+                "average_latency_ms": int(self.latency_sum / self.total) if self.total else 0,
+                "provider_stats": {
+                    name: p.snapshot(self._latest) for name, p in self._providers.items()
+                },
+                "hedge_stats": {
+                    "hedged_invocations": self.hedged,
+                    "hedge_wins": self.hedge_wins,
+                    "hedged_tokens": self.hedged_tokens,
+                    "cancelled_invocations": self.cancelled,
+                    "cancelled_tokens": self.cancelled_tokens,
+                },
+            }
+
+
+class InvocationLedger:
+    """批次级AI调用流水账（JSONL，线程安全追加）"""
+
+    def __init__(self, path: Optional[Path] = None):
+        """
+        Args:
+            path: 流水账路径（如 runs/<batch_id>/ai_invocations.jsonl）；为空时只在内存中统计
+        """
+        self.path = Path(path) if path else None
+        self.metrics = RollingMetrics()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def append(self, invocation):
+        """追加一条调用记录（AiInvocation或dict）"""
+        record = asdict(invocation) if is_dataclass(invocation) else dict(invocation)
+        self.metrics.record(record)
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._file = self.path.open("a", encoding="utf-8")
+                self._file.write(line + "\n")
+                self._file.flush()
+            except OSError as e:
+                logger.warning(f"AI流水账写入失败: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def iter_records(self) -> Iterator[Dict]:
+        """逐行读取流水账"""
+        yield from iter_ledger(self.path)
+
+    def summarize(self) -> Dict:
+        """流式读取流水账重新汇总（无文件时返回内存统计）"""
+        if not self.path or not self.path.exists():
+            return dict(self.metrics.snapshot(), recent=list(self.metrics.recent))
+        return summarize_ledger(self.path)
+
+
+def iter_ledger(path: Optional[Path]) -> Iterator[Dict]:
+    """逐行读取JSONL流水账，跳过损坏的行"""
+    if not path or not Path(path).exists():
+        return
+    with Path(path).open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug("跳过损坏的流水账行")
+
+
+def summarize_ledger(path: Path) -> Dict:
+    """流式汇总流水账（内存占用与记录条数无关）"""
+    metrics = RollingMetrics()
+    for record in iter_ledger(path):
+        metrics.record(record)
+    return dict(metrics.snapshot(), recent=list(metrics.recent))
+
+
+def render_summary_sections(summary: Dict, token_limit: Optional[int] = None) -> List[str]:
+    """审计报告：调用统计 + Provider统计（含滚动p50/p95、tokens/min、错误率）"""
+    md = []
+    md.append("## 📊 调用统计\n\n")
+    md.append(f"- **总调用次数**: {summary['total_invocations']}\n")
+    md.append(f"- **成功次数**: {summary['successful_invocations']}\n")
+    md.append(f"- **成功率**: {summary['success_rate']:.1%}\n")
+    limit = f" / {token_limit}" if token_limit else ""
+    md.append(f"- **Token消耗**: {summary['total_tokens_used']}{limit}\n")
+    md.append(f"- **平均延迟**: {summary['average_latency_ms']}ms\n\n")
+
+    md.append("## 🔌 Provider统计\n\n")
+    md.append("| Provider | 调用次数 | 成功次数 | 成功率 | p50延迟 | p95延迟 | tokens/min | 滚动错误率 |\n")
+    md.append("|----------|----------|----------|--------|---------|---------|------------|------------|\n")
+    for provider, ps in summary["provider_stats"].items():
+        rate = ps["success"] / ps["total"] if ps["total"] > 0 else 0
+        md.append(
+            f"| {provider} | {ps['total']} | {ps['success']} | {rate:.1%} | "
+            f"{ps['rolling_p50_latency_ms']}ms | {ps['rolling_p95_latency_ms']}ms | "
+            f"{ps['tokens_per_minute']} | {ps['rolling_error_rate']:.1%} |\n"
+        )
+    md.append("\n")
+    return md
+
+
+def render_coalesce_section(coalesce_stats: Optional[Dict]) -> List[str]:
+    """审计报告：进行中请求合并"""
+    if not coalesce_stats or not coalesce_stats.get("coalesced"):
+        return []
+    md = ["## 🔗 请求合并\n\n"]
+    md.append(f"- **实际调用**: {coalesce_stats['executed']}\n")
+    md.append(f"- **合并请求**: {coalesce_stats['coalesced']}（{coalesce_stats['coalesce_rate']:.1%}）\n")
+    for kind, ks in coalesce_stats["by_kind"].items():
+        md.append(f"- `{kind}`: 调用{ks['executed']}次，合并{ks['coalesced']}次\n")
+    md.append("\n")
+    return md
+
+
+def render_routing_section(routing: Optional[Dict]) -> List[str]:
+    """审计报告：Provider路由与熔断状态（ProviderRouter.snapshot()）"""
+    if not routing or not routing.get("providers"):
+        return []
+    md = ["## 🧭 Provider路由\n\n"]
+    md.append("| Provider | 模型 | 熔断状态 | 窗口调用 | 窗口错误率 | p50延迟 | p95延迟 |\n")
+    md.append("|----------|------|----------|----------|------------|---------|---------|\n")
+    for provider, rs in routing["providers"].items():
+        md.append(
+            f"| {provider} | {rs['model']} | {rs['state']} | {rs['window_calls']} | "
+            f"{rs['window_error_rate']:.1%} | {rs['p50_latency_ms']}ms | {rs['p95_latency_ms']}ms |\n"
+        )
+    md.append("\n**路由决策**:\n\n")
+    for decision, count in sorted(routing["decisions"].items(), key=lambda x: -x[1]):
+        md.append(f"- `{decision}`: {count}次\n")
+    md.append("\n")
+    return md
+
+
+def render_field_stats_section(field_stats: Optional[Dict]) -> List[str]:
+    """审计报告：字段本地提取命中率（FieldHitStats.snapshot()）"""
+    if not field_stats:
+        return []
+    md = ["## 🧩 字段提取命中率\n\n"]
+    md.append("| 字段 | 请求次数 | 本地命中 | 本地命中率 | LLM调用 | LLM命中率 |\n")
+    md.append("|------|----------|----------|------------|---------|-----------|\n")
+    for field_name, fs in field_stats.items():
+        md.append(
+            f"| {field_name} | {fs['requests']} | {fs['local_hits']} | {fs['local_hit_rate']:.1%} | "
+            f"{fs['llm_calls']} | {fs['llm_hit_rate']:.1%} |\n"
+        )
+    md.append("\n")
+    return md
+
+
+def render_estimator_section(estimator: Optional[Dict]) -> List[str]:
+    """审计报告：Token估算校准（TokenEstimator.snapshot()，发送前估算 vs 实际输入token）"""
+    if not estimator or not estimator.get("observations"):
+        return []
+    md = ["## 🧮 Token估算校准\n\n"]
+    md.append(f"- **当前校准系数**: {estimator['scale']}（{estimator['observations']}次观测）\n\n")
+    md.append("| Provider | 观测次数 | 估算输入 | 实际输入 | 实际/估算 | 平均绝对误差 |\n")
+    md.append("|----------|----------|----------|----------|-----------|--------------|\n")
+    for provider, es in estimator["providers"].items():
+        md.append(
+            f"| {provider} | {es['observations']} | {es['estimated_tokens']} | {es['actual_tokens']} | "
+            f"{es['actual_to_estimated']} | {es['mean_abs_error_pct']:.1%} |\n"
+        )
+    md.append("\n")
+    return md
+
+
+def render_detail_sections(summary: Dict) -> List[str]:
+    """审计报告：对冲请求 + 最近调用记录"""
+    md = []
+    hs = summary["hedge_stats"]
+    if hs["hedged_invocations"]:
+        md.append("## 🪂 对冲请求\n\n")
+        md.append(f"- **对冲调用次数**: {hs['hedged_invocations']}\n")
+        md.append(f"- **对冲胜出次数**: {hs['hedge_wins']}\n")
+        md.append(f"- **对冲Token消耗**: {hs['hedged_tokens']}\n")
+        md.append(f"- **落败取消次数**: {hs['cancelled_invocations']}（{hs['cancelled_tokens']} tokens）\n\n")
+
+    md.append(f"## 📋 详细调用记录（最近{RECENT_ROWS}条）\n\n")
+    md.append("| 时间 | Provider | 延迟 | Tokens | 状态 |\n")
+    md.append("|------|----------|------|--------|------|\n")
+    for row in summary.get("recent", []):
+        status = "✅" if row["success"] else f"❌ {(row['error'] or '')[:30]}"
+        if row["hedged"]:
+            status += " 🪂"
+        if row["cancelled"]:
+            status += " (cancelled)"
+        md.append(f"| {row['timestamp']} | {row['provider']} | {row['latency_ms']}ms | {row['total_tokens']} | {status} |\n")
+    return md
+
+
+def render_audit_report(
+    summary: Dict,
+    token_limit: Optional[int] = None,
+    routing: Optional[Dict] = None,
+    field_stats: Optional[Dict] = None,
+    coalesce_stats: Optional[Dict] = None,
+    estimator: Optional[Dict] = None,
+    extra_sections: Optional[List[str]] = None,
+    ledger_name: Optional[str] = None
+) -> str:
+    """
+    AI审计报告（Markdown），批次报告与AIExtractor.generate_audit_report共用
+
+    Args:
+        summary: 调用汇总（summarize_ledger或RollingMetrics快照）
+        routing/field_stats/coalesce_stats/estimator: 对应组件的snapshot()，为空时省略该节
+        extra_sections: 附加章节（如本地分诊）
+    """
+    md = ["# AI调用审计报告\n\n", f"**生成时间**: {datetime.utcnow().isoformat()}Z\n\n"]
+    if ledger_name:
+        md.append(f"**流水账**: `{ledger_name}`\n\n")
+    md.extend(render_summary_sections(summary, token_limit))
+    md.extend(render_routing_section(routing))
+    md.extend(render_field_stats_section(field_stats))
+    md.extend(render_coalesce_section(coalesce_stats))
+    md.extend(render_estimator_section(estimator))
+    md.extend(extra_sections or [])
+    md.extend(render_detail_sections(summary))
+    return "".join(md)
+
+
+def render_ledger_report(path: Path, token_limit: Optional[int] = None, **sections) -> str:
+    """流式读取流水账生成批次AI审计报告（sections参数见render_audit_report）"""
+    return render_audit_report(summarize_ledger(path), token_limit, ledger_name=Path(path).name, **sections)
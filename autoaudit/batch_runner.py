@@ -1,14 +1,28 @@
 import asyncio
 import json
+import os
 import uuid
 from pathlib import Path
 from typing import Dict, List
 
 from .models import BatchRunResult
 from .rule_engine import RuleEngine
-from .storage import RUNS_DIR
+from .storage import RUNS_DIR, write_json
 from .dual_channel_worker import run_site_dual_channel
+from .evidence_capture import capture_site_evidence
+from .playwright_worker import defer_evidence_capture
+from .browser_pool import BrowserPool
+from .image_encoder import shutdown_encoder_pool
+from .fetch_scheduler import HostGate
+from .ai_ledger import InvocationLedger, render_ledger_report
+from .provider_router import ProviderRouter
+from .review_scheduler import ReviewScheduler
+from .singleflight import SingleFlight
+from .triage import SAMPLES_FILENAME, TriageClassifier
 from .reporting import summarize
+from .token_budget import TokenBudget
+from .token_estimator import TokenEstimator
+from .field_extractors import FieldHitStats
 
 
 DEFAULT_SAMPLING = {
@@ -18,6 +32,9 @@ DEFAULT_SAMPLING = {
 }
 
 
+# 同时运行的站点数（浏览器资源与AI预算份额均按此划分）
+SITE_CONCURRENCY = 2
+
 class BatchRunner:
     def __init__(self, rulepack_path: Path, sites: List[Dict], sampling: Dict | None = None):
         self.rulepack_path = rulepack_path
@@ -27,18 +44,92 @@ class BatchRunner:
         self.rulepack_meta = json.loads((rulepack_path / "rulepack.json").read_text(encoding="utf-8"))
         self.batch_id = f"batch_{uuid.uuid4().hex[:8]}"
         (RUNS_DIR / self.batch_id).mkdir(parents=True, exist_ok=True)
+        # ✅ 批次级AI token预算（所有站点共享，实时指标写入ai_budget.json）
+        self.token_budget = TokenBudget(
+            total_tokens=int(os.environ.get("AI_MAX_TOKENS_PER_BATCH", "50000")),
+            site_ids=[site["site_id"] for site in sites],
+            fair_share=os.environ.get("AI_BUDGET_FAIR_SHARE", "true").lower() == "true",
+            metrics_path=RUNS_DIR / self.batch_id / "ai_budget.json",
+            max_concurrent_sites=SITE_CONCURRENCY,
+            min_site_tokens=int(os.environ.get("AI_BUDGET_MIN_SITE_TOKENS", "2000")),
+        )
+        # ✅ 批次级Provider路由（滚动延迟/熔断状态跨站点共享）
+        self.provider_router = ProviderRouter(
+            window=int(os.environ.get("AI_ROUTER_WINDOW", "20")),
+            failure_threshold=int(os.environ.get("AI_CIRCUIT_FAILURE_THRESHOLD", "5")),
+            cooldown_sec=float(os.environ.get("AI_CIRCUIT_COOLDOWN_SEC", "60")),
+        )
+        # ✅ 批次AI调用流水账（每次调用结束即追加到ai_invocations.jsonl）
+        self.ai_ledger = InvocationLedger(RUNS_DIR / self.batch_id / "ai_invocations.jsonl")
+        # ✅ 批次级请求合并（并发站点的相同模板页只调用一次AI）
+        self.ai_singleflight = SingleFlight()
+        # ✅ 批次级token估算校准（各站点的实际用量共同校准估算系数）
+        self.token_estimator = TokenEstimator()
+        # ✅ UNCERTAIN规则本地分诊（复核样本写入ai_review_samples.jsonl供训练）
+        self.triage = TriageClassifier(
+            samples_path=RUNS_DIR / self.batch_id / SAMPLES_FILENAME,
+            threshold=float(os.environ.get("AI_TRIAGE_THRESHOLD", "0.9")),
+            min_content_chars=int(os.environ.get("AI_TRIAGE_MIN_CONTENT_CHARS", "200")),
+        )
+        # ✅ AI复核按价值调度：所有站点评估完成后，按扣分值×严重程度×站点优先级统一复核
+        self.review_scheduler = ReviewScheduler(
+            concurrency=int(os.environ.get("AI_REVIEW_CONCURRENCY", str(SITE_CONCURRENCY))),
+        )
+        # ✅ 批次级浏览器池：固定数量Chromium进程跨站点复用，每站点独立context
+        self.browser_pool = BrowserPool(
+            size=int(os.environ.get("BROWSER_POOL_SIZE", "2")),
+            recycle_after=int(os.environ.get("BROWSER_RECYCLE_AFTER_SITES", "50")),
+        )
+        # ✅ 批次共享的主机限流（同主机的多个站点也遵守per_domain_delay_sec）
+        self.host_gate = HostGate.from_env()
 
     async def run(self) -> BatchRunResult:
         # 并发控制：最多2个并发worker
-        semaphore = asyncio.Semaphore(2)
+        semaphore = asyncio.Semaphore(SITE_CONCURRENCY)
         
         async def process_site(site):
             async with semaphore:
-                return await self._run_site(site)
+                try:
+                    return await self._run_site(site)
+                finally:
+                    # 站点异常退出时也释放其预算份额
+                    self.token_budget.finish_site(site["site_id"])
         
+        # 复核线程在站点评估期间即开始按价值消费复核队列
+        self.review_scheduler.start()
         # 并发执行所有站点
         tasks = [process_site(site) for site in self.sites]
-        site_results = await asyncio.gather(*tasks)
+        try:
+            site_results = await asyncio.gather(*tasks)
+        finally:
+            await self.browser_pool.close()
+            await asyncio.to_thread(shutdown_encoder_pool)
+            write_json(RUNS_DIR / self.batch_id / "browser_pool.json", {
+                **self.browser_pool.snapshot(),
+                "host_gate": self.host_gate.snapshot(),
+            })
+        
+        # ✅ 批次级AI复核：各站点已等待自己的复核完成，这里停止复核线程（结果已原地更新到site_results）
+        await asyncio.to_thread(self.review_scheduler.close)
+        self.token_budget.flush()
+        
+        # ✅ 流式读取流水账生成批次AI审计报告
+        self.ai_ledger.close()
+        if self.ai_ledger.path.exists() or self.triage.snapshot()["triaged"]:
+            (RUNS_DIR / self.batch_id / "ai_audit.md").write_text(
+                render_ledger_report(
+                    self.ai_ledger.path,
+                    self.token_budget.total_tokens,
+                    routing=self.provider_router.snapshot(),
+                    field_stats=FieldHitStats.merge(
+                        (sr.get("coverage_stats") or {}).get("field_extraction") for sr in site_results
+                    ),
+                    coalesce_stats=self.ai_singleflight.snapshot(),
+                    estimator=self.token_estimator.snapshot(),
+                    extra_sections=self.triage.render_section(),
+                ),
+                encoding="utf-8"
+            )
         
         # summarize保持同步（无IO操作）
         summary_paths = summarize(
@@ -67,7 +158,9 @@ class BatchRunner:
             site["site_id"],
             site,
             self.sampling,
-            rules=self.rules  # ✅ 传递规则用于红框标注
+            rules=self.rules,  # ✅ 传递规则用于红框标注
+            browser_pool=self.browser_pool,
+            host_gate=self.host_gate,
         )
         failures = []
         failure_meta = None
@@ -96,8 +189,35 @@ class BatchRunner:
             }
             for res in entry_results + content_results
         ]
-        rule_engine = RuleEngine(self.rules)
-        rule_results = rule_engine.evaluate(pages_payload, failures)
+        rule_engine = RuleEngine(
+            self.rules,
+            budget=self.token_budget,
+            site_id=site["site_id"],
+            router=self.provider_router,
+            ledger=self.ai_ledger,
+            singleflight=self.ai_singleflight,
+            triage=self.triage,
+            review_scheduler=self.review_scheduler,
+            site_priority=site.get("priority"),
+            token_estimator=self.token_estimator,
+        )
+        # 规则评估（含同步AI调用）放到线程中执行，并发站点的AI请求才能真正重叠与合并
+        rule_results = await asyncio.to_thread(rule_engine.evaluate, pages_payload, failures)
+        # 等待本站点的AI复核完成：复核改判为PASS/FAIL的规则也要进入证据截图
+        await asyncio.to_thread(self.review_scheduler.wait_site, site["site_id"])
+        self.token_budget.finish_site(site["site_id"])
+        # ✅ 延迟取证：只为PASS/FAIL证据引用的页面截图（抓取阶段已跳过截图）
+        evidence_stats = None
+        if defer_evidence_capture():
+            evidence_stats = await capture_site_evidence(
+                self.batch_id,
+                site["site_id"],
+                rule_results,
+                self.rules,
+                evidence_cache=rule_engine.evidence_cache,
+                browser_pool=self.browser_pool,
+                host_gate=self.host_gate,
+            )
         # trace已由dual_channel_worker保存
         trace_path = RUNS_DIR / self.batch_id / f"site_{site['site_id']}" / "trace.json"
         coverage_stats = {
@@ -105,6 +225,12 @@ class BatchRunner:
             "content_pages": len(content_results),
             "rules": len(rule_results),
         }
+        if evidence_stats:
+            coverage_stats["evidence_capture"] = evidence_stats
+        # ✅ 字段本地预提取命中率（只有本地提取不到的字段才调用LLM）
+        ai_stats = rule_engine.get_ai_stats()
+        if ai_stats.get("field_stats"):
+            coverage_stats["field_extraction"] = ai_stats["field_stats"]
         return {
             "site_id": site["site_id"],
             "status": status,
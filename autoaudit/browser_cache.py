@@ -0,0 +1,236 @@
+"""
+跨批次的浏览器磁盘缓存（按可注册域名隔离）
+同一门户的CSS/JS/框架包在每个批次都会重复下载；开启后同一可注册域名下的站点使用持久化的
+HTTP磁盘缓存目录（--disk-cache-dir），而Cookie/LocalStorage等仍放在每次新建、用完即删的临时用户目录中，
+不同站点之间只共享缓存、不共享登录态。缓存按域名限制大小，总量超限时按最近使用时间淘汰
+
+注意：Playwright的route拦截会禁用HTTP缓存，缓存模式下请求屏蔽改用CDP Network.setBlockedURLs（仅按主机屏蔽）
+"""
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import Page
+
+from .storage import RUNS_DIR
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows：只在进程内防止同一缓存目录被并发使用
+    fcntl = None
+
+DEFAULT_CACHE_DIR = RUNS_DIR / ".browser_cache"
+LOCK_FILENAME = ".lock"
+LAST_USED_FILENAME = ".last_used"
+
+# 常见的二级公共后缀（gov.cn等），其下一级才是可注册域名
+_SECOND_LEVEL_SUFFIXES = {
+    "gov.cn", "com.cn", "net.cn", "org.cn", "edu.cn", "ac.cn",
+    "gov.hk", "com.hk", "org.hk", "edu.hk", "gov.mo", "gov.tw", "com.tw",
+}
+
+
+def registrable_domain(url: str) -> str:
+    """
+    URL的可注册域名（www.suqian.gov.cn → suqian.gov.cn，fgw.suqian.gov.cn → suqian.gov.cn）
+
+    IP地址与localhost原样返回
+    """
+    host = (urlparse(url).hostname or "").lower().rstrip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or host.replace(".", "").isdigit():
+        return host
+    if ".".join(labels[-2:]) in _SECOND_LEVEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class BrowserDiskCache:
+    """按域名划分的持久化HTTP磁盘缓存目录"""
+
+    def __init__(self, enabled: bool = False, root: Path = DEFAULT_CACHE_DIR,
+                 max_mb_per_domain: int = 200, max_total_mb: int = 2000):
+        """
+        Args:
+            enabled: 是否启用（关闭时站点使用浏览器池的隔离context，缓存只在内存中）
+            root: 缓存根目录（每个可注册域名一个子目录）
+            max_mb_per_domain: 单个域名的缓存上限（传给Chromium的--disk-cache-size，超出时Chromium自行淘汰）
+            max_total_mb: 所有域名缓存总上限（超出时按最近使用时间删除整个域名目录）
+        """
+        self.enabled = enabled
+        self.root = Path(root)
+        self.max_bytes_per_domain = max_mb_per_domain * 1024 * 1024
+        self.max_total_bytes = max_total_mb * 1024 * 1024
+        self._in_use: Dict[str, object] = {}  # domain -> 锁文件句柄
+        self.stats = {"acquired": 0, "busy": 0, "evicted": 0, "evicted_bytes": 0}
+
+    @classmethod
+    def from_env(cls) -> "BrowserDiskCache":
+        return cls(
+            enabled=os.environ.get("BROWSER_DISK_CACHE", "false").lower() == "true",
+            root=Path(os.environ.get("BROWSER_CACHE_DIR", str(DEFAULT_CACHE_DIR))),
+            max_mb_per_domain=int(os.environ.get("BROWSER_CACHE_MAX_MB_PER_DOMAIN", "200")),
+            max_total_mb=int(os.environ.get("BROWSER_CACHE_MAX_TOTAL_MB", "2000")),
+        )
+
+    def cache_dir(self, domain: str) -> Path:
+        return self.root / domain
+
+    def acquire(self, url: str) -> Optional[Path]:
+        """
+        占用url所属域名的缓存目录（Chromium的磁盘缓存不支持多进程同时使用）
+
+        Returns:
+            缓存目录；未启用或目录正被其他站点/进程使用时返回None（调用方退回无持久缓存的context）
+        """
+        if not self.enabled:
+            return None
+        domain = registrable_domain(url) or "_unknown"
+        if domain in self._in_use:
+            self.stats["busy"] += 1
+            return None
+        path = self.cache_dir(domain)
+        path.mkdir(parents=True, exist_ok=True)
+        lock_file = open(path / LOCK_FILENAME, "a+")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                self.stats["busy"] += 1
+                logger.debug(f"缓存目录{path}正被其他进程使用，本站点不使用持久缓存")
+                return None
+        self._in_use[domain] = lock_file
+        (path / LAST_USED_FILENAME).write_text(str(time.time()), encoding="utf-8")
+        self.stats["acquired"] += 1
+        return path
+
+    def release(self, path: Path):
+        """归还缓存目录，并按总量上限淘汰最久未使用的域名"""
+        lock_file = self._in_use.pop(path.name, None)
+        if lock_file is not None:
+            lock_file.close()  # 关闭文件即释放flock
+        self.evict()
+
+    def launch_args(self, path: Path) -> List[str]:
+        return [f"--disk-cache-dir={path}", f"--disk-cache-size={self.max_bytes_per_domain}"]
+
+    def evict(self):
+        """总量超过上限时，按最近使用时间从旧到新删除未被占用的域名目录"""
+        if not self.root.exists():
+            return
+        entries = []
+        for path in self.root.iterdir():
+            if not path.is_dir():
+                continue
+            last_used = path / LAST_USED_FILENAME
+            mtime = last_used.stat().st_mtime if last_used.exists() else path.stat().st_mtime
+            entries.append((mtime, path, _dir_size(path)))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_total_bytes:
+                break
+            if path.name in self._in_use or not self._try_lock(path):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.stats["evicted"] += 1
+            self.stats["evicted_bytes"] += size
+            logger.info(f"浏览器缓存超出总上限，淘汰{path.name}（{size / 1024 / 1024:.1f}MB）")
+
+    @staticmethod
+    def _try_lock(path: Path) -> bool:
+        """确认没有其他进程正在使用该目录（删除前检查）"""
+        if fcntl is None:
+            return True
+        try:
+            with open(path / LOCK_FILENAME, "a+") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def snapshot(self) -> Dict:
+        return {"enabled": self.enabled, "root": str(self.root), **self.stats}
+
+
+class CacheMonitor:
+    """
+    通过每个页面的CDP会话统计缓存命中（fromDiskCache/内存缓存）字节数与网络下载字节数，
+    并在缓存模式下用Network.setBlockedURLs屏蔽统计/客服等主机（不触发route对缓存的禁用）
+    """
+
+    def __init__(self, block_patterns: Optional[List[str]] = None):
+        self.block_patterns = block_patterns or []
+        self._page_totals: Dict[Page, Dict[str, int]] = {}
+        self.totals = {"cache_hits": 0, "cache_hit_bytes": 0, "network_bytes": 0}
+
+    async def attach(self, page: Page):
+        """为新页面建立CDP会话（PagePool新建页面时调用）"""
+        totals = self._page_totals.setdefault(page, {"cache_hits": 0, "cache_hit_bytes": 0, "network_bytes": 0})
+        cached_requests = set()
+
+        def on_response(params: Dict):
+            response = params.get("response", {})
+            if response.get("fromDiskCache") or response.get("fromPrefetchCache"):
+                cached_requests.add(params.get("requestId"))
+
+        def on_served_from_cache(params: Dict):
+            cached_requests.add(params.get("requestId"))
+
+        def on_data(params: Dict):
+            if params.get("requestId") in cached_requests:
+                self._add(totals, "cache_hit_bytes", params.get("dataLength", 0))
+
+        def on_finished(params: Dict):
+            request_id = params.get("requestId")
+            if request_id in cached_requests:
+                cached_requests.discard(request_id)
+                self._add(totals, "cache_hits", 1)
+            else:
+                self._add(totals, "network_bytes", int(params.get("encodedDataLength", 0)))
+
+        try:
+            session = await page.context.new_cdp_session(page)
+            session.on("Network.responseReceived", on_response)
+            session.on("Network.requestServedFromCache", on_served_from_cache)
+            session.on("Network.dataReceived", on_data)
+            session.on("Network.loadingFinished", on_finished)
+            await session.send("Network.enable")
+            if self.block_patterns:
+                await session.send("Network.setBlockedURLs", {"urls": self.block_patterns})
+        except Exception as e:
+            logger.debug(f"缓存统计CDP会话创建失败（忽略）: {e}")
+
+    def _add(self, page_totals: Dict[str, int], key: str, value: int):
+        page_totals[key] += value
+        self.totals[key] += value
+
+    def page_totals(self, page: Page) -> Dict[str, int]:
+        """页面累计统计的副本（fetch前后相减得到单次访问的缓存命中）"""
+        return dict(self._page_totals.get(page) or {"cache_hits": 0, "cache_hit_bytes": 0, "network_bytes": 0})
+
+    def snapshot(self) -> Dict:
+        hit = self.totals["cache_hit_bytes"]
+        network = self.totals["network_bytes"]
+        return {
+            **self.totals,
+            "hit_ratio": round(hit / (hit + network), 3) if hit + network else 0.0,
+        }
@@ -0,0 +1,270 @@
+"""
+批次级Chromium浏览器池
+固定数量的浏览器进程在整个批次内复用，每个站点借出一个全新隔离的BrowserContext
+（Cookie/缓存/存储互不共享）；借出前做健康检查，浏览器服务满N个站点后回收重启，
+避免每站点启动Chromium的开销和长时间运行的内存膨胀
+开启跨批次磁盘缓存（BROWSER_DISK_CACHE）时，站点改用挂载域名缓存目录的独立持久化context
+"""
+import asyncio
+import logging
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from playwright.async_api import Browser, BrowserContext, Playwright, async_playwright
+
+from .browser_cache import BrowserDiskCache
+
+logger = logging.getLogger(__name__)
+
+BROWSER_LAUNCH_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+]
+
+# Context with realistic User Agent and Locale
+CONTEXT_OPTIONS = {
+    "viewport": {'width': 1920, 'height': 1080},
+    "user_agent": 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 GovOpen-AutoAudit/1.0',
+    "locale": 'zh-CN',
+    "timezone_id": 'Asia/Shanghai',
+    "ignore_https_errors": True,  # Government sites often have bad certs
+}
+
+
+async def launch_cached_context(playwright: Playwright, disk_cache: BrowserDiskCache, cache_path: Path,
+                                headless: bool = True) -> Tuple[BrowserContext, str]:
+    """
+    启动挂载域名磁盘缓存的持久化context
+
+    用户目录（Cookie/LocalStorage等）为本次新建的临时目录，只有HTTP缓存目录跨站点、跨批次保留
+
+    Returns:
+        (context, 临时用户目录)；调用方关闭context后删除临时目录
+    """
+    user_data_dir = tempfile.mkdtemp(prefix="autoaudit_profile_")
+    try:
+        context = await playwright.chromium.launch_persistent_context(
+            user_data_dir,
+            headless=headless,
+            args=BROWSER_LAUNCH_ARGS + disk_cache.launch_args(cache_path),
+            **CONTEXT_OPTIONS,
+        )
+    except BaseException:
+        shutil.rmtree(user_data_dir, ignore_errors=True)
+        raise
+    return context, user_data_dir
+
+
+class _BrowserSlot:
+    """池中的一个浏览器进程"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser: Optional[Browser] = None
+        self.active = 0          # 当前借出的context数
+        self.sites_served = 0    # 本进程启动以来服务的站点数
+        self.generation = 0      # 第几次启动（回收/异常重启后递增）
+
+    def healthy(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+
+class BrowserPool:
+    """固定大小的浏览器池（单事件循环内使用）"""
+
+    def __init__(self, size: int = 2, recycle_after: int = 50, headless: bool = True,
+                 disk_cache: Optional[BrowserDiskCache] = None):
+        """
+        Args:
+            size: 浏览器进程数（建议与站点并发数一致）
+            recycle_after: 每个浏览器服务满N个站点后，在空闲时关闭并重新启动（<=0不回收）
+            headless: 是否无头模式
+            disk_cache: 跨批次磁盘缓存（启用时site_context传入url的站点使用域名缓存context）
+        """
+        self.size = max(1, size)
+        self.recycle_after = recycle_after
+        self.headless = headless
+        self._playwright = None
+        self._slots: List[_BrowserSlot] = [_BrowserSlot(i) for i in range(self.size)]
+        self._lock = asyncio.Lock()
+        self._closed = False
+        self.disk_cache = disk_cache or BrowserDiskCache.from_env()
+        self._cached_contexts: Dict[BrowserContext, Path] = {}
+        self.stats = {
+            "launches": 0,
+            "launch_sec": 0.0,
+            "recycled": 0,
+            "unhealthy_restarts": 0,
+            "contexts": 0,
+            "context_failures": 0,
+            "cached_contexts": 0,
+        }
+
+    async def _ensure_playwright(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+
+    async def _launch(self, slot: _BrowserSlot, reason: str):
+        """（重新）启动slot对应的浏览器进程；调用方需持有self._lock"""
+        if slot.browser is not None:
+            try:
+                await slot.browser.close()
+            except Exception as e:
+                logger.debug(f"关闭浏览器#{slot.index}失败（忽略）: {e}")
+        await self._ensure_playwright()
+        start = time.time()
+        slot.browser = await self._playwright.chromium.launch(
+            headless=self.headless,
+            args=BROWSER_LAUNCH_ARGS,
+        )
+        elapsed = time.time() - start
+        slot.sites_served = 0
+        slot.generation += 1
+        self.stats["launches"] += 1
+        self.stats["launch_sec"] += elapsed
+        logger.info(f"浏览器池: 启动浏览器#{slot.index}（{reason}，第{slot.generation}代，耗时{elapsed:.2f}s）")
+
+    def _draining(self, slot: _BrowserSlot) -> bool:
+        return self.recycle_after > 0 and slot.sites_served >= self.recycle_after and slot.active > 0
+
+    async def _checkout(self) -> _BrowserSlot:
+        """选择负载最低的浏览器，必要时先做健康检查重启或回收"""
+        async with self._lock:
+            if self._closed:
+                raise RuntimeError("BrowserPool已关闭")
+            # 待回收且仍在使用中的浏览器不再借出新站点（排空后回收），除非所有浏览器都在排空
+            slot = min(self._slots, key=lambda s: (self._draining(s), s.active, s.sites_served))
+            if slot.browser is None:
+                await self._launch(slot, "首次使用")
+            elif not slot.healthy():
+                self.stats["unhealthy_restarts"] += 1
+                await self._launch(slot, "健康检查失败")
+            elif self.recycle_after > 0 and slot.sites_served >= self.recycle_after and slot.active == 0:
+                self.stats["recycled"] += 1
+                await self._launch(slot, f"已服务{slot.sites_served}个站点，回收")
+            slot.active += 1
+            slot.sites_served += 1
+            return slot
+
+    async def _new_context(self, slot: _BrowserSlot) -> BrowserContext:
+        """创建隔离context；浏览器已失联时重启一次再试"""
+        try:
+            return await slot.browser.new_context(**CONTEXT_OPTIONS)
+        except Exception as e:
+            self.stats["context_failures"] += 1
+            logger.warning(f"浏览器#{slot.index}创建context失败({e})，重启后重试")
+            async with self._lock:
+                if not slot.healthy():
+                    self.stats["unhealthy_restarts"] += 1
+                    await self._launch(slot, "创建context失败")
+            return await slot.browser.new_context(**CONTEXT_OPTIONS)
+
+    def is_disk_cached(self, context: BrowserContext) -> bool:
+        """context是否挂载了持久磁盘缓存（此时不能使用route拦截，否则缓存被禁用）"""
+        return context in self._cached_contexts
+
+    @asynccontextmanager
+    async def site_context(self, site_id: str = "", url: Optional[str] = None) -> AsyncIterator[BrowserContext]:
+        """
+        为一个站点借出全新的BrowserContext，退出时关闭context并归还浏览器
+
+        Args:
+            url: 站点地址；启用磁盘缓存且该域名缓存目录空闲时，改为启动挂载缓存的独立context
+
+        用法:
+            async with pool.site_context(site_id) as context:
+                page = await context.new_page()
+        """
+        cache_path = self.disk_cache.acquire(url) if url else None
+        if cache_path is not None:
+            async with self._cached_site_context(site_id, cache_path) as context:
+                yield context
+            return
+
+        slot = await self._checkout()
+        context = None
+        try:
+            context = await self._new_context(slot)
+            self.stats["contexts"] += 1
+            logger.debug(f"浏览器池: 站点{site_id}使用浏览器#{slot.index}（第{slot.generation}代）")
+            yield context
+        finally:
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as e:
+                    logger.debug(f"关闭站点{site_id}的context失败（忽略）: {e}")
+            slot.active -= 1
+
+    @asynccontextmanager
+    async def _cached_site_context(self, site_id: str, cache_path: Path) -> AsyncIterator[BrowserContext]:
+        context = None
+        user_data_dir = None
+        try:
+            async with self._lock:
+                if self._closed:
+                    raise RuntimeError("BrowserPool已关闭")
+                await self._ensure_playwright()
+            context, user_data_dir = await launch_cached_context(
+                self._playwright, self.disk_cache, cache_path, self.headless
+            )
+            self._cached_contexts[context] = cache_path
+            self.stats["cached_contexts"] += 1
+            logger.debug(f"浏览器池: 站点{site_id}使用磁盘缓存{cache_path.name}")
+            yield context
+        finally:
+            if context is not None:
+                self._cached_contexts.pop(context, None)
+                try:
+                    await context.close()
+                except Exception as e:
+                    logger.debug(f"关闭站点{site_id}的缓存context失败（忽略）: {e}")
+            if user_data_dir:
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+            # 淘汰检查需遍历缓存目录，放到线程中执行
+            await asyncio.to_thread(self.disk_cache.release, cache_path)
+
+    async def close(self):
+        """关闭所有浏览器进程与Playwright"""
+        async with self._lock:
+            self._closed = True
+            for slot in self._slots:
+                if slot.browser is not None:
+                    try:
+                        await slot.browser.close()
+                    except Exception as e:
+                        logger.debug(f"关闭浏览器#{slot.index}失败（忽略）: {e}")
+                    slot.browser = None
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    async def __aenter__(self) -> "BrowserPool":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def snapshot(self) -> Dict:
+        return {
+            "size": self.size,
+            "recycle_after": self.recycle_after,
+            **self.stats,
+            "disk_cache": self.disk_cache.snapshot(),
+            "launch_sec": round(self.stats["launch_sec"], 2),
+            "browsers": [
+                {
+                    "index": slot.index,
+                    "generation": slot.generation,
+                    "active": slot.active,
+                    "sites_served": slot.sites_served,
+                    "connected": slot.healthy(),
+                }
+                for slot in self._slots
+            ],
+        }
@@ -0,0 +1,196 @@
+"""
+证据截图策略
+full: 整页截图（图例插在页面顶部）；clip: 只截取包含所有编号框的区域加边距（图例叠加在区域上方），
+另存一张按比例缩小的整页缩略图提供上下文。长列表页的整页JPEG常达数MB，裁剪后截图耗时与存储大幅下降
+超过max_capture_height的超长页面不再整页截图（渲染进程内存暴涨甚至崩溃，图片也无法阅读），
+按tiles模式截取有限个分块，或按top模式只截取页面顶部
+"""
+import math
+import base64
+import logging
+import os
+from typing import Dict, List, Optional
+
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_FULL = "full"
+CAPTURE_CLIP = "clip"
+
+TALL_TILES = "tiles"
+TALL_TOP = "top"
+
+_PAGE_SIZE_JS = """
+() => {
+    const root = document.documentElement;
+    const body = document.body || root;
+    return [Math.max(root.scrollWidth, body.scrollWidth), Math.max(root.scrollHeight, body.scrollHeight)];
+}
+"""
+
+
+class CapturePolicy:
+    """证据截图参数"""
+
+    def __init__(self, mode: str = CAPTURE_CLIP, margin: int = 80, clip_max_height: int = 3000,
+                 thumbnail: bool = True, thumbnail_width: int = 320, thumbnail_max_height: int = 8000,
+                 max_capture_height: int = 10000, tall_page_mode: str = TALL_TILES, tile_height: int = 4000,
+                 max_tiles: int = 3):
+        """
+        Args:
+            mode: full | clip
+            margin: 裁剪区域在编号框外保留的边距（像素）
+            clip_max_height: 裁剪区域最大高度（编号框分散在长页面各处时从最上方截取）
+            thumbnail: clip模式下是否保存整页缩略图
+            thumbnail_width: 缩略图宽度（按页面宽度等比缩放）
+            thumbnail_max_height: 缩略图覆盖的页面最大高度（超长页面只缩略顶部）
+            max_capture_height: 单张截图的最大像素高度（整页截图超过时按tall_page_mode处理）
+            tall_page_mode: tiles=从顶部起截取最多max_tiles个tile_height高的分块；top=只截取顶部max_capture_height
+            tile_height: 分块高度
+            max_tiles: 分块数上限（超出部分不截图，元数据中标记truncated）
+        """
+        self.mode = mode if mode in (CAPTURE_FULL, CAPTURE_CLIP) else CAPTURE_CLIP
+        self.margin = margin
+        self.clip_max_height = clip_max_height
+        self.thumbnail = thumbnail
+        self.thumbnail_width = thumbnail_width
+        self.thumbnail_max_height = thumbnail_max_height
+        self.max_capture_height = max(1, max_capture_height)
+        self.tall_page_mode = tall_page_mode if tall_page_mode in (TALL_TILES, TALL_TOP) else TALL_TILES
+        self.tile_height = max(1, min(tile_height, self.max_capture_height))
+        self.max_tiles = max(1, max_tiles)
+
+    @classmethod
+    def from_env(cls) -> "CapturePolicy":
+        return cls(
+            mode=os.environ.get("EVIDENCE_CAPTURE_MODE", CAPTURE_CLIP).lower(),
+            margin=int(os.environ.get("EVIDENCE_CLIP_MARGIN", "80")),
+            clip_max_height=int(os.environ.get("EVIDENCE_CLIP_MAX_HEIGHT", "3000")),
+            thumbnail=os.environ.get("EVIDENCE_THUMBNAIL", "true").lower() == "true",
+            thumbnail_width=int(os.environ.get("EVIDENCE_THUMBNAIL_WIDTH", "320")),
+            max_capture_height=int(os.environ.get("EVIDENCE_MAX_CAPTURE_HEIGHT", "10000")),
+            tall_page_mode=os.environ.get("EVIDENCE_TALL_PAGE_MODE", TALL_TILES).lower(),
+            tile_height=int(os.environ.get("EVIDENCE_TILE_HEIGHT", "4000")),
+            max_tiles=int(os.environ.get("EVIDENCE_MAX_TILES", "3")),
+        )
+
+    def plan_tiles(self, page_size: List[int]) -> List[Dict]:
+        """
+        整页截图的分块方案（页面坐标的clip列表）
+
+        页面不超过max_capture_height时返回覆盖整页的单个区域；
+        否则tiles模式返回从顶部起最多max_tiles个分块，top模式返回顶部max_capture_height的单个区域
+        """
+        page_w, page_h = page_size
+        if page_h <= self.max_capture_height:
+            return [{"x": 0, "y": 0, "width": page_w, "height": page_h}]
+        if self.tall_page_mode == TALL_TOP:
+            return [{"x": 0, "y": 0, "width": page_w, "height": self.max_capture_height}]
+        count = min(self.max_tiles, math.ceil(page_h / self.tile_height))
+        return [
+            {"x": 0, "y": i * self.tile_height, "width": page_w,
+             "height": min(self.tile_height, page_h - i * self.tile_height)}
+            for i in range(count)
+        ]
+
+
+def clip_rect(layout: Dict, margin: int, max_height: int, viewport: Dict) -> Dict:
+    """
+    计算裁剪区域：覆盖图例与所有编号框并外扩margin，限制在页面范围和最大高度内
+
+    无编号框时（如FAIL规则的关键词缺失）截取页面顶部一屏
+    """
+    page_w, page_h = layout.get("page") or [viewport["width"], viewport["height"]]
+    rects = [box for region in layout.get("regions", {}).values() for box in region.get("boxes", [])]
+    if not rects:
+        return {"x": 0, "y": 0, "width": page_w, "height": min(page_h, viewport["height"])}
+    if layout.get("legend"):
+        rects.append(layout["legend"])
+
+    x0 = max(0, min(r[0] for r in rects) - margin)
+    y0 = max(0, min(r[1] for r in rects) - margin)
+    x1 = min(page_w, max(r[0] + r[2] for r in rects) + margin)
+    y1 = min(page_h, max(r[1] + r[3] for r in rects) + margin, y0 + max_height)
+    return {"x": x0, "y": y0, "width": max(1, x1 - x0), "height": max(1, y1 - y0)}
+
+
+async def measure_page(page: Page) -> List[int]:
+    """页面的[宽, 高]（scrollWidth/scrollHeight）"""
+    return await page.evaluate(_PAGE_SIZE_JS)
+
+
+def to_image_coords(regions: Dict[str, Dict], clip: Optional[Dict]) -> Dict[str, Dict]:
+    """
+    把整页坐标的编号框换算为截图图片内坐标
+
+    编号框跨度超过clip_max_height时部分框落在裁剪区域外：完全在外的框丢弃、
+    部分在外的框裁到图片范围内，分别计入region的uncaptured/clamped
+    """
+    if not clip:
+        return regions
+    converted = {}
+    for rule_id, region in regions.items():
+        boxes, uncaptured, clamped = [], 0, 0
+        for box in region.get("boxes", []):
+            x0 = max(box[0] - clip["x"], 0)
+            y0 = max(box[1] - clip["y"], 0)
+            x1 = min(box[0] + box[2] - clip["x"], clip["width"])
+            y1 = min(box[1] + box[3] - clip["y"], clip["height"])
+            if x1 <= x0 or y1 <= y0:
+                uncaptured += 1
+                continue
+            if [x0, y0, x1 - x0, y1 - y0] != [box[0] - clip["x"], box[1] - clip["y"], box[2], box[3]]:
+                clamped += 1
+            boxes.append([x0, y0, x1 - x0, y1 - y0])
+        converted[rule_id] = dict(region, boxes=boxes, uncaptured=uncaptured, clamped=clamped)
+    return converted
+
+
+def to_tile_coords(regions: Dict[str, Dict], tiles: List[Dict]) -> Dict[str, Dict]:
+    """
+    把整页坐标的编号框换算为分块截图内坐标：{"tile": 分块编号, "x", "y", "width", "height"}
+
+    编号框归入其顶边所在的分块，跨越分块下边界的部分被裁掉（计入clamped）；
+    顶边落在最后一个分块之后（页面被截断）的框丢弃并计入uncaptured
+    """
+    converted = {}
+    for rule_id, region in regions.items():
+        boxes, uncaptured, clamped = [], 0, 0
+        for box in region.get("boxes", []):
+            tile = next((t for t in tiles if t["y"] <= box[1] < t["y"] + t["height"]), None)
+            if tile is None:
+                uncaptured += 1
+                continue
+            y = box[1] - tile["y"]
+            height = min(box[3], tile["height"] - y)
+            if height < box[3]:
+                clamped += 1
+            boxes.append({"tile": tile["index"], "x": box[0], "y": y, "width": box[2], "height": height})
+        converted[rule_id] = dict(region, boxes=boxes, uncaptured=uncaptured, clamped=clamped)
+    return converted
+
+
+async def capture_thumbnail(page: Page, page_size: List[int], width: int, max_height: int,
+                            fmt: str = "jpeg", quality: int = 80) -> bytes:
+    """
+    整页缩略图：通过CDP的clip.scale在浏览器内缩放，不需要先生成原尺寸整页图再缩小
+
+    Args:
+        fmt: jpeg | png（png交给ImageEncoder转码）
+    """
+    page_w, page_h = page_size
+    scale = min(1.0, width / max(page_w, 1))
+    params = {
+        "format": fmt,
+        "captureBeyondViewport": True,
+        "clip": {"x": 0, "y": 0, "width": page_w, "height": min(page_h, max_height), "scale": scale},
+    }
+    if fmt == "jpeg":
+        params["quality"] = quality
+    session = await page.context.new_cdp_session(page)
+    try:
+        result = await session.send("Page.captureScreenshot", params)
+    finally:
+        await session.detach()
+    return base64.b64decode(result["data"])
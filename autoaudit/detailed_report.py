@@ -51,7 +51,10 @@ class DetailedReportGenerator:
                     trace = json.load(f)
                 self.rule_results[site_id] = {
                     "trace": trace,
-                    "screenshots": list(site_dir.glob("screenshot_*.jpg")),
+                    "screenshots": [
+                        path for path in site_dir.glob("screenshot_*.*")
+                        if path.suffix in (".webp", ".avif", ".jpg")
+                    ],
                     "dir": site_dir
                 }
     
@@ -1,7 +1,9 @@
 import asyncio
 import logging
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 from .worker import BrowserWorker, FetchResult
+from .browser_pool import BrowserPool
+from .fetch_scheduler import HostGate
 from .playwright_worker import PlaywrightBrowserWorker
 
 logger = logging.getLogger(__name__)
@@ -32,7 +34,9 @@ async def run_site_dual_channel(
     site: Dict,
     sampling: Dict,
     extra_depth: int = 0,
-    rules: List[Dict] = None  # ✅ 新增：传递规则信息用于红框标注
+    rules: List[Dict] = None,  # ✅ 新增：传递规则信息用于红框标注
+    browser_pool: Optional[BrowserPool] = None,  # ✅ 批次级浏览器池（为None时自行启动浏览器）
+    host_gate: Optional[HostGate] = None  # ✅ 批次共享的主机限流（为None时站点内独立限流）
 ) -> Tuple[List[FetchResult], List[FetchResult]]:
     """双通道抓取：Playwright优先（规避反爬虫），静态兜底"""
     
@@ -41,7 +45,7 @@ async def run_site_dual_channel(
     
     try:
         # 1. 优先使用Playwright（真实浏览器）
-        pw_worker = PlaywrightBrowserWorker(batch_id, site_id)
+        pw_worker = PlaywrightBrowserWorker(batch_id, site_id, pool=browser_pool, host_gate=host_gate)
         entry_pw, content_pw = await pw_worker.run_site(site, sampling, extra_depth)
         logger.info(f"Site {site_id}: Playwright执行成功，获取{len(entry_pw)}个入口页，{len(content_pw)}个内容页")
         return entry_pw, content_pw
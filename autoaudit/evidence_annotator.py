@@ -0,0 +1,185 @@
+"""
+证据页面合并标注
+同一页面上的多条PASS/FAIL规则一次性标注：每条规则的匹配元素画上带编号的框（FAIL红、PASS绿），
+页面顶部插入图例说明编号对应的rule_id；返回每条规则在整页截图中的区域坐标
+"""
+import logging
+from typing import Dict, List
+
+from playwright.async_api import Page
+
+logger = logging.getLogger(__name__)
+
+MAX_BOXES_PER_RULE = 5
+LEGEND_BLOCK = "block"
+LEGEND_OVERLAY = "overlay"
+LEGEND_TEXT_LIMIT = 40
+
+# 标注脚本：block模式先把图例插入页面顶部（改变布局）再计算坐标；overlay模式（裁剪截图）
+# 在所有编号框上方叠加图例（不改变布局）。编号框均为绝对定位的叠加层
+_ANNOTATE_JS = """
+([items, maxBoxes, legendMode, margin]) => {
+    const COLORS = {FAIL: '#e53935', PASS: '#43a047'};
+    const Z = '2147483647';
+    const root = document.documentElement;
+    const body = document.body || root;
+
+    const legend = document.createElement('div');
+    legend.setAttribute('data-auto-audit', 'legend');
+    legend.style.cssText = 'all:initial;display:block;box-sizing:border-box;width:100%;padding:8px 12px;'
+        + 'background:#fffbe6;border-bottom:2px solid #333;font:14px/1.6 sans-serif;color:#000;'
+        + 'position:relative;z-index:' + Z + ';';
+    const title = document.createElement('div');
+    title.style.cssText = 'font-weight:bold;';
+    title.textContent = 'GovOpen-AutoAudit 证据标注';
+    legend.appendChild(title);
+    for (const item of items) {
+        const line = document.createElement('div');
+        line.style.cssText = 'color:' + (COLORS[item.status] || '#333') + ';';
+        line.textContent = item.index + '. [' + item.status + '] ' + item.rule_id + (item.label ? ' ' + item.label : '');
+        legend.appendChild(line);
+    }
+    if (legendMode === 'block') {
+        body.insertBefore(legend, body.firstChild);
+    }
+
+    const inLegend = el => legend.contains(el);
+    const visible = el => {
+        const r = el.getBoundingClientRect();
+        return r.width > 0 && r.height > 0;
+    };
+    const findElements = item => {
+        let found = [];
+        if (item.selector) {
+            try { found = Array.from(document.querySelectorAll(item.selector)); } catch (e) { found = []; }
+        } else if (item.keywords && item.keywords.length) {
+            const seen = new Set();
+            const walker = document.createTreeWalker(body, NodeFilter.SHOW_TEXT);
+            while (walker.nextNode()) {
+                const node = walker.currentNode;
+                const parent = node.parentElement;
+                if (!parent || seen.has(parent) || inLegend(parent)) continue;
+                if (item.keywords.some(kw => node.textContent.includes(kw))) {
+                    seen.add(parent);
+                    found.push(parent);
+                }
+            }
+        }
+        return found.filter(el => !inLegend(el) && visible(el));
+    };
+
+    const regions = {};
+    const all = [];
+    for (const item of items) {
+        const color = COLORS[item.status] || '#333';
+        const elements = findElements(item);
+        const boxes = [];
+        for (const el of elements.slice(0, maxBoxes)) {
+            const r = el.getBoundingClientRect();
+            const box = [
+                Math.round(r.left + window.scrollX), Math.round(r.top + window.scrollY),
+                Math.round(r.width), Math.round(r.height),
+            ];
+            boxes.push(box);
+            all.push(box);
+            const frame = document.createElement('div');
+            frame.setAttribute('data-auto-audit', 'box');
+            frame.style.cssText = 'all:initial;position:absolute;box-sizing:border-box;pointer-events:none;'
+                + 'z-index:' + Z + ';border:3px solid ' + color + ';background:' + color + '1a;'
+                + 'left:' + (box[0] - 3) + 'px;top:' + (box[1] - 3) + 'px;'
+                + 'width:' + (box[2] + 6) + 'px;height:' + (box[3] + 6) + 'px;';
+            const badge = document.createElement('div');
+            badge.style.cssText = 'all:initial;position:absolute;left:-3px;top:-22px;padding:0 6px;'
+                + 'background:' + color + ';color:#fff;font:bold 13px/19px sans-serif;';
+            badge.textContent = String(item.index);
+            frame.appendChild(badge);
+            root.appendChild(frame);
+        }
+        regions[item.rule_id] = {index: item.index, boxes: boxes, matched: elements.length};
+    }
+
+    const pageWidth = Math.max(root.scrollWidth, body.scrollWidth);
+    let legendRect;
+    if (legendMode === 'block') {
+        const r = legend.getBoundingClientRect();
+        legendRect = [Math.round(r.left + window.scrollX), Math.round(r.top + window.scrollY), Math.round(r.width), Math.round(r.height)];
+    } else {
+        // 图例叠加在所有编号框的正上方；上方空间不足时放到编号框下方，避免盖住被标注的元素
+        // （无匹配元素时置于页面顶部）
+        let left = 0, top = 0, bottom = 0, width = Math.min(pageWidth, 800);
+        if (all.length) {
+            const minX = Math.min(...all.map(b => b[0]));
+            const maxX = Math.max(...all.map(b => b[0] + b[2]));
+            const minY = Math.min(...all.map(b => b[1]));
+            bottom = Math.max(...all.map(b => b[1] + b[3])) + margin;
+            left = Math.max(0, minX - margin);
+            width = Math.max(Math.min(maxX - minX + 2 * margin, pageWidth - left), Math.min(400, pageWidth - left));
+            top = minY - margin;
+        }
+        legend.style.position = 'absolute';
+        legend.style.left = left + 'px';
+        legend.style.width = width + 'px';
+        legend.style.border = '2px solid #333';
+        root.appendChild(legend);
+        const height = Math.ceil(legend.getBoundingClientRect().height);
+        top = all.length && top - height - 24 < 0 ? bottom + 8 : Math.max(0, top - height - 24);
+        legend.style.top = top + 'px';
+        legendRect = [left, top, width, height];
+    }
+    return {
+        regions: regions,
+        legend: legendRect,
+        page: [pageWidth, Math.max(root.scrollHeight, body.scrollHeight)],
+    };
+}
+"""
+
+
+def build_annotations(items: List[Dict]) -> List[Dict]:
+    """
+    生成标注项：FAIL在前、PASS在后，按顺序编号
+
+    Args:
+        items: [{"rule_id", "status", "locator", "label"}, ...]
+    """
+    ordered = sorted(items, key=lambda item: (item.get("status") != "FAIL", str(item.get("rule_id"))))
+    annotations = []
+    for index, item in enumerate(ordered, start=1):
+        locator = item.get("locator") or {}
+        label = str(item.get("label") or "")
+        annotations.append({
+            "index": index,
+            "rule_id": item.get("rule_id"),
+            "status": item.get("status"),
+            "selector": locator.get("selector"),
+            "keywords": locator.get("keywords") if "selector" not in locator else None,
+            "label": label[:LEGEND_TEXT_LIMIT],
+        })
+    return annotations
+
+
+async def annotate_page(page: Page, annotations: List[Dict], legend_mode: str = LEGEND_BLOCK,
+                        margin: int = 0) -> Dict:
+    """
+    在页面上一次性绘制所有规则的编号框与图例
+
+    Args:
+        legend_mode: block=图例插入页面顶部（整页截图）；overlay=图例叠加在编号框上方，上方空间不足时在下方（裁剪截图）
+        margin: overlay模式下图例与编号框之间预留的边距
+
+    Returns:
+        {
+            "regions": rule_id -> {"index": 编号, "boxes": [[x, y, w, h], ...]（整页坐标）, "matched": 匹配元素数},
+            "legend": 图例的[x, y, w, h],
+            "page": 页面的[宽, 高],
+        }
+    """
+    if not annotations:
+        return {"regions": {}, "legend": None, "page": None}
+    layout = await page.evaluate(_ANNOTATE_JS, [annotations, MAX_BOXES_PER_RULE, legend_mode, margin])
+    regions = layout["regions"]
+    logger.info(
+        f"合并标注{len(annotations)}条规则，"
+        f"定位到{sum(1 for r in regions.values() if r.get('boxes'))}条: {page.url}"
+    )
+    return layout
@@ -0,0 +1,122 @@
+"""
+延迟取证阶段
+抓取阶段默认不截图；规则评估完成后，只重新访问PASS/FAIL结果evidence_ids引用的页面，
+按页面合并：同一页面上所有规则一次标注（编号框+图例）、一次截图，
+截图路径、各规则在图中的区域等截图信息回填到规则结果（随结果落盘）；
+内存中的Evidence对象只同步截图路径与是否成功标注
+"""
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .browser_pool import BrowserPool
+from .evidence_annotator import build_annotations
+from .fetch_scheduler import HostGate
+from .models import EvidenceCache
+from .playwright_worker import PlaywrightBrowserWorker
+
+logger = logging.getLogger(__name__)
+
+EVIDENCE_STATUSES = {"PASS", "FAIL"}
+
+
+def collect_targets(rule_results: List[Dict], rules_by_id: Dict[str, Dict]) -> List[Dict]:
+    """
+    按matched_url分组收集需要截图的证据页面（PASS/FAIL且引用了证据的结果）
+
+    Returns:
+        [{"url": str, "annotations": [...], "results": [rule_result, ...]}, ...]
+    """
+    pages: Dict[str, List[Dict]] = {}
+    for result in rule_results:
+        if result.get("status") not in EVIDENCE_STATUSES or not result.get("evidence_ids"):
+            continue
+        url = result.get("matched_url")
+        if url:
+            pages.setdefault(url, []).append(result)
+
+    targets = []
+    for url, results in pages.items():
+        items = []
+        for result in results:
+            rule = rules_by_id.get(result.get("rule_id")) or {}
+            items.append({
+                "rule_id": result.get("rule_id"),
+                "status": result.get("status"),
+                "locator": rule.get("locator"),
+                "label": result.get("element") or rule.get("description", ""),
+            })
+        targets.append({"url": url, "annotations": build_annotations(items), "results": results})
+    return targets
+
+
+async def capture_site_evidence(
+    batch_id: str,
+    site_id: str,
+    rule_results: List[Dict],
+    rules: List[Dict],
+    evidence_cache: Optional[EvidenceCache] = None,
+    browser_pool: Optional[BrowserPool] = None,
+    host_gate: Optional[HostGate] = None,
+) -> Dict:
+    """
+    为站点的证据页面截图，截图信息原地写入rule_results（screenshot/evidence_region等字段）
+
+    Returns:
+        统计信息 {"targets": 页面数, "captured", "failed", "rules": 覆盖的规则结果数}
+    """
+    rules_by_id = {rule.get("rule_id"): rule for rule in rules}
+    targets = collect_targets(rule_results, rules_by_id)
+    stats = {"targets": len(targets), "rules": sum(len(t["results"]) for t in targets), "captured": 0, "failed": 0}
+    if not targets:
+        return stats
+
+    logger.info(f"Site {site_id}: 证据阶段为{stats['targets']}个页面截图（覆盖{stats['rules']}条规则结果）")
+    worker = PlaywrightBrowserWorker(batch_id, site_id, pool=browser_pool, host_gate=host_gate)
+    try:
+        fetched = await worker.capture_evidence(targets)
+    except Exception as e:
+        logger.warning(f"Site {site_id}: 证据阶段截图失败({e})，规则结果保留无截图的证据")
+        stats["failed"] = len(targets)
+        return stats
+
+    for target, res in zip(targets, fetched):
+        # 截图在后台编码，编码失败时文件不存在
+        if not res.screenshot or not Path(res.screenshot).exists():
+            stats["failed"] += 1
+            continue
+        stats["captured"] += 1
+        regions = getattr(res, "regions", None) or {}
+        for result in target["results"]:
+            region = regions.get(result.get("rule_id")) or {}
+            result["screenshot"] = res.screenshot
+            result["evidence_region"] = {
+                "index": region.get("index"),
+                "boxes": region.get("boxes", []),
+                # 未出现在截图中的编号框数（超出裁剪范围或位于超长页面截断部分）
+                "uncaptured": region.get("uncaptured", 0),
+            }
+            result["shared_capture"] = len(target["results"]) > 1
+            result["highlight_applied"] = bool(region.get("boxes"))
+            clip = getattr(res, "clip", None)
+            if clip:
+                result["capture_clip"] = clip
+            thumbnail = getattr(res, "thumbnail", None)
+            if thumbnail:
+                result["thumbnail"] = thumbnail
+            tiles = getattr(res, "tiles", None)
+            if tiles:
+                # 超长页面分块截图：screenshot只是第0块，编号框坐标对应各自的分块
+                result["tiles"] = tiles
+                result["page_height"] = getattr(res, "page_height", None)
+                result["truncated"] = getattr(res, "truncated", False)
+            if evidence_cache is None:
+                continue
+            evidence = evidence_cache.get(result.get("rule_id"), target["url"])
+            if evidence is not None:
+                evidence.metadata = dict(
+                    evidence.metadata or {},
+                    screenshot=res.screenshot,
+                    highlight_applied=result["highlight_applied"],
+                )
+    return stats
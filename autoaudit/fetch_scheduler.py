@@ -0,0 +1,108 @@
+"""
+站点内并发抓取调度
+入口页、深度导航链接、抽样内容页彼此独立，按最多K个页面并发抓取；
+同一主机的访问受并发上限和访问间隔（docs/04_EXECUTION_POLICY.md 的 per_domain_delay_sec）约束，
+在提升吞吐的同时不对脆弱的政务服务器造成压力
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def host_of(url: str) -> str:
+    return (urlparse(url).hostname or "").lower()
+
+
+class HostGate:
+    """
+    按主机限流：每个主机最多per_host_limit个请求同时进行，
+    且相邻两次请求的开始时间至少间隔delay_sec（可加随机抖动）
+
+    可在批次内跨站点共享（同一城市的部门网站常部署在同一主机上）
+    """
+
+    def __init__(self, per_host_limit: int = 2, delay_sec: float = 2.0, jitter_sec: float = 0.0):
+        self.per_host_limit = max(1, per_host_limit)
+        self.delay_sec = max(0.0, delay_sec)
+        self.jitter_sec = max(0.0, jitter_sec)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._next_start: Dict[str, float] = {}
+        self.stats = {"requests": 0, "delayed": 0, "wait_sec": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "HostGate":
+        return cls(
+            per_host_limit=int(os.environ.get("PER_HOST_CONCURRENCY", "2")),
+            delay_sec=float(os.environ.get("PER_DOMAIN_DELAY_SEC", "2")),
+            jitter_sec=float(os.environ.get("PER_DOMAIN_DELAY_JITTER_SEC", "0")),
+        )
+
+    def _reserve_start(self, host: str) -> float:
+        """预约该主机下一次请求的开始时间（无await，单事件循环内原子）"""
+        now = time.monotonic()
+        start = max(now, self._next_start.get(host, 0.0))
+        self._next_start[host] = start + self.delay_sec + random.uniform(0, self.jitter_sec)
+        return start - now
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """占用url所在主机的一个访问名额（进入时按需等待访问间隔）"""
+        host = host_of(url)
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+        async with semaphore:
+            wait = self._reserve_start(host)
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["delayed"] += 1
+                self.stats["wait_sec"] += wait
+                logger.debug(f"主机{host}访问间隔限制，等待{wait:.2f}s")
+                await asyncio.sleep(wait)
+            yield
+
+    def snapshot(self) -> Dict:
+        return {
+            "per_host_limit": self.per_host_limit,
+            "delay_sec": self.delay_sec,
+            "hosts": len(self._semaphores),
+            "requests": self.stats["requests"],
+            "delayed": self.stats["delayed"],
+            "wait_sec": round(self.stats["wait_sec"], 2),
+        }
+
+
+class FetchScheduler:
+    """单个站点的并发抓取调度（站点级并发上限 + 共享的主机限流）"""
+
+    def __init__(self, max_concurrency: int = 3, host_gate: Optional[HostGate] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.host_gate = host_gate or HostGate()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """站点并发名额 + 主机限流名额"""
+        async with self._semaphore:
+            async with self.host_gate.slot(url):
+                yield
+
+    async def map(self, fn: Callable[[str], Awaitable[T]], urls: List[str]) -> List[T]:
+        """并发执行fn(url)，结果顺序与urls一致"""
+        return await self.map_items(fn, urls, url_of=lambda url: url)
+
+    async def map_items(self, fn: Callable[[Any], Awaitable[T]], items: List[Any],
+                        url_of: Callable[[Any], str]) -> List[T]:
+        """并发执行fn(item)（按url_of(item)限流），结果顺序与items一致"""
+        async def run(item: Any) -> T:
+            async with self.slot(url_of(item)):
+                return await fn(item)
+
+        return list(await asyncio.gather(*(run(item) for item in items)))
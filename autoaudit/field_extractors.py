@@ -0,0 +1,163 @@
+"""
+本地字段预提取
+用预编译正则提取联系电话、传真、电子邮箱、行政区划地址和办公时间，
+只有本地提取不到的字段才交给LLM，减少presence_all的AI调用
+"""
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+_NUM = r"(?:\(?0\d{2,3}\)?[-－—\s]?\d{7,8}(?:[-－转]\d{1,6})?|1[3-9]\d{9}|400[-－]?\d{3}[-－]?\d{4})"
+
+# 带标签的电话（优先），标签与号码之间允许少量说明文字
+PHONE_LABELED_RE = re.compile(
+    r"(?:联系电话|咨询电话|办公电话|监督电话|投诉电话|服务电话|电话|Tel|TEL|tel)[^0-9\n传]{0,10}?(" + _NUM + r")"
+)
+# 无标签的座机/手机号（排除紧跟“传真”的号码）；只接受带分隔符或附近有电话字样的号码，
+# 避免把文号、编号等纯数字串当作电话
+PHONE_RE = re.compile(r"(?<!\d)(" + _NUM + r")(?!\d)")
+PHONE_SEPARATOR_RE = re.compile(r"[-－—\s()]")
+PHONE_HINT_RE = re.compile(r"电话|热线|手机|座机|Tel|TEL|tel")
+FAX_RE = re.compile(r"(?:传真|Fax|FAX|fax)[^0-9\n]{0,10}?(" + _NUM + r")")
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}")
+
+# “网站地址/IP地址/电子邮件地址”等不是办公地址
+ADDRESS_LABELED_RE = re.compile(
+    r"(?:办公地址|通讯地址|联系地址|单位地址|(?<!网站)(?<!网页)(?<!IP)(?<!ip)(?<!邮件)(?<!邮箱)地\s*址)"
+    r"\s*[：:]\s*([^\n，。；;、]{4,60})"
+)
+# 地址取值需含中文行政区划/道路门牌字样，且不是网址、邮箱或主机名/IP
+ADDRESS_HINT_RE = re.compile(r"[省市区县路街号]")
+NOT_ADDRESS_RE = re.compile(r"://|@|[A-Za-z0-9\-]+\.[A-Za-z0-9\-]+\.[A-Za-z0-9\-.]+")
+# 行政区划地址：[省/自治区]市 区/县 ... 路/街/道/巷 ...号
+ADDRESS_RE = re.compile(
+    r"(?:[一-鿿]{2,7}(?:省|自治区))?[一-鿿]{2,7}市"
+    r"(?:[一-鿿]{1,8}(?:区|县|市))?"
+    r"[一-鿿0-9]{1,20}(?:路|街|大道|道|巷|大街)"
+    r"[0-9０-９一二三四五六七八九十百]+号(?:[一-鿿0-9A-Za-z\-]{0,15})"
+)
+
+_DAY = r"(?:周|星期)[一二三四五六日天]"
+OFFICE_HOURS_LABELED_RE = re.compile(
+    r"(?:办公时间|工作时间|受理时间|服务时间)\s*[：:]?\s*([^\n]{4,80})"
+)
+WEEKDAY_RE = re.compile(_DAY + r"\s*(?:至|到|—|-|－|~|～)\s*" + _DAY + r"|法定工作日|工作日")
+TIME_RANGE_RE = re.compile(
+    r"(?:上午|下午|早上|晚上)?\s*\d{1,2}\s*[:：时点]\s*\d{0,2}\s*分?\s*(?:至|到|—|-|－|~|～)\s*"
+    r"(?:上午|下午|晚上)?\s*\d{1,2}\s*[:：时点]\s*\d{0,2}"
+)
+
+
+def extract_phone(text: str) -> Optional[str]:
+    match = PHONE_LABELED_RE.search(text)
+    if match:
+        return match.group(1).strip()
+    for match in PHONE_RE.finditer(text):
+        # 跳过传真号码
+        prefix = text[max(0, match.start() - 12):match.start()]
+        if "传真" in prefix or "fax" in prefix.lower():
+            continue
+        number = match.group(1).strip()
+        if PHONE_SEPARATOR_RE.search(number) or PHONE_HINT_RE.search(text[max(0, match.start() - 20):match.start()]):
+            return number
+    return None
+
+
+def extract_fax(text: str) -> Optional[str]:
+    match = FAX_RE.search(text)
+    return match.group(1).strip() if match else None
+
+
+def extract_email(text: str) -> Optional[str]:
+    match = EMAIL_RE.search(text)
+    return match.group(0) if match else None
+
+
+def _looks_like_address(value: str) -> bool:
+    return bool(ADDRESS_HINT_RE.search(value)) and not NOT_ADDRESS_RE.search(value)
+
+
+def extract_address(text: str) -> Optional[str]:
+    """办公地址；取值不像地址时返回None，交给LLM判断"""
+    for match in ADDRESS_LABELED_RE.finditer(text):
+        value = match.group(1).strip()
+        if _looks_like_address(value):
+            return value
+    match = ADDRESS_RE.search(text)
+    return match.group(0) if match and _looks_like_address(match.group(0)) else None
+
+
+def extract_office_hours(text: str) -> Optional[str]:
+    """办公时间：需同时包含星期范围（或工作日）与时间段"""
+    match = OFFICE_HOURS_LABELED_RE.search(text)
+    if match and (WEEKDAY_RE.search(match.group(1)) or TIME_RANGE_RE.search(match.group(1))):
+        return match.group(1).strip()
+    for line in text.splitlines():
+        if WEEKDAY_RE.search(line) and TIME_RANGE_RE.search(line):
+            return line.strip()[:80]
+    return None
+
+
+FIELD_EXTRACTORS = {
+    "phone": extract_phone,
+    "fax": extract_fax,
+    "email": extract_email,
+    "address": extract_address,
+    "office_hours": extract_office_hours,
+}
+
+
+def extract_local(text: str, fields: List[str]) -> Dict[str, Optional[str]]:
+    """
+    本地提取字段
+
+    Returns:
+        {field: value或None}；没有本地提取器的字段返回None
+    """
+    results = {}
+    for field in fields:
+        extractor = FIELD_EXTRACTORS.get(field)
+        results[field] = extractor(text) if extractor else None
+    return results
+
+
+class FieldHitStats:
+    """按字段统计本地提取命中率与LLM兜底情况"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def record(self, field: str, local_hit: bool, llm_called: bool = False, llm_hit: bool = False):
+        with self._lock:
+            s = self._stats.setdefault(field, {"requests": 0, "local_hits": 0, "llm_calls": 0, "llm_hits": 0})
+            s["requests"] += 1
+            s["local_hits"] += int(local_hit)
+            s["llm_calls"] += int(llm_called)
+            s["llm_hits"] += int(llm_hit)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return self._with_rates(self._stats)
+
+    @staticmethod
+    def _with_rates(stats: Dict[str, Dict[str, int]]) -> Dict[str, Dict]:
+        return {
+            field: dict(
+                s,
+                local_hit_rate=round(s["local_hits"] / s["requests"], 3) if s["requests"] else 0,
+                llm_hit_rate=round(s["llm_hits"] / s["llm_calls"], 3) if s["llm_calls"] else 0,
+            )
+            for field, s in stats.items()
+        }
+
+    @classmethod
+    def merge(cls, snapshots: Iterable[Dict[str, Dict]]) -> Dict[str, Dict]:
+        """合并多个snapshot（各站点的命中率汇总为批次命中率）"""
+        totals: Dict[str, Dict[str, int]] = {}
+        for snapshot in snapshots:
+            for field, s in (snapshot or {}).items():
+                t = totals.setdefault(field, {"requests": 0, "local_hits": 0, "llm_calls": 0, "llm_hits": 0})
+                for key in t:
+                    t[key] += s.get(key, 0)
+        return cls._with_rates(totals)
@@ -0,0 +1,251 @@
+"""
+截图编码卸载
+浏览器只产出原始截图（PNG），转码为WebP/AVIF与落盘在进程池中完成，抓取协程不等待编码和磁盘写入；
+站点会话结束前统一等待编码任务完成，并记录每张图片的原始大小、编码后大小和编码耗时
+未安装Pillow时退回浏览器JPEG截图，落盘仍交给线程池
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import features
+    PILLOW_AVAILABLE = True
+except ImportError:
+    logger.warning("Pillow not installed. Screenshots will be saved as browser-encoded JPEG.")
+    PILLOW_AVAILABLE = False
+
+FORMAT_WEBP = "webp"
+FORMAT_AVIF = "avif"
+FORMAT_JPEG = "jpeg"
+
+EXTENSIONS = {
+    FORMAT_WEBP: ".webp",
+    FORMAT_AVIF: ".avif",
+    FORMAT_JPEG: ".jpg",
+}
+
+# 进程级共享的编码池（跨站点、跨worker复用，批次结束时关闭）
+_process_pool: Optional[ProcessPoolExecutor] = None
+_io_pool: Optional[ThreadPoolExecutor] = None
+
+
+def _atomic_write(path: str, data: bytes):
+    """先写临时文件再替换，读取方不会看到写了一半的图片"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _write_file(data: bytes, path: str) -> Tuple[int, float]:
+    """线程池中执行：浏览器已编码的图片直接落盘"""
+    start = time.perf_counter()
+    _atomic_write(path, data)
+    return len(data), (time.perf_counter() - start) * 1000
+
+
+def _encode_file(raw: bytes, path: str, fmt: str, quality: int) -> Tuple[int, float]:
+    """进程池中执行：解码原始截图 → 转码 → 原子写入；返回(文件字节数, 编码+写入毫秒)"""
+    import io
+
+    from PIL import Image
+
+    if fmt == FORMAT_AVIF:
+        try:
+            import pillow_avif  # noqa: F401  旧版Pillow需插件注册AVIF编码器
+        except ImportError:
+            pass
+
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(raw)) as image:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        options = {"quality": quality}
+        if fmt == FORMAT_WEBP:
+            options["method"] = 4  # 速度与体积折中（0最快，6最小）
+        image.save(buffer, format=fmt.upper(), **options)
+    data = buffer.getvalue()
+    _atomic_write(path, data)
+    return len(data), (time.perf_counter() - start) * 1000
+
+
+def _avif_supported() -> bool:
+    if features.check("avif"):
+        return True
+    try:
+        import pillow_avif  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn：父进程持有Playwright驱动线程和事件循环，fork可能继承锁状态
+        _process_pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+def _get_io_pool() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="screenshot_io")
+    return _io_pool
+
+
+def shutdown_encoder_pool():
+    """关闭共享编码池（批次结束时调用；之后再提交会重新创建）"""
+    global _process_pool, _io_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True)
+        _process_pool = None
+    if _io_pool is not None:
+        _io_pool.shutdown(wait=True)
+        _io_pool = None
+
+
+class ImageEncoder:
+    """单个worker的截图编码器（提交后立即返回最终路径，编码在后台完成）"""
+
+    def __init__(self, fmt: str = FORMAT_WEBP, quality: int = 80, max_workers: int = 2):
+        """
+        Args:
+            fmt: webp | avif | jpeg（jpeg由浏览器直接编码，不经过进程池）
+            quality: 编码质量（1-100）
+            max_workers: 编码进程数（进程池首次创建时生效）
+        """
+        fmt = fmt.lower()
+        if fmt == "jpg":
+            fmt = FORMAT_JPEG
+        if fmt not in EXTENSIONS:
+            logger.warning(f"未知的截图格式{fmt}，使用{FORMAT_WEBP}")
+            fmt = FORMAT_WEBP
+        if fmt != FORMAT_JPEG and not PILLOW_AVAILABLE:
+            fmt = FORMAT_JPEG
+        if fmt == FORMAT_AVIF and not _avif_supported():
+            logger.warning("当前Pillow不支持AVIF编码（需Pillow>=11.3或pillow-avif-plugin），使用WebP")
+            fmt = FORMAT_WEBP
+        self.format = fmt
+        self.quality = max(1, min(100, quality))
+        self.max_workers = max(1, max_workers)
+        self.records: Dict[str, Dict] = {}  # 文件路径 -> 编码记录
+        self._pending = set()
+        self._futures: Dict[str, asyncio.Future] = {}  # 文件路径 -> 未完成的编码任务
+
+    @classmethod
+    def from_env(cls) -> "ImageEncoder":
+        return cls(
+            fmt=os.environ.get("SCREENSHOT_FORMAT", FORMAT_WEBP),
+            quality=int(os.environ.get("SCREENSHOT_QUALITY", "80")),
+            max_workers=int(os.environ.get("SCREENSHOT_ENCODE_WORKERS", "2")),
+        )
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    @property
+    def capture_type(self) -> str:
+        """浏览器截图格式：转码时取无损PNG，避免两次有损压缩"""
+        return FORMAT_JPEG if self.format == FORMAT_JPEG else "png"
+
+    def screenshot_options(self) -> Dict:
+        """page.screenshot的格式参数"""
+        if self.capture_type == FORMAT_JPEG:
+            return {"type": "jpeg", "quality": self.quality}
+        return {"type": "png"}
+
+    def submit(self, raw: bytes, path: Path) -> str:
+        """
+        提交截图编码任务（不等待完成）
+
+        Args:
+            raw: 浏览器截图字节（capture_type格式）
+            path: 不含扩展名的目标路径
+
+        Returns:
+            最终文件路径（文件在wait(path)或drain()返回后才存在，读取前必须先等待）
+        """
+        target = str(path.with_name(path.name + self.extension))
+        loop = asyncio.get_running_loop()
+        if self.format == FORMAT_JPEG:
+            future = loop.run_in_executor(_get_io_pool(), _write_file, raw, target)
+        else:
+            future = loop.run_in_executor(
+                _get_process_pool(self.max_workers), _encode_file, raw, target, self.format, self.quality
+            )
+        submitted = time.monotonic()
+        record = {"path": target, "format": self.format, "raw_bytes": len(raw)}
+
+        def done(fut: asyncio.Future):
+            self._pending.discard(fut)
+            if self._futures.get(target) is fut:
+                del self._futures[target]
+            record["latency_ms"] = round((time.monotonic() - submitted) * 1000, 1)
+            if fut.cancelled():
+                record["error"] = "cancelled"
+            elif fut.exception() is not None:
+                record["error"] = str(fut.exception())
+                logger.error(f"截图编码失败 {target}: {fut.exception()}")
+            else:
+                size, encode_ms = fut.result()
+                record["bytes"] = size
+                record["encode_ms"] = round(encode_ms, 1)
+            self.records[target] = record
+
+        future.add_done_callback(done)
+        self._pending.add(future)
+        self._futures[target] = future
+        return target
+
+    async def wait(self, path: Optional[str]) -> bool:
+        """
+        等待单张截图编码落盘
+
+        Returns:
+            文件是否已成功写入（编码失败或路径不是本编码器提交的返回False）
+        """
+        if not path:
+            return False
+        future = self._futures.get(path)
+        if future is not None:
+            await asyncio.gather(future, return_exceptions=True)
+        record = self.records.get(path)
+        return bool(record and "bytes" in record)
+
+    async def drain(self):
+        """等待所有已提交的编码任务完成"""
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def record_for(self, path: Optional[str]) -> Optional[Dict]:
+        return self.records.get(path) if path else None
+
+    def snapshot(self) -> Dict:
+        encoded = [r for r in self.records.values() if "bytes" in r]
+        raw_bytes = sum(r["raw_bytes"] for r in encoded)
+        out_bytes = sum(r["bytes"] for r in encoded)
+        encode_ms = [r["encode_ms"] for r in encoded]
+        return {
+            "format": self.format,
+            "quality": self.quality,
+            "images": len(encoded),
+            "failed": len(self.records) - len(encoded),
+            "raw_bytes": raw_bytes,
+            "bytes": out_bytes,
+            "compression_ratio": round(out_bytes / raw_bytes, 3) if raw_bytes else None,
+            "avg_encode_ms": round(sum(encode_ms) / len(encode_ms), 1) if encode_ms else 0,
+            "max_encode_ms": max(encode_ms) if encode_ms else 0,
+        }
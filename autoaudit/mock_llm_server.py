@@ -0,0 +1,273 @@
+"""
+本地OpenAI兼容模拟服务（离线压测AI路径）
+实现 /v1/chat/completions 接口，可配置延迟分布、错误率、token用量和脚本化JSON回答，
+将 AI_BASE_URL 指向本服务即可在无ModelScope Key的机器上确定性地测量
+AIExtractor 的吞吐、并发、预算与Provider降级行为
+
+用法:
+    python -m autoaudit.mock_llm_server --port 8765 --config mock_llm.json
+    AI_BASE_URL=http://127.0.0.1:8765/v1 DEEPSEEK_API_KEY=mock python scripts/bench_ai_offline.py
+
+配置示例（均可省略，使用默认值）:
+    {
+        "seed": 42,
+        "default": {
+            "latency": {"dist": "lognormal", "median_ms": 800, "sigma": 0.4},
+            "error_rate": 0.0,
+            "error_status": 500
+        },
+        "models": {
+            "Qwen/Qwen3-32B": {"latency": {"dist": "fixed", "ms": 300}, "error_rate": 0.1}
+        },
+        "field_values": {"phone": "0527-84361234"},
+        "review": {"status": "PASS", "confidence": 0.9},
+        "responses": [
+            {"match": "信息公开指南", "content": {"status": "FAIL", "confidence": 0.95}}
+        ]
+    }
+"""
+import argparse
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from .token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_CONFIG = {
+    "latency": {"dist": "lognormal", "median_ms": 800, "sigma": 0.4},
+    "error_rate": 0.0,
+    "error_status": 500,       # 500 或 429（限流）
+    "prompt_tokens": None,     # None=按消息内容估算
+    "prompt_token_scale": 1.0, # 估算值的缩放（模拟不同分词器，用于验证估算器校准）
+    "completion_tokens": None, # None=按回答内容估算
+}
+
+DEFAULT_FIELD_VALUES = {
+    "phone": "0527-84361234",
+    "address": "江苏省宿迁市宿城区洪泽湖路1号",
+    "email": "gk@example.gov.cn",
+    "fax": "0527-84361235",
+    "office_hours": "周一至周五 上午8:30-12:00 下午14:00-17:30",
+}
+
+DEFAULT_REVIEW = {
+    "status": "UNCERTAIN",
+    "confidence": 0.6,
+    "reasoning": "模拟服务默认回答",
+    "suggested_action": "manual_review",
+}
+
+_FIELD_LINE_RE = re.compile(r"^- (\w+):", re.MULTILINE)
+
+
+class MockLLMServer:
+    """OpenAI chat-completions 模拟服务（线程内运行，可作为上下文管理器使用）"""
+
+    def __init__(self, config: Optional[Dict] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            config: 模拟配置（见模块说明）
+            host, port: 监听地址（port=0时自动分配）
+        """
+        self.config = config or {}
+        self.default = dict(DEFAULT_MODEL_CONFIG, **self.config.get("default", {}))
+        self.models = self.config.get("models", {})
+        self.field_values = dict(DEFAULT_FIELD_VALUES, **self.config.get("field_values", {}))
+        self.review = dict(DEFAULT_REVIEW, **self.config.get("review", {}))
+        self.responses = [
+            dict(r, _re=re.compile(r["match"])) for r in self.config.get("responses", [])
+        ]
+
+        self._rng = random.Random(self.config.get("seed", 42))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.stats = Counter()
+
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"模拟LLM服务已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def serve_forever(self):
+        logger.info(f"模拟LLM服务已启动: {self.base_url}")
+        self._httpd.serve_forever()
+
+    # ------------------------------------------------------------------
+    # 模拟逻辑
+    # ------------------------------------------------------------------
+
+    def _model_config(self, model: str) -> Dict:
+        return dict(self.default, **self.models.get(model, {}))
+
+    def _sample_latency_ms(self, latency: Dict) -> float:
+        dist = latency.get("dist", "fixed")
+        with self._lock:
+            if dist == "uniform":
+                return self._rng.uniform(latency.get("min_ms", 0), latency.get("max_ms", 1000))
+            if dist == "lognormal":
+                median = latency.get("median_ms", 800)
+                return median * self._rng.lognormvariate(0, latency.get("sigma", 0.4))
+            if dist == "normal":
+                return max(0.0, self._rng.gauss(latency.get("mean_ms", 800), latency.get("stddev_ms", 200)))
+            return float(latency.get("ms", 0))
+
+    def _should_fail(self, error_rate: float) -> bool:
+        with self._lock:
+            return self._rng.random() < error_rate
+
+    def _answer(self, prompt: str) -> str:
+        """脚本化回答优先；否则按prompt类型生成默认JSON"""
+        for scripted in self.responses:
+            if scripted["_re"].search(prompt):
+                content = scripted["content"]
+                return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+        if "需要提取的字段" in prompt:
+            fields = _FIELD_LINE_RE.findall(prompt.split("需要提取的字段", 1)[1])
+            answer = {f: self.field_values.get(f) for f in fields}
+        elif "UNCERTAIN" in prompt:
+            answer = self.review
+        else:
+            answer = {"status": "ok"}
+        return json.dumps(answer, ensure_ascii=False)
+
+    def complete(self, request: Dict):
+        """
+        处理一次chat completion请求
+
+        Returns:
+            (HTTP状态码, 响应体)
+        """
+        model = request.get("model", "mock")
+        cfg = self._model_config(model)
+        messages = request.get("messages", [])
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+
+        time.sleep(self._sample_latency_ms(cfg["latency"]) / 1000)
+
+        if self._should_fail(cfg["error_rate"]):
+            status = int(cfg["error_status"])
+            with self._lock:
+                self.stats[f"{model}:error_{status}"] += 1
+            return status, {"error": {"message": f"mock error {status}", "type": "mock_error", "code": status}}
+
+        content = self._answer(prompt)
+        prompt_tokens = cfg["prompt_tokens"] or int(estimate_tokens(prompt) * cfg["prompt_token_scale"])
+        completion_tokens = cfg["completion_tokens"] or estimate_tokens(content)
+        max_tokens = request.get("max_tokens")
+        if max_tokens:
+            completion_tokens = min(completion_tokens, max_tokens)
+
+        with self._lock:
+            self.stats[f"{model}:ok"] += 1
+            completion_id = next(self._ids)
+
+        return 200, {
+            "id": f"chatcmpl-mock-{completion_id}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"mock llm: {format % args}")
+
+            def _send(self, status: int, body: Dict):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    models = list(server.models) or ["mock"]
+                    self._send(200, {"object": "list", "data": [{"id": m, "object": "model"} for m in models]})
+                elif self.path.rstrip("/").endswith("/stats"):
+                    self._send(200, dict(server.stats))
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send(400, {"error": {"message": "invalid json"}})
+                    return
+                status, body = server.complete(request)
+                self._send(status, body)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", help="模拟配置JSON文件")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockLLMServer(config, host=args.host, port=args.port)
+    print(f"AI_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
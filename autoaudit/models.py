@@ -13,6 +13,15 @@ class TraceStep:
     screenshot: Optional[str] = None
     snapshot: Optional[str] = None
     notes: Optional[str] = None
+    ready_ms: Optional[int] = None  # 页面就绪耗时（DOM静默+请求空闲，含滚动后的等待）
+    ready_reason: Optional[str] = None  # quiet | timeout | error
+    screenshot_bytes: Optional[int] = None  # 编码后截图大小
+    encode_ms: Optional[float] = None  # 截图转码+落盘耗时（后台进程池）
+    tiles: Optional[List[Dict]] = None  # 超长页面分块截图 [{"index", "path", "y", "height"}, ...]
+    page_height: Optional[int] = None  # 分块截图时的页面总高度
+    cache_hits: Optional[int] = None  # 磁盘缓存命中的请求数（启用BROWSER_DISK_CACHE时）
+    cache_hit_bytes: Optional[int] = None  # 由缓存提供的字节数
+    network_bytes: Optional[int] = None  # 实际从网络下载的字节数
 
 
 @dataclass
@@ -158,6 +167,14 @@ class EvidenceCache:
         self._cache[cache_key] = evidence
         return evidence
     
+    def get(self, rule_id: str, url: str) -> Optional['Evidence']:
+        """
+        按缓存键(rule_id, url)查找已创建的Evidence
+
+        evidence_id只由时间（秒）和URL哈希组成，同一页面上的多条规则会得到相同的ID，不能用来查找
+        """
+        return self._cache.get((rule_id, url))
+    
     def get_stats(self) -> Dict:
         """获取缓存统计"""
         total = self._hits + self._misses
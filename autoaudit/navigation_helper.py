@@ -5,10 +5,13 @@
 """
 import logging
 import asyncio
+from contextlib import nullcontext
 from typing import List, Dict, Set, Optional
 from playwright.async_api import Page, Locator
 from urllib.parse import urljoin, urlparse
 
+from .page_readiness import ReadinessPolicy, RequestTracker, wait_until_ready
+
 logger = logging.getLogger(__name__)
 
 # 常见政务公开栏目关键词（优先级从高到低）
@@ -25,6 +28,57 @@ CATEGORY_KEYWORDS = {
     "行政执法": ["行政执法", "执法公示", "执法信息"],
 }
 
+# 入口页上需要进入的子页面（机构信息、年报、公开指南等规则依赖的页面），每组第一个为anchor名称
+ANCHOR_PATTERNS = [
+    # 机构信息相关
+    ["机构职能", "机构职责", "部门职能"],
+    ["机构设置", "内设机构", "组织机构"],
+    ["机构领导", "领导分工", "领导信息"],
+    ["办公地址", "联系方式", "联系我们"],
+    ["办公时间", "工作时间"],
+    # ✅ 新增：年报相关
+    ["政府信息公开年报", "年报", "年度报告"],
+    # 政府信息公开指南相关
+    ["政府信息公开指南", "公开指南", "信息公开指南"],
+    ["政府信息公开制度", "公开制度"],
+]
+
+# 一次DOM遍历为所有anchor组查找链接：每组按关键词顺序取文档中第一个文本包含该关键词的链接
+# （与XPath //a[contains(., kw)] 相同的匹配语义），返回浏览器解析后的绝对URL
+_HARVEST_ANCHORS_JS = r"""
+(patterns) => {
+    const links = [];
+    for (const a of document.querySelectorAll('a[href]')) {
+        const raw = a.getAttribute('href').trim();
+        if (!raw || raw.startsWith('#') || raw.toLowerCase().startsWith('javascript:')) continue;
+        links.push({href: a.href, text: (a.textContent || '').replace(/\s+/g, ' ').trim()});
+    }
+    return patterns.map(anchors => {
+        for (const anchor of anchors) {
+            const link = links.find(l => l.text.includes(anchor));
+            if (link) return {href: link.href, text: link.text, matched_anchor: anchor};
+        }
+        return null;
+    });
+}
+"""
+
+# 一次DOM遍历收集多个选择器匹配的链接（替代逐个元素的get_attribute/inner_text往返调用）
+# 返回[{selector, href, text}]，href为原始属性值，text与inner_text()一致（去除首尾空白）
+_HARVEST_LINKS_JS = """
+(selectors) => {
+    const out = [];
+    for (const selector of selectors) {
+        let elements;
+        try { elements = document.querySelectorAll(selector); } catch (e) { continue; }
+        for (const el of elements) {
+            out.push({selector: selector, href: el.getAttribute('href'), text: (el.innerText || '').trim()});
+        }
+    }
+    return out;
+}
+"""
+
 # 导航菜单常见选择器（按优先级）
 # ⚠️ 注意：只使用政务公开栏目内的子导航选择器，不要使用顶部主导航栏
 NAV_SELECTORS = [
@@ -61,14 +115,17 @@ NAV_SELECTORS = [
 class NavigationHelper:
     """导航辅助类"""
     
-    def __init__(self, max_depth: int = 5, max_links_per_level: int = 20):
+    def __init__(self, max_depth: int = 5, max_links_per_level: int = 20, host_gate=None):
         """
         Args:
             max_depth: 最大导航深度（1=仅主菜单，5=深入5层以找到深层指标项）
             max_links_per_level: 每层最多抓取的链接数（防止失控）
+            host_gate: 可选的主机限流（fetch_scheduler.HostGate），导航时遵守同域名访问间隔
         """
         self.max_depth = max_depth
         self.max_links_per_level = max_links_per_level
+        self.host_gate = host_gate
+        self.readiness = ReadinessPolicy.from_env()
         self.visited_urls: Set[str] = set()
     
     async def discover_navigation_links(self, page: Page, base_url: str) -> List[Dict]:
@@ -80,47 +137,45 @@ class NavigationHelper:
         """
         links = []
         
+        # 一次page.evaluate取回所有选择器的链接，选择与栏目匹配在Python中完成
+        harvested = await harvest_links(page, NAV_SELECTORS)
+        by_selector: Dict[str, List[Dict]] = {}
+        for item in harvested:
+            by_selector.setdefault(item["selector"], []).append(item)
+        
         for selector in NAV_SELECTORS:
-            try:
-                elements = await page.locator(selector).all()
-                if elements:
-                    logger.info(f"使用选择器发现导航: {selector}，找到{len(elements)}个链接")
-                    
-                    for elem in elements[:self.max_links_per_level]:
-                        try:
-                            href = await elem.get_attribute("href")
-                            text = (await elem.inner_text()).strip()
-                            
-                            if not href or not text:
-                                continue
-                            
-                            # 转换为绝对URL
-                            abs_url = urljoin(base_url, href)
-                            
-                            # 过滤外部链接
-                            if not self._is_same_domain(abs_url, base_url):
-                                continue
-                            
-                            # 匹配栏目类别
-                            category, priority = self._match_category(text)
-                            
-                            links.append({
-                                "url": abs_url,
-                                "text": text,
-                                "category": category,
-                                "priority": priority
-                            })
-                        except Exception as e:
-                            logger.debug(f"解析链接失败: {e}")
-                            continue
-                    
-                    # 找到有效选择器就停止
-                    if links:
-                        break
-                        
-            except Exception as e:
-                logger.debug(f"选择器{selector}失败: {e}")
+            elements = by_selector.get(selector)
+            if not elements:
                 continue
+            logger.info(f"使用选择器发现导航: {selector}，找到{len(elements)}个链接")
+            
+            for elem in elements[:self.max_links_per_level]:
+                href = elem["href"]
+                text = elem["text"]
+                
+                if not href or not text:
+                    continue
+                
+                # 转换为绝对URL
+                abs_url = urljoin(base_url, href)
+                
+                # 过滤外部链接
+                if not self._is_same_domain(abs_url, base_url):
+                    continue
+                
+                # 匹配栏目类别
+                category, priority = self._match_category(text)
+                
+                links.append({
+                    "url": abs_url,
+                    "text": text,
+                    "category": category,
+                    "priority": priority
+                })
+            
+            # 找到有效选择器就停止
+            if links:
+                break
         
         # 按优先级排序
         links.sort(key=lambda x: x["priority"], reverse=True)
@@ -185,27 +240,62 @@ class NavigationHelper:
             logger.info(f"[深度{current_depth}] 导航到: {url}")
             
             # 访问页面
-            await page.goto(url, timeout=30000, wait_until='domcontentloaded')
-            await page.wait_for_timeout(1500)  # 等待动态内容
-            
-            # 发现链接
-            links = await self.discover_navigation_links(page, url)
-            
-            # 提取URL（去重）
-            discovered_urls = list({link["url"] for link in links if link["url"] not in self.visited_urls})
-            
-            logger.info(f"[深度{current_depth}] 在 {url} 发现{len(discovered_urls)}个新链接")
+            tracker = RequestTracker(page).attach()
+            try:
+                async with (self.host_gate.slot(url) if self.host_gate else nullcontext()):
+                    await page.goto(url, timeout=30000, wait_until='domcontentloaded')
+                # 等待动态内容（导航菜单常由脚本渲染）
+                ready = await wait_until_ready(page, self.readiness, tracker)
+                logger.debug(f"[深度{current_depth}] {url} ready after {ready['ready_ms']}ms ({ready['reason']})")
+            finally:
+                tracker.detach()
             
-            return discovered_urls[:self.max_links_per_level]
+            return await self.discover_links(page, url, current_depth)
             
         except Exception as e:
             logger.error(f"导航到{url}失败: {e}")
             return []
     
+    async def discover_links(self, page: Page, url: str, current_depth: int = 0) -> List[str]:
+        """在已加载的页面上发现子链接（不导航），返回未访问过的链接URL"""
+        links = await self.discover_navigation_links(page, url)
+        
+        # 提取URL（去重）
+        discovered_urls = list({link["url"] for link in links if link["url"] not in self.visited_urls})
+        
+        logger.info(f"[深度{current_depth}] 在 {url} 发现{len(discovered_urls)}个新链接")
+        
+        return discovered_urls[:self.max_links_per_level]
+    
+    async def harvest_entry(
+        self,
+        page: Page,
+        entry_url: str,
+        anchor_patterns: Optional[List[List[str]]] = None
+    ) -> Dict:
+        """
+        在入口页抓取时已加载的页面上收集level_0链接与anchor子页面链接（不重新加载入口页）
+        
+        Returns:
+            {"level_0": [url, ...], "anchor_links": [...]}，作为build_navigation_tree的entry_harvest参数
+        """
+        self.visited_urls.add(entry_url)
+        harvest = {"level_0": [], "anchor_links": []}
+        if self.max_depth > 0:
+            try:
+                harvest["level_0"] = await self.discover_links(page, entry_url, current_depth=0)
+            except Exception as e:
+                logger.error(f"入口页{entry_url}链接发现失败: {e}")
+        if anchor_patterns:
+            harvest["anchor_links"] = await harvest_anchor_links(page, anchor_patterns, entry_url)
+        return harvest
+    
     async def build_navigation_tree(
         self, 
         page: Page, 
-        entry_url: str
+        entry_url: str,
+        anchor_patterns: Optional[List[List[str]]] = None,
+        entry_harvest: Optional[Dict] = None
     ) -> Dict:
         """
         从入口URL构建导航树
@@ -213,6 +303,8 @@ class NavigationHelper:
         Args:
             page: Playwright页面对象
             entry_url: 入口URL
+            anchor_patterns: 可选的anchor组（见ANCHOR_PATTERNS），在入口页上一并收集子页面链接
+            entry_harvest: 入口页抓取时harvest_entry()的结果；传入时不再加载入口页，page只用于二级页面
         
         Returns:
             Dict: {
@@ -220,6 +312,7 @@ class NavigationHelper:
                 "level_0": [url1, url2, ...],  # 入口页发现的链接
                 "level_1": [url3, url4, ...],  # 二级页面发现的链接
                 "all_urls": [all_unique_urls],
+                "anchor_links": [{"anchor_name", "url", "text", "matched_anchor"}, ...],  # 传入anchor_patterns时
                 "metadata": {...}
             }
         """
@@ -228,6 +321,7 @@ class NavigationHelper:
             "level_0": [],
             "level_1": [],
             "all_urls": [],
+            "anchor_links": [],
             "metadata": {
                 "max_depth": self.max_depth,
                 "total_discovered": 0
@@ -236,7 +330,14 @@ class NavigationHelper:
         
         try:
             # Level 0: 从入口页发现的链接
-            level_0_urls = await self.navigate_and_discover_links(page, entry_url, current_depth=0)
+            if entry_harvest is not None:
+                level_0_urls = entry_harvest["level_0"]
+                tree["anchor_links"] = entry_harvest["anchor_links"]
+            else:
+                level_0_urls = await self.navigate_and_discover_links(page, entry_url, current_depth=0)
+                # 入口页仍在当前页面上：一次DOM遍历收集所有anchor组的子页面链接
+                if anchor_patterns:
+                    tree["anchor_links"] = await harvest_anchor_links(page, anchor_patterns, entry_url)
             tree["level_0"] = level_0_urls
             
             # Level 1: 从level_0链接发现的二级链接（如果max_depth >= 2）
@@ -265,6 +366,20 @@ class NavigationHelper:
         return tree
 
 
+async def harvest_links(page: Page, selectors: List[str]) -> List[Dict]:
+    """
+    一次page.evaluate收集所有选择器匹配的链接
+    
+    Returns:
+        List[Dict]: [{"selector", "href", "text"}, ...]（按选择器顺序、文档顺序；无效选择器跳过）
+    """
+    try:
+        return await page.evaluate(_HARVEST_LINKS_JS, selectors)
+    except Exception as e:
+        logger.error(f"收集页面链接失败: {e}")
+        return []
+
+
 async def extract_category_links(page: Page, category_keywords: List[str]) -> List[str]:
     """
     根据关键词提取特定栏目的链接
@@ -278,34 +393,57 @@ async def extract_category_links(page: Page, category_keywords: List[str]) -> Li
     """
     matched_urls = []
     
-    try:
-        # 获取所有链接
-        all_links = await page.locator("a").all()
+    # 一次取回页面上所有链接
+    for link in await harvest_links(page, ["a"]):
+        text = link["text"]
+        href = link["href"]
         
-        for link in all_links:
-            try:
-                text = (await link.inner_text()).strip()
-                href = await link.get_attribute("href")
-                
-                if not href:
-                    continue
-                
-                # 检查是否匹配关键词
-                if any(kw in text for kw in category_keywords):
-                    matched_urls.append(href)
-                    logger.debug(f"匹配到栏目链接: {text} -> {href}")
-                    
-            except Exception:
-                continue
-        
-        logger.info(f"根据关键词{category_keywords}找到{len(matched_urls)}个链接")
+        if not href:
+            continue
         
-    except Exception as e:
-        logger.error(f"提取栏目链接失败: {e}")
+        # 检查是否匹配关键词
+        if any(kw in text for kw in category_keywords):
+            matched_urls.append(href)
+            logger.debug(f"匹配到栏目链接: {text} -> {href}")
+    
+    logger.info(f"根据关键词{category_keywords}找到{len(matched_urls)}个链接")
     
     return matched_urls
 
 
+async def harvest_anchor_links(page: Page, anchor_patterns: List[List[str]], base_url: str) -> List[Dict]:
+    """
+    在已加载的页面上一次性查找所有anchor组对应的链接（不点击、不导航）
+    
+    Args:
+        anchor_patterns: anchor组列表，每组第一个关键词作为anchor名称
+        base_url: 页面URL，用于相对路径解析
+    
+    Returns:
+        List[Dict]: [{"anchor_name", "url", "text", "matched_anchor"}, ...]（未找到的组不返回）
+    """
+    try:
+        matches = await page.evaluate(_HARVEST_ANCHORS_JS, anchor_patterns)
+    except Exception as e:
+        logger.error(f"收集anchor链接失败: {e}")
+        return []
+    
+    found = []
+    for anchors, match in zip(anchor_patterns, matches):
+        if not match:
+            logger.debug(f"未找到匹配链接: {anchors}")
+            continue
+        url = urljoin(base_url, match["href"])
+        found.append({
+            "anchor_name": anchors[0],
+            "url": url,
+            "text": match["text"],
+            "matched_anchor": match["matched_anchor"],
+        })
+        logger.info(f"找到匹配链接: {anchors[0]} '{match['text'][:30]}' -> {url}")
+    return found
+
+
 async def click_link_by_anchor(page: Page, anchors: List[str], base_url: str) -> Optional[Dict]:
     """
     根据anchor文本查找并点击链接，返回目标页面的内容
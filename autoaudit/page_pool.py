@@ -0,0 +1,131 @@
+"""
+BrowserContext内的页面（标签页）复用池
+站点抓取期间复用已打开的Page，归还时导航到about:blank并恢复视口以清除上一页面的状态；
+限制同时打开的页面数，并统计新建页面耗时与复用次数
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from playwright.async_api import BrowserContext, Page
+
+logger = logging.getLogger(__name__)
+
+BLANK_URL = "about:blank"
+MIN_PAGES = 2  # 深度导航持有入口页时仍需另一个页面抓取发现的链接
+
+
+class PagePool:
+    """单个BrowserContext的页面池（单事件循环内使用）"""
+
+    def __init__(self, context: BrowserContext, max_pages: int = 4, viewport: Optional[Dict] = None,
+                 on_create: Optional[Callable[[Page], Awaitable[None]]] = None):
+        """
+        Args:
+            context: 所属BrowserContext（页面池随context一起关闭）
+            max_pages: 同时打开的页面上限（至少2）
+            viewport: 归还时恢复的视口大小（证据截图可能临时修改视口）
+            on_create: 新建页面后的初始化回调（如挂载CDP会话）
+        """
+        self.context = context
+        self.max_pages = max(MIN_PAGES, max_pages)
+        self.viewport = viewport
+        self.on_create = on_create
+        self._idle: List[Page] = []
+        self._open = 0
+        self._slots = asyncio.Semaphore(self.max_pages)
+        self.stats = {
+            "acquired": 0,
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "resets": 0,
+            "create_ms": 0.0,
+            "reset_ms": 0.0,
+            "max_open": 0,
+        }
+
+    async def acquire(self) -> Page:
+        """借出一个页面（达到上限时等待其他页面归还）"""
+        await self._slots.acquire()
+        try:
+            self.stats["acquired"] += 1
+            while self._idle:
+                page = self._idle.pop()
+                if not page.is_closed():
+                    self.stats["reused"] += 1
+                    return page
+                self._open -= 1
+            start = time.time()
+            page = await self.context.new_page()
+            if self.on_create is not None:
+                await self.on_create(page)
+            self.stats["create_ms"] += (time.time() - start) * 1000
+            self.stats["created"] += 1
+            self._open += 1
+            self.stats["max_open"] = max(self.stats["max_open"], self._open)
+            return page
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def release(self, page: Page):
+        """归还页面：重置为空白页后放回池中；重置失败或页面已关闭则丢弃"""
+        try:
+            if page.is_closed():
+                self._discard()
+                return
+            start = time.time()
+            try:
+                await page.goto(BLANK_URL)
+                if self.viewport and page.viewport_size != self.viewport:
+                    await page.set_viewport_size(self.viewport)
+            except Exception as e:
+                logger.debug(f"页面重置失败，丢弃该页面: {e}")
+                self._discard()
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+                return
+            self.stats["reset_ms"] += (time.time() - start) * 1000
+            self.stats["resets"] += 1
+            self._idle.append(page)
+        finally:
+            self._slots.release()
+
+    def _discard(self):
+        self._open -= 1
+        self.stats["discarded"] += 1
+
+    @asynccontextmanager
+    async def page(self) -> AsyncIterator[Page]:
+        page = await self.acquire()
+        try:
+            yield page
+        finally:
+            await self.release(page)
+
+    async def close(self):
+        """关闭所有空闲页面（借出中的页面随context关闭）"""
+        idle, self._idle = self._idle, []
+        for page in idle:
+            try:
+                await page.close()
+            except Exception:
+                pass
+        self._open -= len(idle)
+
+    def snapshot(self) -> Dict:
+        created = self.stats["created"]
+        reused = self.stats["reused"]
+        resets = self.stats["resets"]
+        return {
+            "max_pages": self.max_pages,
+            **{k: v for k, v in self.stats.items() if not k.endswith("_ms")},
+            "reuse_rate": round(reused / (created + reused), 3) if created + reused else 0.0,
+            "avg_create_ms": round(self.stats["create_ms"] / created, 1) if created else 0.0,
+            "avg_reset_ms": round(self.stats["reset_ms"] / resets, 1) if resets else 0.0,
+        }
@@ -0,0 +1,185 @@
+"""
+页面就绪检测（替代固定等待）
+以DOM变更静默（MutationObserver）和进行中请求数判断页面是否加载完成，并设置硬上限；
+静态页面通常几百毫秒即可就绪，动态页面最多等待到上限
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from playwright.async_api import Page, Request
+
+logger = logging.getLogger(__name__)
+
+READY_QUIET = "quiet"      # DOM静默且请求空闲
+READY_TIMEOUT = "timeout"  # 达到硬上限仍未静默
+READY_ERROR = "error"      # 页面已关闭/导航中断等
+
+# 在页面内等待DOM静默：quietMs内无变更返回true，达到maxMs返回false
+# 轮播图/动画/时钟会持续改写style和class，这类属性变更不视为内容变化
+_DOM_QUIET_JS = """
+([quietMs, maxMs]) => new Promise(resolve => {
+    const start = performance.now();
+    let last = start;
+    const root = document.documentElement || document;
+    const ignored = new Set(['style', 'class']);
+    const observer = new MutationObserver(records => {
+        if (records.some(r => r.type !== 'attributes' || !ignored.has(r.attributeName))) {
+            last = performance.now();
+        }
+    });
+    observer.observe(root, {childList: true, subtree: true, attributes: true, characterData: true});
+    const step = Math.max(10, Math.min(50, quietMs));
+    const tick = () => {
+        const now = performance.now();
+        if (now - last >= quietMs || now - start >= maxMs) {
+            observer.disconnect();
+            resolve(now - last >= quietMs);
+        } else {
+            setTimeout(tick, step);
+        }
+    };
+    setTimeout(tick, step);
+})
+"""
+
+# 等待两帧渲染（样式注入后截图前使用，替代固定500ms）
+NEXT_PAINT_JS = "() => new Promise(r => requestAnimationFrame(() => requestAnimationFrame(() => r(true))))"
+
+
+class RequestTracker:
+    """统计页面进行中的请求数（goto之前attach，结束后detach）"""
+
+    def __init__(self, page: Page):
+        self.page = page
+        self.inflight = 0
+        self.last_activity = time.monotonic()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def _on_request(self, request: Request):
+        self.inflight += 1
+        self.last_activity = time.monotonic()
+        self._idle.clear()
+
+    def _on_done(self, request: Request):
+        self.inflight = max(0, self.inflight - 1)
+        self.last_activity = time.monotonic()
+        if self.inflight == 0:
+            self._idle.set()
+
+    def attach(self) -> "RequestTracker":
+        self.page.on("request", self._on_request)
+        self.page.on("requestfinished", self._on_done)
+        self.page.on("requestfailed", self._on_done)
+        return self
+
+    def detach(self):
+        for event, handler in (
+            ("request", self._on_request),
+            ("requestfinished", self._on_done),
+            ("requestfailed", self._on_done),
+        ):
+            try:
+                self.page.remove_listener(event, handler)
+            except Exception:
+                pass
+
+    async def wait_below(self, max_inflight: int, timeout_sec: float) -> bool:
+        """等待进行中请求数降到max_inflight以下（含）"""
+        deadline = time.monotonic() + timeout_sec
+        while self.inflight > max_inflight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                if max_inflight == 0:
+                    await asyncio.wait_for(self._idle.wait(), remaining)
+                else:
+                    await asyncio.sleep(min(0.05, remaining))
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+class ReadinessPolicy:
+    """就绪判定参数"""
+
+    def __init__(self, quiet_ms: int = 300, max_wait_ms: int = 2000, max_inflight: int = 2,
+                 scroll_max_wait_ms: int = 1000):
+        """
+        Args:
+            quiet_ms: DOM无变更持续多久视为静默
+            max_wait_ms: 硬上限（从domcontentloaded起算；与滚动上限合计不超过原固定等待的3秒）
+            max_inflight: 允许的进行中请求数（长轮询/统计脚本常驻连接，类似networkidle2）
+            scroll_max_wait_ms: 滚动触发懒加载后的等待上限
+        """
+        self.quiet_ms = quiet_ms
+        self.max_wait_ms = max_wait_ms
+        self.max_inflight = max_inflight
+        self.scroll_max_wait_ms = scroll_max_wait_ms
+
+    @classmethod
+    def from_env(cls) -> "ReadinessPolicy":
+        return cls(
+            quiet_ms=int(os.environ.get("PAGE_READY_QUIET_MS", "300")),
+            max_wait_ms=int(os.environ.get("PAGE_READY_MAX_WAIT_MS", "2000")),
+            max_inflight=int(os.environ.get("PAGE_READY_MAX_INFLIGHT", "2")),
+            scroll_max_wait_ms=int(os.environ.get("PAGE_READY_SCROLL_MAX_WAIT_MS", "1000")),
+        )
+
+
+async def wait_until_ready(page: Page, policy: ReadinessPolicy, tracker: Optional[RequestTracker] = None,
+                           max_wait_ms: Optional[int] = None) -> Dict:
+    """
+    等待页面就绪：DOM静默quiet_ms且进行中请求数不超过max_inflight，最多等待max_wait_ms
+
+    Returns:
+        {"ready_ms": 实际等待毫秒数, "reason": quiet|timeout|error, "inflight": 结束时进行中请求数}
+    """
+    cap_ms = policy.max_wait_ms if max_wait_ms is None else max_wait_ms
+    start = time.monotonic()
+    deadline = start + cap_ms / 1000
+    reason = READY_TIMEOUT
+
+    while True:
+        remaining_ms = (deadline - time.monotonic()) * 1000
+        if remaining_ms <= 0:
+            break
+        try:
+            dom_quiet = await page.evaluate(_DOM_QUIET_JS, [policy.quiet_ms, int(remaining_ms)])
+        except Exception as e:
+            # 客户端跳转会销毁执行上下文：等待新文档加载后重试
+            if page.is_closed():
+                reason = READY_ERROR
+                break
+            logger.debug(f"就绪检测中断（{e}），重试")
+            try:
+                await page.wait_for_load_state("domcontentloaded", timeout=max(remaining_ms, 1))
+            except Exception:
+                pass
+            continue
+        if not dom_quiet:
+            break
+        if tracker is None or tracker.inflight <= policy.max_inflight:
+            reason = READY_QUIET
+            break
+        # DOM已静默但仍有请求进行中（可能随后插入内容）：等请求回落后再确认一次DOM静默
+        if not await tracker.wait_below(policy.max_inflight, max(deadline - time.monotonic(), 0)):
+            break
+
+    return {
+        "ready_ms": int((time.monotonic() - start) * 1000),
+        "reason": reason,
+        "inflight": tracker.inflight if tracker else None,
+    }
+
+
+async def wait_for_paint(page: Page, timeout_ms: int = 1000):
+    """等待样式生效（两帧渲染），失败时退回短暂等待"""
+    try:
+        await asyncio.wait_for(page.evaluate(NEXT_PAINT_JS), timeout_ms / 1000)
+    except Exception:
+        await page.wait_for_timeout(100)
@@ -0,0 +1,230 @@
+"""
+段落选择器
+将页面文本切分为段落块，按规则关键词、必填字段和同义词做BM25相关性排序，
+在token预算内挑选最相关的段落，替代原来的 text[:N] 盲截断
+"""
+import logging
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from .token_estimator import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# 必填字段 → 检索词（与_build_extraction_prompt中的字段描述对应）
+FIELD_QUERY_TERMS = {
+    "phone": ["联系电话", "电话", "咨询电话", "联系方式", "tel"],
+    "address": ["办公地址", "地址", "通讯地址", "邮编", "邮政编码"],
+    "email": ["电子邮箱", "邮箱", "电子邮件", "email", "e-mail"],
+    "fax": ["传真"],
+    "office_hours": ["办公时间", "工作时间", "受理时间", "周一至周五", "工作日"],
+}
+
+_CJK_RE = re.compile(r"[一-鿿]")
+_TERM_RE = re.compile(r"[一-鿿]+|[a-z0-9@._\-]+")
+_REGEX_LITERAL_RE = re.compile(r"[一-鿿A-Za-z0-9]{2,}")
+
+
+def html_to_text(html_body: str) -> str:
+    """HTML转纯文本（去除script/style）"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_body or "", 'html.parser')
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup.get_text(separator="\n", strip=True)
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：中文按二元组切分（单字词保留单字），英文数字按词"""
+    terms: List[str] = []
+    for run in _TERM_RE.findall(text.lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+
+def build_query_terms(
+    rule: Optional[Dict] = None,
+    fields: Optional[List[str]] = None,
+    extra_terms: Optional[List[str]] = None,
+    expand_synonyms: bool = True
+) -> List[str]:
+    """
+    从规则定义、必填字段和同义词组构建检索词
+
+    Args:
+        rule: 规则定义（读取locator/evaluator/locate/targets中的关键词）
+        fields: 必填字段，如["phone", "address"]
+        extra_terms: 额外检索词
+        expand_synonyms: 是否按SynonymMapper扩展同义词
+    """
+    terms: List[str] = []
+
+    if rule:
+        terms.extend(rule.get("locator", {}).get("keywords", []))
+        evaluator = rule.get("evaluator", {})
+        terms.extend(evaluator.get("keywords", []))
+        fields = list(fields or []) + list(evaluator.get("required_fields", []))
+        terms.extend(rule.get("locate", {}).get("keywords_any", []))
+        for target in rule.get("targets", []) or []:
+            terms.extend(target.get("anchors_any", []))
+        # 正则只取其中的字面片段
+        for pattern in rule.get("pass_if_regex_any", []) or []:
+            terms.extend(_REGEX_LITERAL_RE.findall(pattern))
+        if rule.get("element"):
+            terms.append(rule["element"])
+
+    for field in fields or []:
+        terms.extend(FIELD_QUERY_TERMS.get(field, [field]))
+
+    terms.extend(extra_terms or [])
+
+    if expand_synonyms:
+        mapper = _get_synonym_mapper()
+        for term in list(terms):
+            canonical = mapper.find_canonical(term)
+            if canonical:
+                terms.append(canonical)
+                terms.extend(mapper.synonyms[canonical]["synonyms"])
+
+    # 去重并保持顺序
+    seen = set()
+    unique_terms = []
+    for term in terms:
+        if term and term not in seen:
+            seen.add(term)
+            unique_terms.append(term)
+    return unique_terms
+
+
+_synonym_mapper = None
+
+
+def _get_synonym_mapper():
+    global _synonym_mapper
+    if _synonym_mapper is None:
+        from .synonym_mapper import SynonymMapper
+        _synonym_mapper = SynonymMapper()
+    return _synonym_mapper
+
+
+class PassageSelector:
+    """基于BM25的段落选择器（纯本地计算）"""
+
+    def __init__(self, chunk_chars: int = 300, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            chunk_chars: 每个段落块的目标字符数
+            k1, b: BM25参数
+        """
+        self.chunk_chars = chunk_chars
+        self.k1 = k1
+        self.b = b
+
+    def split(self, text: str) -> List[str]:
+        """按行聚合为段落块，超长行按chunk_chars硬切"""
+        chunks: List[str] = []
+        buf: List[str] = []
+        size = 0
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            while len(line) > self.chunk_chars:
+                if buf:
+                    chunks.append("\n".join(buf))
+                    buf, size = [], 0
+                chunks.append(line[:self.chunk_chars])
+                line = line[self.chunk_chars:]
+            if size + len(line) > self.chunk_chars and buf:
+                chunks.append("\n".join(buf))
+                buf, size = [], 0
+            buf.append(line)
+            size += len(line)
+        if buf:
+            chunks.append("\n".join(buf))
+        return chunks
+
+    def score(self, chunks: List[str], query_terms: List[str]) -> List[float]:
+        """计算每个段落块的BM25得分"""
+        if not chunks:
+            return []
+        query = set()
+        for term in query_terms:
+            query.update(tokenize(term))
+        if not query:
+            return [0.0] * len(chunks)
+
+        docs = [Counter(tokenize(chunk)) for chunk in chunks]
+        lengths = [sum(doc.values()) for doc in docs]
+        avg_len = (sum(lengths) / len(lengths)) or 1.0
+        n = len(docs)
+        # 每个检索词的idf只计算一次（逐段落重复统计df会随段落数平方增长）
+        idf = {}
+        for term in query:
+            df = sum(1 for d in docs if term in d)
+            idf[term] = math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+        scores = []
+        for doc, length in zip(docs, lengths):
+            s = 0.0
+            for term in query:
+                tf = doc.get(term, 0)
+                if not tf:
+                    continue
+                s += idf[term] * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+            scores.append(s)
+        return scores
+
+    def select(self, texts: List[str], query_terms: List[str], token_budget: int) -> List[str]:
+        """
+        在token预算内从多个文档中挑选最相关的段落
+
+        Args:
+            texts: 文档文本列表（如多个页面）
+            query_terms: 检索词
+            token_budget: token预算
+
+        Returns:
+            与texts一一对应的选中文本（段落保持原文顺序，未选中的文档为空串）
+        """
+        chunks = []  # (doc_idx, chunk_idx, text)
+        for doc_idx, text in enumerate(texts):
+            for chunk_idx, chunk in enumerate(self.split(text or "")):
+                chunks.append((doc_idx, chunk_idx, chunk))
+
+        scores = self.score([c[2] for c in chunks], query_terms)
+        ranked = sorted(
+            (i for i, s in enumerate(scores) if s > 0),
+            key=lambda i: scores[i],
+            reverse=True
+        )
+        # 没有任何相关段落时退化为按原文顺序截取
+        if not ranked:
+            ranked = list(range(len(chunks)))
+
+        selected = []
+        used = 0
+        for i in ranked:
+            cost = estimate_tokens(chunks[i][2])
+            if used + cost > token_budget:
+                continue
+            selected.append(i)
+            used += cost
+
+        selected.sort(key=lambda i: (chunks[i][0], chunks[i][1]))
+        result = [[] for _ in texts]
+        for i in selected:
+            result[chunks[i][0]].append(chunks[i][2])
+
+        logger.debug(
+            f"段落选择: {len(chunks)}个段落中选中{len(selected)}个（约{used}/{token_budget} tokens）"
+        )
+        return ["\n".join(parts) for parts in result]
@@ -2,19 +2,41 @@ import asyncio
 import base64
 import logging
 import json
+import os
 import random
+import shutil
 import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Any, Awaitable, Callable, Dict, List, Tuple, Optional
 
 from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Response
 
+from .browser_cache import BrowserDiskCache, CacheMonitor
+from .browser_pool import BROWSER_LAUNCH_ARGS, CONTEXT_OPTIONS, BrowserPool, launch_cached_context
+from .capture_policy import (
+    CAPTURE_CLIP, CapturePolicy, capture_thumbnail, clip_rect, measure_page, to_image_coords, to_tile_coords,
+)
+from .evidence_annotator import LEGEND_BLOCK, LEGEND_OVERLAY, annotate_page
+from .fetch_scheduler import FetchScheduler, HostGate
+from .image_encoder import ImageEncoder
 from .models import TraceStep
+from .page_pool import PagePool
+from .resource_policy import DISCOVERY, EVIDENCE, ResourcePolicy
+from .page_readiness import READY_TIMEOUT, ReadinessPolicy, RequestTracker, wait_for_paint, wait_until_ready
 from .storage import RUNS_DIR, write_json
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+BLOCKED_STATUS_CODES = {403, 429}
+
+
+def defer_evidence_capture() -> bool:
+    """抓取阶段是否跳过截图（规则评估后只为证据引用的页面截图）"""
+    return os.environ.get("DEFER_EVIDENCE_CAPTURE", "true").lower() == "true"
+
+
 class FetchResult:
     def __init__(self, url: str, status_code: int, body: str, elapsed: float = 0, 
                  screenshot: str = "", snapshot: str = "", title: str = "", 
@@ -34,57 +56,141 @@ class FetchResult:
 
 
 class PlaywrightBrowserWorker:
-    def __init__(self, batch_id: str, site_id: str, headless: bool = True):
+    def __init__(self, batch_id: str, site_id: str, headless: bool = True, pool: Optional[BrowserPool] = None,
+                 host_gate: Optional[HostGate] = None):
         self.batch_id = batch_id
         self.site_id = site_id
         self.base_dir = RUNS_DIR / batch_id / f"site_{site_id}"
         self.base_dir.mkdir(parents=True, exist_ok=True)
         self.traces: List[TraceStep] = []
         self.headless = headless
+        # ✅ 批次级浏览器池：有池时run_site借用池中浏览器的隔离context，不再自行启动Chromium
+        self.pool = pool
         
         # Playwright objects
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
+        # ✅ 页面复用池（随context创建/关闭）
+        self.page_pool: Optional[PagePool] = None
+        self.resource_policy: Optional[ResourcePolicy] = None
+        self.max_pages = int(os.environ.get("MAX_PAGES_PER_CONTEXT", "4"))
+        # ✅ 站点内并发抓取：最多K个页面同时抓取，主机级并发与访问间隔由HostGate控制（可批次共享）
+        self.scheduler = FetchScheduler(
+            max_concurrency=int(os.environ.get("SITE_FETCH_CONCURRENCY", "3")),
+            host_gate=host_gate or HostGate.from_env(),
+        )
+        self._step_seq = 0
+        # ✅ 自适应就绪检测（DOM静默 + 进行中请求数，带硬上限），替代固定等待
+        self.readiness = ReadinessPolicy.from_env()
+        # ✅ 延迟取证：抓取阶段默认不截图（被拦截/验证码页面除外），由证据阶段按需截图
+        self.capture_during_crawl = not defer_evidence_capture()
+        # ✅ 证据截图策略（clip=只截取标注区域+边距，另存整页缩略图）
+        self.capture_policy = CapturePolicy.from_env()
+        # ✅ 截图转码（WebP/AVIF）与落盘交给进程池，抓取协程只提交原始截图
+        self.encoder = ImageEncoder.from_env()
+        # 输出文件名前缀（证据阶段为"evidence_"，与抓取阶段的文件区分）
+        self.file_prefix = ""
+        # ✅ 跨批次磁盘缓存（按域名持久化HTTP缓存；有浏览器池时由池管理）
+        self.disk_cache = pool.disk_cache if pool is not None else BrowserDiskCache.from_env()
+        self.disk_cached = False
+        self.cache_monitor: Optional[CacheMonitor] = None
+        self._cache_path: Optional[Path] = None
+        self._user_data_dir: Optional[str] = None
 
-    async def start(self):
-        """Initialize Playwright and Browser"""
+    async def start(self, url: Optional[str] = None):
+        """Initialize Playwright and Browser（传入站点url且启用磁盘缓存时使用域名缓存context）"""
         self.playwright = await async_playwright().start()
-        # Launch options
-        self.browser = await self.playwright.chromium.launch(
-            headless=self.headless,
-            args=[
-                '--disable-blink-features=AutomationControlled',
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-            ]
-        )
-        # Context with realistic User Agent and Locale
-        self.context = await self.browser.new_context(
-            viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 GovOpen-AutoAudit/1.0',
-            locale='zh-CN',
-            timezone_id='Asia/Shanghai',
-            ignore_https_errors=True # Government sites often have bad certs
+        self._cache_path = self.disk_cache.acquire(url) if url else None
+        if self._cache_path is not None:
+            self.context, self._user_data_dir = await launch_cached_context(
+                self.playwright, self.disk_cache, self._cache_path, self.headless
+            )
+            self.disk_cached = True
+        else:
+            # Launch options
+            self.browser = await self.playwright.chromium.launch(
+                headless=self.headless,
+                args=BROWSER_LAUNCH_ARGS,
+            )
+            # Context with realistic User Agent and Locale
+            self.context = await self.browser.new_context(**CONTEXT_OPTIONS)
+        await self._setup_context()
+
+    async def _setup_context(self):
+        """为当前context安装请求拦截策略并创建页面池"""
+        # ✅ 屏蔽与规则无关的重资源（发现抓取屏蔽图片/媒体/字体，证据截图保留图片）
+        # 挂载磁盘缓存时不使用route拦截（route会禁用HTTP缓存），改由CacheMonitor按主机屏蔽并统计缓存命中
+        self.resource_policy = ResourcePolicy.from_env()
+        await self.resource_policy.install(self.context, intercept=not self.disk_cached)
+        if self.disk_cached:
+            self.cache_monitor = CacheMonitor(self.resource_policy.url_block_patterns())
+        # 深度导航持有入口页的同时并发抓取K个页面，页面上限至少K+1
+        max_pages = max(self.max_pages, self.scheduler.max_concurrency + 1)
+        self.page_pool = PagePool(
+            self.context, max_pages=max_pages, viewport=CONTEXT_OPTIONS["viewport"],
+            on_create=self.cache_monitor.attach if self.cache_monitor else None,
         )
 
+    async def _teardown_context(self):
+        # 会话结束前等待截图编码完成（证据阶段随后读取截图路径）
+        await self.encoder.drain()
+        stats = self.encoder.snapshot()
+        if stats["images"] or stats["failed"]:
+            logger.info(
+                f"Site {self.site_id}: 截图编码{stats['images']}张（{stats['format']}），"
+                f"{stats['raw_bytes'] / 1024:.0f}KB → {stats['bytes'] / 1024:.0f}KB，平均{stats['avg_encode_ms']}ms"
+            )
+            write_json(self.base_dir / f"{self.file_prefix}image_encoder.json", stats)
+        if self.resource_policy:
+            stats = self.resource_policy.snapshot()
+            logger.info(
+                f"Site {self.site_id}: 屏蔽{stats['blocked']}个无关请求，"
+                f"估算节省{stats['estimated_bytes_saved'] / 1024 / 1024:.1f}MB"
+            )
+            write_json(self.base_dir / f"{self.file_prefix}resource_policy.json", stats)
+            self.resource_policy = None
+        if self.page_pool:
+            await self.page_pool.close()
+            stats = self.page_pool.snapshot()
+            logger.info(
+                f"Site {self.site_id}: 页面池新建{stats['created']}个、复用{stats['reused']}次"
+                f"（新建平均{stats['avg_create_ms']}ms，重置平均{stats['avg_reset_ms']}ms）"
+            )
+            write_json(self.base_dir / f"{self.file_prefix}page_pool.json", stats)
+            self.page_pool = None
+        if self.cache_monitor:
+            stats = self.cache_monitor.snapshot()
+            logger.info(
+                f"Site {self.site_id}: 磁盘缓存命中{stats['cache_hits']}个请求"
+                f"（{stats['cache_hit_bytes'] / 1024 / 1024:.1f}MB），网络下载{stats['network_bytes'] / 1024 / 1024:.1f}MB"
+            )
+            write_json(self.base_dir / f"{self.file_prefix}browser_cache.json", stats)
+            self.cache_monitor = None
+
     async def close(self):
         """Clean up resources"""
+        await self._teardown_context()
         if self.context:
             await self.context.close()
         if self.browser:
             await self.browser.close()
         if self.playwright:
             await self.playwright.stop()
+        if self._user_data_dir:
+            shutil.rmtree(self._user_data_dir, ignore_errors=True)
+            self._user_data_dir = None
+        if self._cache_path is not None:
+            await asyncio.to_thread(self.disk_cache.release, self._cache_path)
+            self._cache_path = None
+        self.disk_cached = False
 
-    def _write_screenshot(self, name: str, data: bytes) -> str:
-        path = self.base_dir / name
-        with path.open("wb") as f:
-            f.write(data)
-        return str(path)
+    def _submit_screenshot(self, stem: str, raw: bytes) -> str:
+        """提交截图编码（不等待），返回最终文件路径（扩展名由编码格式决定）"""
+        return self.encoder.submit(raw, self.base_dir / f"{self.file_prefix}{stem}")
 
     def _write_snapshot(self, name: str, html: str) -> str:
-        path = self.base_dir / name
+        path = self.base_dir / f"{self.file_prefix}{name}"
         path.write_text(html, encoding="utf-8")
         return str(path)
     
@@ -140,64 +246,113 @@ class PlaywrightBrowserWorker:
             except Exception as e:
                 logger.warning(f"Keywords highlight failed: {e}")
 
-    async def fetch(self, url: str, step: str, rule_hints: Optional[Dict] = None) -> FetchResult:
+    async def fetch(self, url: str, step: str, rule_hints: Optional[Dict] = None,
+                    capture: bool = True, keep_snapshot: bool = True,
+                    annotations: Optional[List[Dict]] = None,
+                    on_loaded: Optional[Callable[[Page], Awaitable[None]]] = None) -> FetchResult:
         """
         Navigate to a URL, capture evidence, and return result.
         rule_hints: Optional dictionary with 'locator' or text to highlight.
+        annotations: 证据阶段的合并标注项（见evidence_annotator.build_annotations），一次截图覆盖页面上所有规则
+        capture: 是否截图（False时仅被拦截/验证码页面截图，用于failures取证）
+        keep_snapshot: 是否保存HTML快照（证据阶段复用抓取阶段的快照）
+        on_loaded: 页面就绪后、归还页面前调用（如在已加载的入口页上收集导航链接，避免再次加载）
+
+        返回的screenshot/thumbnail/tiles路径在后台编码，读取文件前先await self.encoder.wait(path)
         """
         start = time.time()
         status_code = 0
         body = ""
         screenshot_path = ""
         snapshot_path = ""
+        ready = {"ready_ms": None, "reason": None}
+        layout = None
+        capture_meta: Dict[str, Any] = {}
+        # 并发抓取时按开始顺序分配文件编号
+        step_idx = self._step_seq
+        self._step_seq += 1
         
-        page = await self.context.new_page()
+        page = await self.page_pool.acquire()
+        cache_before = self.cache_monitor.page_totals(page) if self.cache_monitor else None
+        # 截图取证使用保留图片的evidence策略，仅抓取内容时屏蔽图片/媒体/字体
+        self.resource_policy.set_profile(page, EVIDENCE if capture else DISCOVERY)
+        tracker = RequestTracker(page).attach()
         
         try:
             # Navigate
-            # Use 'domcontentloaded' for speed, 'networkidle' for completeness. 
+            # Use 'domcontentloaded' for speed, then wait for adaptive readiness. 
             # Gov sites can be slow, so we set a generous timeout.
             response: Optional[Response] = await page.goto(url, timeout=30000, wait_until='domcontentloaded')
             
-            # Wait a bit for dynamic content
-            await page.wait_for_timeout(2000)
+            # 等待动态内容：DOM静默且请求空闲即就绪（有硬上限）
+            ready = await wait_until_ready(page, self.readiness, tracker)
             
             # Scroll to bottom to trigger lazy loading
             await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-            await page.wait_for_timeout(1000)
+            scrolled = await wait_until_ready(page, self.readiness, tracker,
+                                              max_wait_ms=self.readiness.scroll_max_wait_ms)
+            ready = {
+                "ready_ms": ready["ready_ms"] + scrolled["ready_ms"],
+                "reason": READY_TIMEOUT if READY_TIMEOUT in (ready["reason"], scrolled["reason"]) else ready["reason"],
+            }
+            logger.debug(f"{url} ready after {ready['ready_ms']}ms ({ready['reason']})")
             
             if response:
                 status_code = response.status
             
             body = await page.content()
             
+            if on_loaded is not None:
+                try:
+                    await on_loaded(page)
+                except Exception as e:
+                    logger.error(f"on_loaded failed for {url}: {e}")
+            
             # ✅ 启用红框标注：只要有rule_hints就标注（不需要highlight标志）
             if rule_hints:
                 try:
                     await self._highlight_elements(page, rule_hints)
                     # 等待CSS生效
-                    await page.wait_for_timeout(500)
+                    await wait_for_paint(page)
                     logger.info(f"为{url}启用红框标注")
                 except Exception as e:
                     logger.error(f"Highlighting failed for {url}: {e}")
             
-            screenshot_bytes = await page.screenshot(full_page=True, type='jpeg', quality=80) 
-            # Using JPEG to save space, full_page for complete evidence
+            # ✅ 合并标注：页面上所有规则的编号框与图例一次绘制，返回各规则在截图中的区域
+            if annotations:
+                clip_mode = self.capture_policy.mode == CAPTURE_CLIP
+                try:
+                    layout = await annotate_page(
+                        page, annotations,
+                        legend_mode=LEGEND_OVERLAY if clip_mode else LEGEND_BLOCK,
+                        margin=self.capture_policy.margin,
+                    )
+                    await wait_for_paint(page)
+                except Exception as e:
+                    logger.error(f"Annotation failed for {url}: {e}")
             
-            step_idx = len(self.traces)
-            screenshot_path = self._write_screenshot(f"screenshot_{step_idx}.jpg", screenshot_bytes)
-            snapshot_path = self._write_snapshot(f"snapshot_{step_idx}.html", body)
+            # 被拦截/验证码页面的截图是failures的证据，抓取时必须当场保留
+            blocked = status_code in BLOCKED_STATUS_CODES or "captcha" in body.lower()
+            if capture or blocked:
+                screenshot_path, capture_meta = await self._capture(page, step_idx, layout)
+            
+            if keep_snapshot:
+                snapshot_path = self._write_snapshot(f"snapshot_{step_idx}.html", body)
             
         except Exception as e:
             logger.error(f"Playwright fetch failed for {url}: {e}")
             # Capture error state if possible
             try:
-                screenshot_bytes = await page.screenshot(full_page=False)
-                screenshot_path = self._write_screenshot(f"error_{len(self.traces)}.jpg", screenshot_bytes)
+                screenshot_bytes = await page.screenshot(full_page=False, **self.encoder.screenshot_options())
+                screenshot_path = self._submit_screenshot(f"error_{step_idx}", screenshot_bytes)
             except:
                 pass
         finally:
             elapsed = time.time() - start
+            cache_delta = {}
+            if cache_before is not None:
+                cache_after = self.cache_monitor.page_totals(page)
+                cache_delta = {key: cache_after[key] - cache_before[key] for key in cache_before}
             self.traces.append(TraceStep(
                 step=step, 
                 url=url, 
@@ -205,14 +360,98 @@ class PlaywrightBrowserWorker:
                 elapsed=elapsed, 
                 screenshot=screenshot_path, 
                 snapshot=snapshot_path,
-                notes=str(rule_hints) if rule_hints else None
+                notes=(
+                    f"annotations: {', '.join(str(a['rule_id']) for a in annotations)}" if annotations
+                    else str(rule_hints) if rule_hints else None
+                ),
+                ready_ms=ready["ready_ms"],
+                ready_reason=ready["reason"],
+                tiles=capture_meta.get("tiles"),
+                page_height=capture_meta.get("page_height"),
+                cache_hits=cache_delta.get("cache_hits"),
+                cache_hit_bytes=cache_delta.get("cache_hit_bytes"),
+                network_bytes=cache_delta.get("network_bytes"),
             ))
-            await page.close()
+            tracker.detach()
+            self.resource_policy.set_profile(page, None)
+            await self.page_pool.release(page)
+
+        return FetchResult(url, status_code, body, elapsed, screenshot_path, snapshot_path, **capture_meta)
+
+    async def _capture(self, page: Page, step_idx: int, layout: Optional[Dict] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        按截图策略截图
 
-        return FetchResult(url, status_code, body, elapsed, screenshot_path, snapshot_path)
+        Returns:
+            (截图路径, 附加信息{"regions": 图片坐标的规则区域, "clip": 裁剪区域, "thumbnail": 缩略图路径,
+             "tiles": 超长页面的分块列表（截图路径为第一块，regions的框为{"tile", "x", "y", "width", "height"}分块坐标）})
+        """
+        policy = self.capture_policy
+        meta: Dict[str, Any] = {}
+        clip = None
+        if layout is not None and policy.mode == CAPTURE_CLIP:
+            clip = clip_rect(layout, policy.margin, policy.clip_max_height, CONTEXT_OPTIONS["viewport"])
+            meta["clip"] = clip
+
+        tiles = None
+        if clip is None:
+            # 整页截图前检查页面高度：超长页面按分块或顶部截取，避免整页位图撑爆渲染进程
+            try:
+                page_size = (layout or {}).get("page") or await measure_page(page)
+                tiles = policy.plan_tiles(page_size)
+            except Exception as e:
+                logger.debug(f"页面尺寸获取失败（按整页截图）: {e}")
+            if tiles and len(tiles) == 1 and tiles[0]["height"] >= page_size[1]:
+                tiles = None
+
+        if tiles:
+            meta["tiles"] = []
+            for n, tile in enumerate(tiles):
+                tile_bytes = await page.screenshot(full_page=True, clip=tile, **self.encoder.screenshot_options())
+                stem = f"screenshot_{step_idx}" if n == 0 else f"screenshot_{step_idx}_tile{n}"
+                meta["tiles"].append({"index": n, "path": self._submit_screenshot(stem, tile_bytes),
+                                      "y": tile["y"], "height": tile["height"]})
+            covered = tiles[-1]["y"] + tiles[-1]["height"]
+            meta["page_height"] = page_size[1]
+            meta["truncated"] = covered < page_size[1]
+            screenshot_path = meta["tiles"][0]["path"]
+            logger.info(
+                f"超长页面({page_size[1]}px)截取{len(tiles)}块共{covered}px"
+                f"（{policy.tall_page_mode}模式）: {page.url}"
+            )
+        else:
+            # full_page so that clip uses page coordinates; encoding happens off the event loop
+            screenshot_bytes = await page.screenshot(full_page=True, clip=clip, **self.encoder.screenshot_options())
+            screenshot_path = self._submit_screenshot(f"screenshot_{step_idx}", screenshot_bytes)
+
+        if layout is not None:
+            if tiles:
+                meta["regions"] = to_tile_coords(layout.get("regions", {}), meta["tiles"])
+            else:
+                meta["regions"] = to_image_coords(layout.get("regions", {}), clip)
+            if clip and policy.thumbnail and layout.get("page"):
+                try:
+                    thumb = await capture_thumbnail(
+                        page, layout["page"], policy.thumbnail_width, policy.thumbnail_max_height,
+                        self.encoder.capture_type, self.encoder.quality,
+                    )
+                    meta["thumbnail"] = self._submit_screenshot(f"thumb_{step_idx}", thumb)
+                except Exception as e:
+                    logger.debug(f"缩略图生成失败（忽略）: {e}")
+        return screenshot_path, meta
 
     def save_trace(self) -> str:
-        trace_path = self.base_dir / "trace.json"
+        trace_path = self.base_dir / f"{self.file_prefix}trace.json"
+        # 截图编码在后台完成，保存trace时补充图片大小与编码耗时
+        for trace in self.traces:
+            record = self.encoder.record_for(trace.screenshot)
+            if record:
+                trace.screenshot_bytes = record.get("bytes")
+                trace.encode_ms = record.get("encode_ms")
+            for tile in trace.tiles or []:
+                tile_record = self.encoder.record_for(tile["path"])
+                if tile_record:
+                    tile["bytes"] = tile_record.get("bytes")
         trace_data = [trace.__dict__ for trace in self.traces]
         write_json(trace_path, trace_data)
         return str(trace_path)
@@ -239,123 +478,164 @@ class PlaywrightBrowserWorker:
         ordered.extend(remaining[:per_list_random_m])
         return ordered[:max_content_pages]
 
+    @asynccontextmanager
+    async def _site_session(self, url: Optional[str] = None):
+        """
+        站点会话：有浏览器池时借用隔离context，否则自行启动浏览器；结束时保存trace
+
+        Args:
+            url: 站点地址（启用磁盘缓存时据此选择域名缓存目录）
+        """
+        if self.pool is not None:
+            async with self.pool.site_context(self.site_id, url) as context:
+                self.context = context
+                self.disk_cached = self.pool.is_disk_cached(context)
+                await self._setup_context()
+                try:
+                    yield
+                finally:
+                    await self._teardown_context()
+                    self.context = None
+                    self.disk_cached = False
+                    self.save_trace()
+            return
+
+        await self.start(url)
+        try:
+            yield
+        finally:
+            await self.close()
+            self.save_trace()
+
     async def run_site(self, site: Dict, sampling: Dict, extra_depth: int = 0, enable_deep_nav: bool = True) -> Tuple[List[FetchResult], List[FetchResult]]:
-        await self.start()
+        async with self._site_session(url=next(iter(site.get("entry_points") or []), None)):
+            return await self._crawl_site(site, sampling, extra_depth, enable_deep_nav)
+
+    async def capture_evidence(self, targets: List[Dict]) -> List[FetchResult]:
+        """
+        证据阶段：重新访问证据引用的页面，一次标注页面上的所有规则后截图
+
+        Args:
+            targets: [{"url": str, "annotations": [...]}, ...]（每个页面一项）
+
+        Returns:
+            与targets顺序一致的FetchResult（截图失败时screenshot为空）
+        """
+        self.file_prefix = "evidence_"
+        async with self._site_session(url=targets[0]["url"] if targets else None):
+            return await self.scheduler.map_items(
+                lambda target: self.fetch(
+                    target["url"], step="evidence", keep_snapshot=False, annotations=target.get("annotations")
+                ),
+                targets,
+                url_of=lambda target: target["url"],
+            )
+
+    async def _crawl_site(self, site: Dict, sampling: Dict, extra_depth: int, enable_deep_nav: bool) -> Tuple[List[FetchResult], List[FetchResult]]:
         entry_results: List[FetchResult] = []
         content_results: List[FetchResult] = []
         
-        try:
-            # 1. Visit Entry Points
-            for url in site.get("entry_points", []):
-                res = await self.fetch(url, step="entry")
-                entry_results.append(res)
+        nav_helper = None
+        entry_harvest: Dict[str, Dict] = {}
+        if enable_deep_nav:
+            from .navigation_helper import ANCHOR_PATTERNS, NavigationHelper
+            import os
+            
+            # ✅ 从环境变量读取配置
+            max_depth = int(os.environ.get("MAX_NAVIGATION_DEPTH", "5"))
+            max_links = int(os.environ.get("MAX_LINKS_PER_LEVEL", "15"))
             
-            # ✅ 新增: 深度导航 - 自动发现栏目链接
-            if enable_deep_nav:
-                from .navigation_helper import NavigationHelper, click_link_by_anchor
-                import os
+            logger.info(f"启用深度导航模式（深度{max_depth}层，每层最多{max_links}链接），从入口页发现政务栏目...")
+            nav_helper = NavigationHelper(
+                max_depth=max_depth, max_links_per_level=max_links, host_gate=self.scheduler.host_gate
+            )
+        
+        async def fetch_entry(url: str) -> FetchResult:
+            on_loaded = None
+            if nav_helper is not None:
+                # ✅ 入口页只加载一次：抓取时就在已加载的页面上收集导航链接和所有anchor组的子页面链接
+                async def on_loaded(page: Page):
+                    entry_harvest[url] = await nav_helper.harvest_entry(page, url, ANCHOR_PATTERNS)
+            return await self.fetch(url, step="entry", capture=self.capture_during_crawl, on_loaded=on_loaded)
+        
+        # 1. Visit Entry Points
+        entry_results.extend(await self.scheduler.map(fetch_entry, site.get("entry_points", [])))
+        
+        # ✅ 新增: 深度导航 - 自动发现栏目链接
+        if nav_helper is not None:
+            # 对每个入口页构建导航树
+            for entry_url in site.get("entry_points", []):
+                page = await self.page_pool.acquire()
+                try:
+                    # 构建导航树只需DOM，使用屏蔽图片/媒体的discovery策略
+                    self.resource_policy.set_profile(page, DISCOVERY)
+                    # 入口页链接已在抓取时收集（抓取失败时才由导航树重新加载入口页），这里只访问二级页面
+                    nav_tree = await nav_helper.build_navigation_tree(
+                        page, entry_url, anchor_patterns=ANCHOR_PATTERNS, entry_harvest=entry_harvest.get(entry_url)
+                    )
+                except Exception as e:
+                    logger.error(f"深度导航失败: {e}", exc_info=True)
+                    continue
+                finally:
+                    self.resource_policy.set_profile(page, None)
+                    await self.page_pool.release(page)
                 
-                # ✅ 从环境变量读取配置
-                max_depth = int(os.environ.get("MAX_NAVIGATION_DEPTH", "5"))
-                max_links = int(os.environ.get("MAX_LINKS_PER_LEVEL", "15"))
+                # 访问发现的深层链接（优先高优先级栏目）
+                discovered_urls = nav_tree.get("level_0", [])[:10]  # 最多10个level_0链接
+                discovered_urls += nav_tree.get("level_1", [])[:5]   # 最多5个level_1链接
                 
-                logger.info(f"启用深度导航模式（深度{max_depth}层，每层最多{max_links}链接），从入口页发现政务栏目...")
-                nav_helper = NavigationHelper(max_depth=max_depth, max_links_per_level=max_links)
+                # anchor子页面按URL去重（多个anchor组可能指向同一页面），已抓取或已在深层链接中的不重复抓取
+                anchor_names: Dict[str, List[str]] = {}
+                for link in nav_tree.get("anchor_links", []):
+                    anchor_names.setdefault(link["url"], []).append(link["anchor_name"])
+                fetched = {res.url: res for res in entry_results}
+                targets = [(url, "deep_nav") for url in discovered_urls]
+                targets += [
+                    (url, "anchor_nav") for url in anchor_names
+                    if url not in fetched and url not in discovered_urls
+                ]
                 
-                # 对每个入口页构建导航树
-                for entry_url in site.get("entry_points", []):
-                    page = await self.context.new_page()
-                    try:
-                        nav_tree = await nav_helper.build_navigation_tree(page, entry_url)
-                        
-                        # 访问发现的深层链接（优先高优先级栏目）
-                        discovered_urls = nav_tree.get("level_0", [])[:10]  # 最多10个level_0链接
-                        discovered_urls += nav_tree.get("level_1", [])[:5]   # 最多5个level_1链接
-                        
-                        logger.info(f"从{entry_url}发现{len(discovered_urls)}个深层链接，开始访问...")
-                        
-                        for nav_url in discovered_urls:
-                            res = await self.fetch(nav_url, step="deep_nav")
-                            entry_results.append(res)  # 深度导航的链接算作entry扩展
-                        
-                        # ✅ 新增：主动点击进入左侧导航子页面
-                        # 这些是机构信息等规则需要的子页面
-                        anchor_patterns = [
-                            # 机构信息相关
-                            ["机构职能", "机构职责", "部门职能"],
-                            ["机构设置", "内设机构", "组织机构"],
-                            ["机构领导", "领导分工", "领导信息"],
-                            ["办公地址", "联系方式", "联系我们"],
-                            ["办公时间", "工作时间"],
-                            # ✅ 新增：年报相关
-                            ["政府信息公开年报", "年报", "年度报告"],
-                            # 政府信息公开指南相关
-                            ["政府信息公开指南", "公开指南", "信息公开指南"],
-                            ["政府信息公开制度", "公开制度"],
-                        ]
-                        
-                        for anchors in anchor_patterns:
-                            try:
-                                # 先导航到入口页
-                                await page.goto(entry_url, timeout=10000)
-                                await page.wait_for_load_state("domcontentloaded")
-                                
-                                # 尝试点击匹配的链接
-                                result = await click_link_by_anchor(page, anchors, entry_url)
-                                
-                                if result:
-                                    # 截图并保存页面内容
-                                    screenshot_path = self.runs_dir / self.batch_id / f"site_{site['site_id']}" / f"anchor_{anchors[0]}.jpg"
-                                    screenshot_path.parent.mkdir(parents=True, exist_ok=True)
-                                    await page.screenshot(path=str(screenshot_path), type="jpeg", quality=80)
-                                    
-                                    # 构建FetchResult
-                                    fetch_res = FetchResult(
-                                        url=result["url"],
-                                        status_code=200,
-                                        body=result["body"],
-                                        title=result.get("title", ""),
-                                        screenshot=str(screenshot_path),
-                                        step="anchor_nav",
-                                        # ✅ 新增：存储anchor名称，规则引擎可按此匹配
-                                        anchor_name=anchors[0]
-                                    )
-                                    entry_results.append(fetch_res)
-                                    logger.info(f"✅ 成功访问子页面: {anchors[0]} -> {result['url']}")
-                                    
-                            except Exception as anchor_err:
-                                logger.debug(f"点击anchor失败 {anchors[0]}: {anchor_err}")
-                                continue
-                        
-                    except Exception as e:
-                        logger.error(f"深度导航失败: {e}", exc_info=True)
-                    finally:
-                        await page.close()
-            
-            # 2. Sample Content Pages
-            sampled_content = self.sample_content_urls(
-                site,
-                sampling.get("per_list_recent_n", 3),
-                sampling.get("per_list_random_m", 2),
-                sampling.get("max_content_pages_per_site", 30),
-            )
-            
-            for url in sampled_content:
-                res = await self.fetch(url, step="content")
-                content_results.append(res)
+                logger.info(
+                    f"从{entry_url}发现{len(discovered_urls)}个深层链接、{len(anchor_names)}个anchor子页面，开始访问..."
+                )
                 
-            # 3. Extra Depth (if needed)
-            for _ in range(extra_depth):
-                remaining = [u for u in site.get("content_paths", []) if u not in sampled_content]
-                if not remaining:
-                    break
-                url = remaining.pop(0)
-                sampled_content.append(url)
-                res = await self.fetch(url, step="content_deepen")
-                content_results.append(res)
+                # 深度导航与anchor子页面的链接算作entry扩展，统一走并发抓取
+                nav_results = await self.scheduler.map_items(
+                    lambda target: self.fetch(target[0], step=target[1], capture=self.capture_during_crawl),
+                    targets,
+                    url_of=lambda target: target[0],
+                )
+                entry_results.extend(nav_results)
+                fetched.update((url, res) for (url, _), res in zip(targets, nav_results))
                 
-        finally:
-            await self.close()
-            self.save_trace()
+                for url, names in anchor_names.items():
+                    res = fetched[url]
+                    # ✅ 存储anchor名称，规则引擎可按此匹配（同一页面可能对应多个anchor组）
+                    res.anchor_name = res.anchor_name or names[0]
+                    res.anchor_names = names
+                    logger.info(f"✅ 访问子页面: {'、'.join(names)} -> {url}")
+        
+        # 2. Sample Content Pages
+        sampled_content = self.sample_content_urls(
+            site,
+            sampling.get("per_list_recent_n", 3),
+            sampling.get("per_list_random_m", 2),
+            sampling.get("max_content_pages_per_site", 30),
+        )
+        
+        content_results.extend(await self.scheduler.map(
+            lambda url: self.fetch(url, step="content", capture=self.capture_during_crawl), sampled_content
+        ))
             
+        # 3. Extra Depth (if needed)
+        for _ in range(extra_depth):
+            remaining = [u for u in site.get("content_paths", []) if u not in sampled_content]
+            if not remaining:
+                break
+            url = remaining.pop(0)
+            sampled_content.append(url)
+            async with self.scheduler.slot(url):
+                res = await self.fetch(url, step="content_deepen", capture=self.capture_during_crawl)
+            content_results.append(res)
+
         return entry_results, content_results
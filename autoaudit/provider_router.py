@@ -0,0 +1,198 @@
+"""
+AI Provider路由
+按Provider维护滚动延迟/错误统计，对持续失败的Provider打开熔断器，
+并把调用路由到当前最快的健康Provider
+"""
+import logging
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+from .ai_ledger import percentile
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class ProviderStats:
+    """单个Provider的滚动统计与熔断状态"""
+
+    def __init__(self, provider: str, window: int):
+        self.provider = provider
+        self.model: Optional[str] = None
+        self.samples = deque(maxlen=window)  # (latency_ms, success)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_started = 0.0  # 半开状态下探测调用的放行时间（0表示无探测在途）
+        self.total_calls = 0
+        self.total_failures = 0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def latency_pct(self, pct: float) -> float:
+        """成功调用的延迟分位数（ms）"""
+        return percentile([lat for lat, ok in self.samples if ok], pct)
+
+    @property
+    def has_latency(self) -> bool:
+        return any(ok for _, ok in self.samples)
+
+
+class ProviderRouter:
+    """基于滚动延迟与熔断器的Provider路由"""
+
+    def __init__(
+        self,
+        window: int = 20,
+        failure_threshold: int = 5,
+        error_rate_threshold: float = 0.5,
+        cooldown_sec: float = 60.0
+    ):
+        """
+        Args:
+            window: 滚动统计窗口（最近N次调用）
+            failure_threshold: 连续失败N次打开熔断
+            error_rate_threshold: 窗口内错误率达到该值（且样本数≥failure_threshold）打开熔断
+            cooldown_sec: 熔断打开后多久进入半开状态（放行一次探测调用）
+        """
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.cooldown_sec = cooldown_sec
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ProviderStats] = {}
+        self.decisions = Counter()  # "deepseek>qwen (reason)" -> 次数
+        self.recent_decisions = deque(maxlen=50)
+
+    def _get(self, provider: str) -> ProviderStats:
+        if provider not in self._stats:
+            self._stats[provider] = ProviderStats(provider, self.window)
+        return self._stats[provider]
+
+    def record(self, invocation):
+        """根据AiInvocation记录更新统计与熔断状态"""
+        with self._lock:
+            stats = self._get(invocation.provider)
+            stats.model = invocation.model
+            stats.samples.append((invocation.latency_ms, invocation.success))
+            stats.total_calls += 1
+            stats.probe_started = 0.0
+
+            if invocation.success:
+                stats.consecutive_failures = 0
+                if stats.state != CLOSED:
+                    logger.info(f"Provider {invocation.provider} 探测成功，熔断器关闭")
+                stats.state = CLOSED
+                return
+
+            stats.total_failures += 1
+            stats.consecutive_failures += 1
+            should_open = (
+                stats.state == HALF_OPEN
+                or stats.consecutive_failures >= self.failure_threshold
+                or (len(stats.samples) >= self.failure_threshold
+                    and stats.error_rate >= self.error_rate_threshold)
+            )
+            if should_open and stats.state != OPEN:
+                stats.state = OPEN
+                stats.opened_at = time.time()
+                logger.warning(
+                    f"Provider {invocation.provider} 熔断器打开 "
+                    f"(连续失败{stats.consecutive_failures}次, 错误率{stats.error_rate:.0%})"
+                )
+
+    def _refresh_state(self, stats: ProviderStats):
+        if stats.state == OPEN and time.time() - stats.opened_at >= self.cooldown_sec:
+            stats.state = HALF_OPEN
+            logger.info(f"Provider {stats.provider} 熔断器半开，放行探测调用")
+
+    def route(self, candidates: List[str]) -> List[str]:
+        """
+        返回本次调用的Provider尝试顺序
+
+        健康Provider按滚动p50延迟升序（无样本的保持配置顺序，排在有样本的之后），
+        熔断打开的Provider排除；半开的Provider只放行一个探测调用（探测在途时其他调用视同熔断，
+        探测超过cooldown_sec仍无结果——如调用方在更快的Provider成功后未尝试它——则重新放行）；
+        全部熔断时按配置顺序全部放行
+        """
+        with self._lock:
+            healthy = []
+            for idx, provider in enumerate(candidates):
+                stats = self._get(provider)
+                self._refresh_state(stats)
+                if stats.state == OPEN:
+                    continue
+                if stats.state == HALF_OPEN:
+                    now = time.time()
+                    if stats.probe_started and now - stats.probe_started < self.cooldown_sec:
+                        continue
+                    stats.probe_started = now
+                latency = stats.latency_pct(50) if stats.has_latency else float("inf")
+                healthy.append((latency, idx, provider))
+
+            if healthy:
+                order = [p for _, _, p in sorted(healthy)]
+                skipped = [p for p in candidates if p not in order]
+                if skipped:
+                    reason = f"circuit_open:{','.join(skipped)}"
+                elif order != list(candidates):
+                    reason = "faster_provider"
+                else:
+                    reason = "default_order"
+            else:
+                order = list(candidates)
+                reason = "all_circuits_open"
+
+            decision = f"{'>'.join(order)} ({reason})"
+            self.decisions[decision] += 1
+            self.recent_decisions.append({
+                "timestamp": time.time(),
+                "order": order,
+                "reason": reason,
+            })
+            if reason != "default_order":
+                logger.info(f"Provider路由: {decision}")
+            return order
+
+    def latency_percentile(self, provider: str, pct: float, min_samples: int = 5) -> Optional[float]:
+        """Provider成功调用的延迟分位数（ms）；样本不足时返回None"""
+        with self._lock:
+            stats = self._stats.get(provider)
+            if stats is None:
+                return None
+            latencies = [lat for lat, ok in stats.samples if ok]
+            if len(latencies) < min_samples:
+                return None
+            return percentile(latencies, pct)
+
+    def snapshot(self) -> Dict:
+        """各Provider的滚动统计与熔断状态"""
+        with self._lock:
+            providers = {}
+            for provider, stats in self._stats.items():
+                self._refresh_state(stats)
+                providers[provider] = {
+                    "model": stats.model,
+                    "state": stats.state,
+                    "window_calls": len(stats.samples),
+                    "window_error_rate": round(stats.error_rate, 3),
+                    "p50_latency_ms": int(stats.latency_pct(50)),
+                    "p95_latency_ms": int(stats.latency_pct(95)),
+                    "consecutive_failures": stats.consecutive_failures,
+                    "total_calls": stats.total_calls,
+                    "total_failures": stats.total_failures,
+                }
+            return {
+                "providers": providers,
+                "decisions": dict(self.decisions),
+            }
@@ -50,6 +50,8 @@ def generate_markdown_report(
     md.append(f"- **通过率**: {pass_rate:.1%}\n")
     md.append(f"- **失败率**: {fail_rate:.1%}\n")
     md.append(f"- **不确定率**: {uncertain_rate:.1%}\n")
+    if stats.get('ai_review_skipped'):
+        md.append(f"- **因预算未AI复核**: {stats['ai_review_skipped']} 条规则（见 ai_review_skipped.json）\n")
     md.append("\n---\n\n")
     
     # 站点结果概览
@@ -123,7 +125,7 @@ def generate_markdown_report(
     # 证据
     md.append("## 📦 证据包\n\n")
     md.append("所有证据文件已打包至 `evidence.zip`，包含：\n")
-    md.append("- 截图文件 (`.jpg`)\n")
+    md.append("- 截图文件 (`.webp`，未安装Pillow时为`.jpg`)\n")
     md.append("- 页面快照 (`.html`)\n")
     md.append("- 追踪日志 (`trace.json`)\n\n")
     
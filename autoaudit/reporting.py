@@ -45,6 +45,7 @@ def summarize(batch_id: str, site_results: List[Dict], rule_pack_id: str, versio
             "pass_rate": round(rule_stats["PASS"] / total_rules, 3) if total_rules > 0 else 0,
             "fail_rate": round(rule_stats["FAIL"] / total_rules, 3) if total_rules > 0 else 0,
             "uncertain_rate": round(rule_stats["UNCERTAIN"] / total_rules, 3) if total_rules > 0 else 0,
+            "ai_review_skipped": 0,
         },
         
         "site_results": []
@@ -106,6 +107,22 @@ def summarize(batch_id: str, site_results: List[Dict], rule_pack_id: str, versio
         "total_failures": len(failures)
     }
     
+    # ✅ 因token预算不足未进行AI复核的规则（按复核价值降序）
+    skipped = []
+    for result in site_results:
+        for rule_result in result.get("rule_results", []):
+            if rule_result.get("ai_review_skipped"):
+                skipped.append({
+                    "rule_id": rule_result.get("rule_id"),
+                    "site_id": result["site_id"],
+                    "status": rule_result.get("status"),
+                    "reason": rule_result.get("reason"),
+                    "skipped_because": rule_result["ai_review_skipped"],
+                    "review_value": rule_result.get("ai_review_value"),
+                })
+    skipped.sort(key=lambda x: x["review_value"] or 0, reverse=True)
+    summary["statistics"]["ai_review_skipped"] = len(skipped)
+    
     # 写入文件
     base_dir = RUNS_DIR / batch_id / "export"
     base_dir.mkdir(parents=True, exist_ok=True)
@@ -113,10 +130,12 @@ def summarize(batch_id: str, site_results: List[Dict], rule_pack_id: str, versio
     summary_path = base_dir / "summary.json"
     issues_path = base_dir / "issues.json"
     failures_path = base_dir / "failures.json"
+    skipped_path = base_dir / "ai_review_skipped.json"
     
     write_json(summary_path, summary)
     write_json(issues_path, issues_data)
     write_json(failures_path, failures_data)
+    write_json(skipped_path, {"rules": skipped, "total_skipped": len(skipped)})
     
     evidence_zip = create_evidence_zip(batch_id)
     
@@ -130,7 +149,8 @@ def summarize(batch_id: str, site_results: List[Dict], rule_pack_id: str, versio
         "issues": str(issues_path),
         "failures": str(failures_path),
         "evidence_zip": evidence_zip,
-        "report": str(report_path)  # ✅ 新增report.md
+        "report": str(report_path),  # ✅ 新增report.md
+        "ai_review_skipped": str(skipped_path),
     }
 
 
@@ -0,0 +1,211 @@
+"""
+请求拦截策略（屏蔽与政务公开规则无关的重资源）
+在BrowserContext上按资源类型和主机模式中止请求；发现抓取（discovery）屏蔽图片/媒体/字体，
+证据截图（evidence）保留图片和字体以保证截图真实；统计每个站点被屏蔽的请求和估算节省的流量
+"""
+import fnmatch
+import logging
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import BrowserContext, Page, Response, Route
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY = "discovery"
+EVIDENCE = "evidence"
+OFF = "off"
+
+# 第三方统计与在线客服组件（与公开规则无关，且常拖慢页面）
+# 注意：不屏蔽"我为政府网站找错"、无障碍等政务网站规范要求的组件
+DEFAULT_BLOCK_HOSTS = [
+    "hm.baidu.com",          # 百度统计
+    "*.cnzz.com",            # CNZZ/友盟统计
+    "*.umeng.com",
+    "*.51.la",
+    "*.growingio.com",
+    "*.google-analytics.com",
+    "*.googletagmanager.com",
+    "*.doubleclick.net",
+    "tajs.qq.com",
+    "*.53kf.com",            # 在线客服
+    "*.sobot.com",
+    "*.udesk.cn",
+    "*.qiyukf.com",
+    "*.easemob.com",
+]
+
+DEFAULT_PROFILE_TYPES = {
+    DISCOVERY: {"image", "media", "font"},
+    EVIDENCE: {"media"},
+    OFF: set(),
+}
+
+# 无法读取Content-Length时按资源类型估算单个请求大小（字节）
+TYPICAL_BYTES = {
+    "image": 80_000,
+    "media": 1_000_000,
+    "font": 60_000,
+    "script": 40_000,
+    "stylesheet": 20_000,
+    "xhr": 5_000,
+    "fetch": 5_000,
+}
+DEFAULT_TYPICAL_BYTES = 10_000
+
+
+def _split_env(name: str) -> Optional[List[str]]:
+    value = os.environ.get(name)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+class ResourcePolicy:
+    """单个BrowserContext的请求拦截策略（按页面切换profile）"""
+
+    def __init__(self, profile_types: Optional[Dict[str, Iterable[str]]] = None,
+                 block_hosts: Optional[List[str]] = None, default_profile: str = DISCOVERY):
+        """
+        Args:
+            profile_types: profile -> 需屏蔽的resource_type集合
+            block_hosts: 需屏蔽的主机模式（fnmatch，*.example.com 同时匹配 example.com）
+            default_profile: 未指定profile的页面使用的策略
+        """
+        self.profile_types = {
+            name: set(types) for name, types in (profile_types or DEFAULT_PROFILE_TYPES).items()
+        }
+        self.profile_types.setdefault(OFF, set())
+        self.block_hosts = list(DEFAULT_BLOCK_HOSTS if block_hosts is None else block_hosts)
+        self.default_profile = default_profile
+        self._page_profiles: Dict[Page, str] = {}
+        self._observed_bytes = Counter()   # resource_type -> 已加载字节（Content-Length）
+        self._observed_count = Counter()
+        self.blocked_by_type = Counter()
+        self.blocked_by_host = Counter()
+        self.estimated_bytes_saved = 0
+        self.allowed = 0
+        self.intercept = True
+
+    @classmethod
+    def from_env(cls) -> "ResourcePolicy":
+        profile_types = {k: set(v) for k, v in DEFAULT_PROFILE_TYPES.items()}
+        for name, env in ((DISCOVERY, "RESOURCE_BLOCK_DISCOVERY_TYPES"), (EVIDENCE, "RESOURCE_BLOCK_EVIDENCE_TYPES")):
+            types = _split_env(env)
+            if types is not None:
+                profile_types[name] = set(types)
+        block_hosts = list(DEFAULT_BLOCK_HOSTS)
+        block_hosts += _split_env("RESOURCE_BLOCK_EXTRA_HOSTS") or []
+        default_profile = os.environ.get("RESOURCE_BLOCK_PROFILE", DISCOVERY)
+        if default_profile not in profile_types:
+            logger.warning(f"未知的RESOURCE_BLOCK_PROFILE={default_profile}，使用{DISCOVERY}")
+            default_profile = DISCOVERY
+        return cls(profile_types, block_hosts, default_profile)
+
+    async def install(self, context: BrowserContext, intercept: bool = True):
+        """
+        Args:
+            intercept: 是否通过route拦截请求。route会禁用浏览器HTTP缓存，使用持久磁盘缓存时传False，
+                由CacheMonitor以CDP Network.setBlockedURLs按url_block_patterns()屏蔽主机（不按资源类型屏蔽）
+        """
+        self.intercept = intercept
+        context.on("response", self._on_response)
+        if intercept:
+            await context.route("**/*", self._handle)
+        else:
+            context.on("requestfailed", self._on_request_failed)
+
+    def url_block_patterns(self) -> List[str]:
+        """block_hosts对应的CDP URL通配模式"""
+        patterns = []
+        for host in self.block_hosts:
+            if host.startswith("*."):
+                patterns += [f"*://{host}/*", f"*://{host[2:]}/*"]
+            else:
+                patterns.append(f"*://{host}/*")
+        return patterns
+
+    def set_profile(self, page: Page, profile: Optional[str]):
+        """为页面指定profile（None恢复默认）；页面池复用页面时需重新指定"""
+        if profile is None:
+            self._page_profiles.pop(page, None)
+        else:
+            self._page_profiles[page] = profile
+
+    def _profile_for(self, route: Route) -> str:
+        try:
+            page = route.request.frame.page
+        except Exception:  # Service Worker等请求没有frame
+            return self.default_profile
+        return self._page_profiles.get(page, self.default_profile)
+
+    def _host_blocked(self, host: str) -> bool:
+        for pattern in self.block_hosts:
+            if fnmatch.fnmatch(host, pattern):
+                return True
+            if pattern.startswith("*.") and host == pattern[2:]:
+                return True
+        return False
+
+    def _estimate_bytes(self, resource_type: str) -> int:
+        if self._observed_count[resource_type]:
+            return self._observed_bytes[resource_type] // self._observed_count[resource_type]
+        return TYPICAL_BYTES.get(resource_type, DEFAULT_TYPICAL_BYTES)
+
+    async def _handle(self, route: Route):
+        request = route.request
+        profile = self._profile_for(route)
+        resource_type = request.resource_type
+        host = (urlparse(request.url).hostname or "").lower()
+
+        blocked_type = resource_type in self.profile_types.get(profile, ())
+        blocked_host = profile != OFF and self._host_blocked(host)
+        if blocked_type or blocked_host:
+            self.blocked_by_type[resource_type] += 1
+            if blocked_host:
+                self.blocked_by_host[host] += 1
+            self.estimated_bytes_saved += self._estimate_bytes(resource_type)
+            try:
+                await route.abort("blockedbyclient")
+            except Exception as e:
+                logger.debug(f"中止请求失败（忽略）: {e}")
+            return
+
+        self.allowed += 1
+        try:
+            await route.continue_()
+        except Exception as e:
+            logger.debug(f"放行请求失败（忽略）: {e}")
+
+    def _on_request_failed(self, request):
+        """非拦截模式下统计被setBlockedURLs屏蔽的请求"""
+        if "ERR_BLOCKED_BY_CLIENT" not in (request.failure or ""):
+            return
+        host = (urlparse(request.url).hostname or "").lower()
+        self.blocked_by_type[request.resource_type] += 1
+        self.blocked_by_host[host] += 1
+        self.estimated_bytes_saved += self._estimate_bytes(request.resource_type)
+
+    def _on_response(self, response: Response):
+        """记录已加载资源的大小，用于估算被屏蔽资源的节省量"""
+        try:
+            length = int(response.headers.get("content-length", 0))
+        except (TypeError, ValueError):
+            return
+        if length > 0:
+            resource_type = response.request.resource_type
+            self._observed_bytes[resource_type] += length
+            self._observed_count[resource_type] += 1
+
+    def snapshot(self) -> Dict:
+        return {
+            "default_profile": self.default_profile,
+            "intercept": self.intercept,
+            "allowed": self.allowed,
+            "blocked": sum(self.blocked_by_type.values()),
+            "blocked_by_type": dict(self.blocked_by_type),
+            "blocked_by_host": dict(self.blocked_by_host.most_common(20)),
+            "estimated_bytes_saved": self.estimated_bytes_saved,
+        }
@@ -0,0 +1,168 @@
+"""
+AI复核按价值调度
+UNCERTAIN规则的AI复核不再按规则文件顺序即时执行，而是进入按期望价值
+（扣分值deduct_if_fail/score × 严重程度 × 站点优先级）排序的队列，由固定数量的复核线程
+从高到低取出执行（批次内跨站点共享，站点评估期间即开始复核）；
+预算不足而跳过的规则会被标记并在导出中单独列出
+"""
+import heapq
+import itertools
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_WEIGHT = {"critical": 3.0, "penalty": 2.0, "warn": 1.0, "info": 0.5}
+DEFAULT_SITE_PRIORITY = 5
+MIN_DEDUCTION = 0.1  # 无扣分值的规则仍可复核，但排在最后
+
+REVIEWED = "reviewed"
+BUDGET_SKIPPED = "budget"
+FAILED = "failed"
+
+
+def rule_deduction(rule: Dict) -> float:
+    """规则失败时的扣分值（优先使用deduct_if_fail，与RuleEngine一致）"""
+    try:
+        return abs(float(rule.get("deduct_if_fail", rule.get("score", 0)) or 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def review_value(rule: Dict, site_priority: Optional[float] = None) -> float:
+    """AI复核的期望价值：扣分值 × 严重程度权重 × 站点优先级（0-10，默认5）"""
+    priority = DEFAULT_SITE_PRIORITY if site_priority is None else site_priority
+    return (
+        max(rule_deduction(rule), MIN_DEDUCTION)
+        * SEVERITY_WEIGHT.get(rule.get("severity"), 1.0)
+        * max(priority, 0.5) / DEFAULT_SITE_PRIORITY
+    )
+
+
+@dataclass
+class PendingReview:
+    """一条待AI复核的UNCERTAIN规则"""
+    engine: Any              # 所属RuleEngine（负责执行复核并更新result）
+    rule: Dict
+    reason: str
+    pages: List[Dict]        # 轻量页面（纯文本body），避免批次结束前持有全部HTML
+    result: Dict             # 已放入规则结果列表的UNCERTAIN结果，复核后原地更新
+    site_id: Optional[str] = None
+    value: float = 0.0
+    features: Dict = field(default_factory=dict)  # 分诊特征（复核后写入训练样本）
+
+
+class ReviewScheduler:
+    """
+    待复核规则的价值优先队列（线程安全，可在批次内跨站点共享）
+
+    start()后由concurrency个复核线程持续按价值从高到低取出执行，复核完成即释放页面文本；
+    未start()时由run()在调用线程内一次性按价值复核（单站点场景）
+    """
+
+    def __init__(self, concurrency: int = 0):
+        """
+        Args:
+            concurrency: 复核线程数（BatchRunner按AI_REVIEW_CONCURRENCY设置；0表示只用run()同步执行）
+        """
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue: List = []  # 堆：(-value, 序号, PendingReview)
+        self._seq = itertools.count()
+        self._outstanding: Dict[Optional[str], int] = {}  # site_id -> 未完成的复核数
+        self._workers: List[threading.Thread] = []
+        self._closed = False
+        self.reviewed = 0
+        self.failed = 0
+        self.skipped: List[Dict] = []
+
+    def submit(self, pending: PendingReview):
+        with self._lock:
+            heapq.heappush(self._queue, (-pending.value, next(self._seq), pending))
+            self._outstanding[pending.site_id] = self._outstanding.get(pending.site_id, 0) + 1
+            self._changed.notify()
+
+    def start(self):
+        """启动复核线程"""
+        for n in range(self.concurrency):
+            worker = threading.Thread(target=self._work, name=f"ai_review_{n}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._changed.wait()
+                if not self._queue:
+                    return
+                _, _, pending = heapq.heappop(self._queue)
+            self._execute(pending)
+
+    def _execute(self, pending: PendingReview):
+        try:
+            outcome = pending.engine._apply_ai_review(pending)
+        except Exception as e:
+            logger.error(f"AI复核异常: {e}")
+            outcome = FAILED
+        pending.pages = []  # 复核完成后不再持有页面文本
+        with self._lock:
+            if outcome == BUDGET_SKIPPED:
+                self.skipped.append({
+                    "site_id": pending.site_id,
+                    "rule_id": pending.rule.get("rule_id"),
+                    "reason": pending.reason,
+                    "deduct_if_fail": rule_deduction(pending.rule),
+                    "severity": pending.rule.get("severity"),
+                    "value": round(pending.value, 3),
+                })
+            elif outcome == FAILED:
+                self.failed += 1
+            else:
+                self.reviewed += 1
+            self._outstanding[pending.site_id] -= 1
+            self._changed.notify_all()
+
+    def wait_site(self, site_id: Optional[str]):
+        """等待某站点提交的复核全部完成（站点据此在复核后再截取证据）"""
+        with self._lock:
+            while self._outstanding.get(site_id):
+                self._changed.wait()
+
+    def close(self):
+        """等待队列清空并停止复核线程"""
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        for worker in self._workers:
+            worker.join()
+        if self._workers and self.skipped:
+            logger.warning(f"预算不足，{len(self.skipped)}条规则未进行AI复核")
+        self._workers = []
+        self.run()  # 未启动线程时在当前线程执行剩余复核
+
+    def run(self):
+        """在调用线程内按价值降序复核队列中的所有规则（预算不足的规则标记跳过后继续尝试更小的）"""
+        with self._lock:
+            queue = [heapq.heappop(self._queue)[2] for _ in range(len(self._queue))]
+        if not queue:
+            return
+        logger.info(
+            f"AI复核调度: {len(queue)}条规则，按价值排序（最高{queue[0].value:.2f}，最低{queue[-1].value:.2f}）"
+        )
+        for pending in queue:
+            self._execute(pending)
+        if self.skipped:
+            logger.warning(f"预算不足，{len(self.skipped)}条规则未进行AI复核")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "reviewed": self.reviewed,
+                "failed": self.failed,
+                "budget_skipped": len(self.skipped),
+                "skipped_rules": list(self.skipped),
+            }
@@ -1,7 +1,10 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 import logging
+import os
 
 from .models import Evidence, EvidenceCache
+from .review_scheduler import BUDGET_SKIPPED, REVIEWED, PendingReview, ReviewScheduler, review_value
+from .review_scheduler import FAILED as FAILED_REVIEW
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +15,78 @@ NOT_ASSESSABLE = "NOT-ASSESSABLE"
 
 
 class RuleEngine:
-    def __init__(self, rules: List[Dict]):
+    def __init__(self, rules: List[Dict], budget=None, site_id: Optional[str] = None, router=None, ledger=None, singleflight=None, triage=None,
+                 review_scheduler: Optional[ReviewScheduler] = None, site_priority: Optional[float] = None,
+                 token_estimator=None):
+        """
+        Args:
+            rules: 规则列表
+            budget: 批次共享的TokenBudget（为空时AIExtractor使用独立预算）
+            site_id: 站点ID，用于预算公平份额
+            router: 批次共享的ProviderRouter（为空时AIExtractor使用独立路由统计）
+            ledger: 批次共享的InvocationLedger（AI调用流水账）
+            singleflight: 批次共享的SingleFlight（合并跨站点的相同AI请求）
+            triage: 批次共享的TriageClassifier（UNCERTAIN规则在LLM复核前本地分诊）
+            review_scheduler: 批次共享的ReviewScheduler（为空时evaluate结束前在本站点内按价值复核）
+            site_priority: 站点优先级（0-10，默认5），参与AI复核价值排序
+            token_estimator: 批次共享的TokenEstimator（跨站点累积估算校准）
+        """
         self.rules = rules
         self.evidence_cache = EvidenceCache()  # ✅ 新增缓存
+        self.budget = budget
+        self.site_id = site_id
+        self.router = router
+        self.ledger = ledger
+        self.singleflight = singleflight
+        self.token_estimator = token_estimator
+        self.triage = triage
+        self.review_scheduler = review_scheduler
+        self.site_priority = site_priority
+        self._local_reviews = ReviewScheduler()
+        self._ai_extractor = None
+        self._page_texts: Dict[str, str] = {}
+
+    def _get_ai_extractor(self):
+        """字段提取与UNCERTAIN复核共享同一个AIExtractor（共享批次预算）"""
+        if self._ai_extractor is None:
+            from .ai_extractor import AIExtractor
+            self._ai_extractor = AIExtractor(
+                primary_provider="deepseek",
+                fallback_provider="qwen",
+                budget=self.budget,
+                site_id=self.site_id,
+                router=self.router,
+                ledger=self.ledger,
+                singleflight=self.singleflight,
+                token_estimator=self.token_estimator
+            )
+        return self._ai_extractor
+
+    def _get_triage(self):
+        if self.triage is None:
+            from .triage import TriageClassifier
+            self.triage = TriageClassifier(
+                threshold=float(os.environ.get("AI_TRIAGE_THRESHOLD", "0.9")),
+                min_content_chars=int(os.environ.get("AI_TRIAGE_MIN_CONTENT_CHARS", "200")),
+            )
+        return self.triage
+
+    def _texts_for(self, pages: List[Dict]) -> List[str]:
+        """页面纯文本（按URL缓存，同一站点多条规则复用）"""
+        from .passage_selector import html_to_text
+        texts = []
+        for page in pages:
+            key = page.get("url") or str(id(page))
+            if key not in self._page_texts:
+                self._page_texts[key] = html_to_text(page.get("body", ""))
+            texts.append(self._page_texts[key])
+        return texts
+
+    def get_ai_stats(self) -> Dict:
+        """本站点的AI调用统计（未调用AI时为空）"""
+        if self._ai_extractor is None:
+            return {}
+        return self._ai_extractor.get_invocation_stats()
 
     def evaluate(self, pages: List[Dict], failures: List[Dict]) -> List[Dict]:
         results: List[Dict] = []
@@ -28,6 +100,8 @@ class RuleEngine:
                 continue
             result = self._evaluate_rule(rule, pages)
             results.append(result)
+        # 未接入批次调度器时，在本站点内按价值执行AI复核（结果原地更新）
+        self._local_reviews.run()
         return results
     
     def _extract_page_title(self, page: Dict) -> str:
@@ -183,14 +257,16 @@ class RuleEngine:
             required_fields = evaluator.get("required_fields", [])
             
             # M1完整实现: 调用AI提取
-            from .ai_extractor import AIExtractor
-            
-            extractor = AIExtractor()
+            extractor = self._get_ai_extractor()
             for page in matched_pages:
                 body = page.get("body", "")
                 
-                # 调用AI提取字段
-                extracted = extractor.extract_fields(body, required_fields)
+                # 调用AI提取字段（locator关键词用于挑选相关段落）
+                extracted = extractor.extract_fields(
+                    body, required_fields,
+                    query_terms=rule.get("locator", {}).get("keywords"),
+                    rule_class=rule.get("class")
+                )
                 
                 # 验证所有required_fields都有值
                 all_present = all(
@@ -373,88 +449,151 @@ class RuleEngine:
         """
         返回UNCERTAIN结果，可选AI复核
         
+        AI复核不即时执行：本地分诊无法定论的规则先以UNCERTAIN放入结果，
+        登记到复核调度器，按期望价值排序后再复核并原地更新结果
+        
         Args:
             rule: 规则定义
             reason: UNCERTAIN原因
             pages: 所有页面内容（用于AI复核，可选）
         """
+        result = {
+            "rule_id": rule["rule_id"],
+            "status": UNCERTAIN,
+            "score_delta": 0,
+            "reason": reason,
+            "evidence": [],
+        }
+        
         # ✅ 新增: AI复核UNCERTAIN规则（环境变量控制）
-        import os
         enable_ai_review = os.environ.get("ENABLE_AI_REVIEW", "false").lower() == "true"
         
         if enable_ai_review and pages:
             try:
-                from .ai_extractor import AIExtractor
-                
-                # 创建AI提取器实例（共享实例以控制token消耗）
-                if not hasattr(self, '_ai_extractor'):
-                    self._ai_extractor = AIExtractor(
-                        primary_provider="deepseek",
-                        fallback_provider="qwen",
-                        max_cost_per_batch=2000  # 2000 tokens限制
-                    )
-                
-                logger.info(f"对规则 {rule['rule_id']} 进行AI复核（原因: {reason}）")
-                ai_result = self._ai_extractor.review_uncertain_rule(rule, pages, reason)
-                
-                # 高置信度（>0.8）才采纳AI判断
-                if ai_result["confidence"] > 0.8:
+                # ✅ 本地分诊：明显的情况直接定论，只有模糊的情况才调用LLM
+                texts = self._texts_for(pages)
+                decision, features = self._get_triage().decide(rule, reason, texts)
+                if decision:
                     logger.info(
-                        f"AI复核高置信度结果: {ai_result['status']} "
-                        f"(confidence: {ai_result['confidence']:.2f})"
+                        f"规则 {rule['rule_id']} 本地分诊: {decision['status']} "
+                        f"(confidence: {decision['confidence']:.2f}, {decision['source']})，跳过AI复核"
                     )
-                    
-                    # 根据AI判断返回适当的状态
-                    if ai_result["status"] == "FAIL":
-                        # AI判定为FAIL，但需要有evidence才能标记FAIL
-                        # 这里我们返回带AI reasoning的FAIL
-                        return {
-                            "rule_id": rule["rule_id"],
-                            "status": FAIL,
-                            "score_delta": rule.get("score", 0),
-                            "reason": f"ai_reviewed_{reason}",
-                            "ai_confidence": ai_result["confidence"],
-                            "ai_reasoning": ai_result["reasoning"],
-                            "evidence": [],  # AI判定的FAIL可能没有screenshot evidence
-                        }
-                    elif ai_result["status"] == "PASS":
-                        return {
-                            "rule_id": rule["rule_id"],
-                            "status": PASS,
-                            "score_delta": 0,
-                            "reason": f"ai_reviewed_{reason}",
-                            "ai_confidence": ai_result["confidence"],
-                            "ai_reasoning": ai_result["reasoning"],
-                            "evidence": [],
-                        }
-                    # else: ai_result["status"] == "UNCERTAIN" → 继续使用原UNCERTAIN逻辑
+                    return self._triage_result(rule, reason, decision)
+                
+                # ✅ 登记待复核（按扣分值×严重程度×站点优先级排序后执行）
+                pending = PendingReview(
+                    engine=self,
+                    rule=rule,
+                    reason=reason,
+                    pages=[{"url": page.get("url", ""), "body": text} for page, text in zip(pages, texts)],
+                    result=result,
+                    site_id=self.site_id,
+                    value=review_value(rule, self.site_priority),
+                    features=features,
+                )
+                if self.review_scheduler is not None:
+                    self.review_scheduler.submit(pending)
                 else:
-                    logger.info(
-                        f"AI复核置信度不足({ai_result['confidence']:.2f})，"
-                        f"保持UNCERTAIN状态"
-                    )
-                    # 附加AI建议到reason中
-                    return {
-                        "rule_id": rule["rule_id"],
-                        "status": UNCERTAIN,
-                        "score_delta": 0,
-                        "reason": reason,
-                        "ai_reviewed": True,
-                        "ai_confidence": ai_result["confidence"],
-                        "ai_suggestion": ai_result["suggested_action"],
-                        "evidence": [],
-                    }
-                    
+                    self._local_reviews.submit(pending)
             except Exception as e:
-                logger.error(f"AI复核失败: {e}")
-                # AI复核失败，返回原UNCERTAIN
+                logger.error(f"AI复核登记失败: {e}")
+        
+        # UNCERTAIN（未启用AI、待复核或登记失败）
+        return result
+
+    def _attach_review_evidence(self, rule: Dict, result: Dict, pages: List[Dict]):
+        """AI改判的结果关联证据页面（含规则关键词的首个页面），延迟取证阶段据此截图"""
+        locator = rule.get("locator") or {}
+        keywords = locator.get("keywords") or rule.get("evaluator", {}).get("keywords") or []
+        page = next((p for p in pages if any(kw in p.get("body", "") for kw in keywords)), pages[0])
+        evidence = self.evidence_cache.get_or_create(
+            rule_id=rule["rule_id"],
+            site_id=self.site_id or "unknown",
+            page=page,
+            locator=locator or None,
+            rule=rule,
+        )
+        result["evidence_ids"] = [evidence.evidence_id]
+        result["matched_url"] = page.get("url", "")
+
+    def _apply_ai_review(self, pending: PendingReview) -> str:
+        """
+        执行一条待复核规则的AI复核，原地更新其结果
         
-        # 原有UNCERTAIN返回（未启用AI或AI复核失败）
+        Returns:
+            "reviewed" | "budget"（预算不足跳过）| "failed"
+        """
+        rule, reason, result = pending.rule, pending.reason, pending.result
+        try:
+            # 共享AI提取器实例（token消耗计入批次预算）
+            logger.info(f"对规则 {rule['rule_id']} 进行AI复核（原因: {reason}，价值{pending.value:.2f}）")
+            ai_result = self._get_ai_extractor().review_uncertain_rule(rule, pending.pages, reason)
+        except Exception as e:
+            logger.error(f"AI复核失败: {e}")
+            return FAILED_REVIEW
+        
+        if ai_result.get("suggested_action") == "increase_token_limit":
+            result["ai_review_skipped"] = BUDGET_SKIPPED
+            result["ai_review_value"] = round(pending.value, 3)
+            return BUDGET_SKIPPED
+        if ai_result.get("reasoning") == "AI复核失败":
+            return FAILED_REVIEW
+        self._get_triage().record_sample(rule, reason, pending.features, ai_result)
+        
+        # 高置信度（>0.8）才采纳AI判断
+        if ai_result["confidence"] > 0.8:
+            logger.info(
+                f"AI复核高置信度结果: {ai_result['status']} "
+                f"(confidence: {ai_result['confidence']:.2f})"
+            )
+            
+            # 根据AI判断更新为适当的状态
+            if ai_result["status"] == "FAIL":
+                # AI判定为FAIL，但需要有evidence才能标记FAIL
+                # 这里我们返回带AI reasoning的FAIL
+                result.update({
+                    "status": FAIL,
+                    "score_delta": rule.get("score", 0),
+                    "reason": f"ai_reviewed_{reason}",
+                    "ai_confidence": ai_result["confidence"],
+                    "ai_reasoning": ai_result["reasoning"],
+                    "evidence": [],  # AI判定的FAIL可能没有screenshot evidence
+                })
+            elif ai_result["status"] == "PASS":
+                result.update({
+                    "status": PASS,
+                    "score_delta": 0,
+                    "reason": f"ai_reviewed_{reason}",
+                    "ai_confidence": ai_result["confidence"],
+                    "ai_reasoning": ai_result["reasoning"],
+                    "evidence": [],
+                })
+            # else: ai_result["status"] == "UNCERTAIN" → 保持原UNCERTAIN结果
+            if result["status"] in (PASS, FAIL) and pending.pages:
+                self._attach_review_evidence(rule, result, pending.pages)
+        else:
+            logger.info(
+                f"AI复核置信度不足({ai_result['confidence']:.2f})，"
+                f"保持UNCERTAIN状态"
+            )
+            # 附加AI建议
+            result.update({
+                "ai_reviewed": True,
+                "ai_confidence": ai_result["confidence"],
+                "ai_suggestion": ai_result["suggested_action"],
+            })
+        return REVIEWED
+
+    def _triage_result(self, rule: Dict, reason: str, decision: Dict) -> Dict:
+        """本地分诊结论（与AI复核结论的字段对应，reason前缀为triage_）"""
+        status = {"PASS": PASS, "FAIL": FAIL}.get(decision["status"], UNCERTAIN)
         return {
             "rule_id": rule["rule_id"],
-            "status": UNCERTAIN,
-            "score_delta": 0,
-            "reason": reason,
+            "status": status,
+            "score_delta": rule.get("score", 0) if status == FAIL else 0,
+            "reason": f"triage_{reason}" if status != UNCERTAIN else reason,
+            "triage_confidence": decision["confidence"],
+            "triage_source": decision["source"],
             "evidence": [],
         }
 
@@ -0,0 +1,86 @@
+"""
+进行中请求合并（singleflight）
+同一城市的部门网站常共用同一模板页面，并发站点会在同一时刻产生完全相同的prompt；
+相同key的请求在进行中时，后来者等待同一结果，不再重复调用AI
+"""
+import copy
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(*parts: str) -> str:
+    """由请求类型、Provider、prompt等拼接生成key"""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """线程安全的进行中请求合并（只合并同时进行的请求，不做结果缓存）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = Counter()    # kind -> 实际执行次数
+        self.coalesced = Counter()  # kind -> 合并（等待他人结果）次数
+
+    def do(self, key: str, fn: Callable[[], Any], kind: str = "default") -> Tuple[Any, bool]:
+        """
+        执行fn；若相同key已在执行中则等待其结果
+
+        Returns:
+            (结果, 是否为合并结果)；合并结果为深拷贝，调用方可自由修改
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders[kind] += 1
+            else:
+                call.waiters += 1
+                self.coalesced[kind] += 1
+
+        if not leader:
+            logger.info(f"合并进行中的相同AI请求（{kind}）")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            executed = sum(self.leaders.values())
+            coalesced = sum(self.coalesced.values())
+            return {
+                "executed": executed,
+                "coalesced": coalesced,
+                "coalesce_rate": round(coalesced / (executed + coalesced), 3) if executed + coalesced else 0.0,
+                "by_kind": {
+                    kind: {"executed": self.leaders[kind], "coalesced": self.coalesced[kind]}
+                    for kind in sorted(set(self.leaders) | set(self.coalesced))
+                },
+                "in_flight": len(self._calls),
+            }
@@ -34,6 +34,9 @@ def import_sites(path: Path) -> Dict:
             raise SiteImportError(f"site {sid} missing base_url")
         if "entry_points" not in site:
             site["entry_points"] = [site["base_url"]]
+        # 站点优先级（可选，0-10）：参与AI复核的价值排序
+        if "priority" in site and (not isinstance(site["priority"], (int, float)) or not (0 <= site["priority"] <= 10)):
+            raise SiteImportError(f"site {sid} priority must be 0-10, got {site['priority']}")
         
         # 处理content_paths优先级
         if "content_paths" in site:
@@ -1,6 +1,7 @@
 import json
 import hashlib
 import os
+import threading
 from pathlib import Path
 from typing import Any, Dict
 
@@ -27,6 +28,15 @@ def write_json(path: Path, data: Any) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+def write_json_atomic(path: Path, data: Any) -> None:
+    """先写临时文件再替换，并发读取方（如平台接口）不会读到写了一半的JSON"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
 def file_sha256(path: Path) -> str:
     h = hashlib.sha256()
     with path.open("rb") as f:
@@ -0,0 +1,246 @@
+"""
+批次级Token预算管理
+调用前按估算值预留token，调用后按实际用量结算，避免并发站点超支；
+支持站点公平份额、规则类别优先级，并实时导出剩余预算指标
+"""
+import itertools
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from .storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# 规则类别优先级：预留后剩余预算不得低于总预算的该比例（留给更高优先级的类别）
+# class 1（存在性/时效性）优先级最高，class 3（质量要素）最低
+CLASS_RESERVE_FLOOR = {1: 0.0, 2: 0.1, 3: 0.2}
+DEFAULT_RESERVE_FLOOR = 0.2
+
+
+@dataclass
+class Reservation:
+    """一次token预留"""
+    reservation_id: int
+    tokens: int
+    site_id: Optional[str] = None
+    rule_class: Optional[int] = None
+    estimated_input_tokens: int = 0  # 预留时的输入token估算（用于校准估算器）
+    hedged: bool = False     # 对冲请求的预留（单独统计）
+    cancelled: bool = False  # 对冲竞争落败，结果被丢弃
+    settled: bool = False
+
+
+class TokenBudget:
+    """线程安全的批次token预算"""
+
+    def __init__(
+        self,
+        total_tokens: int,
+        site_ids: Optional[Iterable[str]] = None,
+        fair_share: bool = True,
+        metrics_path: Optional[Path] = None,
+        max_concurrent_sites: Optional[int] = None,
+        min_site_tokens: int = 0,
+        export_interval: float = 1.0
+    ):
+        """
+        Args:
+            total_tokens: 批次总token预算
+            site_ids: 参与公平份额分配的站点（为空则不限制单站点）
+            fair_share: 是否启用站点公平份额
+            metrics_path: 实时指标导出路径（如 runs/<batch_id>/ai_budget.json）
+            max_concurrent_sites: 同时评估的站点数（份额按并发站点数而非批次总站点数划分）
+            min_site_tokens: 站点份额下限（至少能完成一次预留，避免大批次下份额被摊薄到无法调用）
+            export_interval: 指标导出的最小间隔（秒），避免每次调用都重写文件
+        """
+        self.total_tokens = total_tokens
+        self.fair_share = fair_share
+        self.max_concurrent_sites = max_concurrent_sites
+        self.min_site_tokens = min_site_tokens
+        self.metrics_path = metrics_path
+        self.export_interval = export_interval
+        self._last_export = 0.0
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._used = 0
+        self._reserved = 0
+        self._sites: Dict[str, Dict] = {}
+        self._denied = 0
+        self._hedge_used = 0
+        self._class_used: Dict[str, int] = {}
+
+        for site_id in site_ids or []:
+            self._sites[site_id] = {"used": 0, "reserved": 0, "finished": False}
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @used.setter
+    def used(self, value: int):
+        with self._lock:
+            self._used = value
+
+    @property
+    def reserved(self) -> int:
+        return self._reserved
+
+    @property
+    def remaining(self) -> int:
+        return self.total_tokens - self._used - self._reserved
+
+    def _site_quota(self, site_id: str) -> Optional[int]:
+        """
+        站点公平份额：已完成站点未用掉的预算由同时评估的站点平分（并发数为max_concurrent_sites，
+        不按批次总站点数摊薄），且不低于min_site_tokens；
+        所有站点都完成后（批次级AI复核阶段）不再限制单站点，由复核调度按价值分配
+        """
+        if not self.fair_share or site_id not in self._sites:
+            return None
+        unfinished = sum(1 for s in self._sites.values() if not s["finished"])
+        if not unfinished:
+            return None
+        pool = self.total_tokens - sum(s["used"] for s in self._sites.values() if s["finished"])
+        concurrent = min(unfinished, self.max_concurrent_sites or unfinished)
+        return max(int(pool / concurrent), self.min_site_tokens)
+
+    def available(self, site_id: Optional[str] = None, rule_class: Optional[int] = None) -> int:
+        """当前可预留的token上限（同时考虑类别保留下限与站点公平份额）"""
+        with self._lock:
+            floor = CLASS_RESERVE_FLOOR.get(rule_class, DEFAULT_RESERVE_FLOOR) if rule_class else 0.0
+            available = self.remaining - int(self.total_tokens * floor)
+            quota = self._site_quota(site_id) if site_id else None
+            if quota is not None:
+                site = self._sites[site_id]
+                available = min(available, quota - site["used"] - site["reserved"])
+            return max(available, 0)
+
+    def reserve(
+        self,
+        tokens: int,
+        site_id: Optional[str] = None,
+        rule_class: Optional[int] = None,
+        hedged: bool = False
+    ) -> Optional[Reservation]:
+        """
+        预留token
+
+        Returns:
+            Reservation；预算不足（总量/站点份额/类别下限）时返回None
+        """
+        with self._lock:
+            reservation = self._reserve_locked(tokens, site_id, rule_class, hedged)
+            metrics = self._export_due()
+        self._write_metrics(metrics)
+        return reservation
+
+    def _reserve_locked(self, tokens: int, site_id: Optional[str], rule_class: Optional[int],
+                        hedged: bool) -> Optional[Reservation]:
+        """持锁时检查总量/类别下限/站点份额并记录预留"""
+        floor = CLASS_RESERVE_FLOOR.get(rule_class, DEFAULT_RESERVE_FLOOR) if rule_class else 0.0
+        if self.remaining - tokens < self.total_tokens * floor:
+            self._denied += 1
+            logger.warning(
+                f"Token预算不足: 需要{tokens}, 剩余{self.remaining}/{self.total_tokens} "
+                f"(class {rule_class} 保留下限{floor:.0%})"
+            )
+            return None
+
+        quota = self._site_quota(site_id) if site_id else None
+        if quota is not None:
+            site = self._sites[site_id]
+            if site["used"] + site["reserved"] + tokens > quota:
+                self._denied += 1
+                logger.warning(
+                    f"站点{site_id}超出公平份额: 已用{site['used']}+预留{site['reserved']}+{tokens} > {quota}"
+                )
+                return None
+            site["reserved"] += tokens
+
+        self._reserved += tokens
+        return Reservation(next(self._ids), tokens, site_id, rule_class, hedged=hedged)
+
+    def settle(self, reservation: Reservation, actual_tokens: int):
+        """按实际用量结算一次预留（重复结算忽略）"""
+        with self._lock:
+            if reservation.settled:
+                return
+            reservation.settled = True
+            self._reserved -= reservation.tokens
+            self._used += actual_tokens
+            site = self._sites.get(reservation.site_id)
+            if site is not None:
+                site["reserved"] -= reservation.tokens
+                site["used"] += actual_tokens
+            if reservation.hedged:
+                self._hedge_used += actual_tokens
+            key = f"class_{reservation.rule_class}" if reservation.rule_class else "unclassified"
+            self._class_used[key] = self._class_used.get(key, 0) + actual_tokens
+            if actual_tokens > reservation.tokens:
+                logger.debug(f"实际用量{actual_tokens}超出预留{reservation.tokens}")
+            metrics = self._export_due()
+        self._write_metrics(metrics)
+
+    def release(self, reservation: Reservation):
+        """取消预留（调用失败、未产生用量）"""
+        self.settle(reservation, 0)
+
+    def finish_site(self, site_id: str):
+        """标记站点完成，其剩余份额释放给其他站点"""
+        with self._lock:
+            if site_id in self._sites:
+                self._sites[site_id]["finished"] = True
+            metrics = self._export_due()
+        self._write_metrics(metrics)
+
+    def flush(self):
+        """立即导出最新指标（批次结束时调用，补上节流期间未写出的变化）"""
+        with self._lock:
+            metrics = self._export_due(force=True)
+        self._write_metrics(metrics)
+
+    def snapshot(self) -> Dict:
+        """当前预算指标"""
+        return {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "total_tokens": self.total_tokens,
+            "used_tokens": self._used,
+            "reserved_tokens": self._reserved,
+            "remaining_tokens": self.remaining,
+            "denied_reservations": self._denied,
+            "hedged_tokens": self._hedge_used,
+            "class_used": dict(self._class_used),
+            "sites": {
+                site_id: {
+                    "used": s["used"],
+                    "reserved": s["reserved"],
+                    "quota": self._site_quota(site_id),
+                    "finished": s["finished"],
+                }
+                for site_id, s in self._sites.items()
+            },
+        }
+
+    def _export_due(self, force: bool = False) -> Optional[Dict]:
+        """持锁时调用：距上次导出超过export_interval时返回指标快照（文件在锁外写入）"""
+        if not self.metrics_path:
+            return None
+        now = time.monotonic()
+        if not force and now - self._last_export < self.export_interval:
+            return None
+        self._last_export = now
+        return self.snapshot()
+
+    def _write_metrics(self, metrics: Optional[Dict]):
+        if metrics is None:
+            return
+        try:
+            write_json_atomic(self.metrics_path, metrics)
+        except Exception as e:
+            logger.debug(f"预算指标导出失败: {e}")
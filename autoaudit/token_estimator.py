@@ -0,0 +1,129 @@
+"""
+Token估算与prompt装填
+发送前在本地估算中文为主的prompt的token数（近似ModelScope上DeepSeek/Qwen/GLM的分词器），
+并按实际用量持续校准；供预算预留、prompt按目标token数装填和超预算时的收缩/拒绝使用
+"""
+import logging
+import math
+import re
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 分词器近似参数（按常见中文政务页面实测取偏保守值）
+CJK_TOKENS_PER_CHAR = 0.75   # 汉字：BPE词表常把高频词合并，约0.6~0.75 token/字
+ASCII_CHARS_PER_TOKEN = 4    # 英文单词/URL
+DIGITS_PER_TOKEN = 3         # 数字串（电话、日期）
+MESSAGE_OVERHEAD_TOKENS = 4  # 每条chat消息的格式开销
+
+_CJK_RE = re.compile(r"[一-鿿㐀-䶿]")
+_ASCII_WORD_RE = re.compile(r"[A-Za-z]+")
+_DIGIT_RE = re.compile(r"[0-9]+")
+_SPACE_RE = re.compile(r"\s")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    未校准的token估算
+
+    汉字按CJK_TOKENS_PER_CHAR计，英文单词约4字符/token，数字约3位/token，
+    其余标点符号（含全角）各计1 token，空白不计
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    words = _ASCII_WORD_RE.findall(text)
+    digits = _DIGIT_RE.findall(text)
+    spaces = len(_SPACE_RE.findall(text))
+    other = len(text) - cjk - sum(map(len, words)) - sum(map(len, digits)) - spaces
+    return math.ceil(
+        cjk * CJK_TOKENS_PER_CHAR
+        + sum(math.ceil(len(w) / ASCII_CHARS_PER_TOKEN) for w in words)
+        + sum(math.ceil(len(d) / DIGITS_PER_TOKEN) for d in digits)
+        + max(other, 0)
+    )
+
+
+class TokenEstimator:
+    """带在线校准的token估算器（线程安全）"""
+
+    def __init__(self, alpha: float = 0.2, min_observations: int = 5):
+        """
+        Args:
+            alpha: 校准系数的指数滑动平均权重
+            min_observations: 观测数达到该值后才应用校准系数
+        """
+        self.alpha = alpha
+        self.min_observations = min_observations
+        self._lock = threading.Lock()
+        self._ratio = 1.0  # 实际/估算 的滑动平均
+        self._observations = 0
+        self._providers: Dict[str, Dict] = {}
+
+    @property
+    def scale(self) -> float:
+        """当前校准系数（样本不足时为1.0）"""
+        return self._ratio if self._observations >= self.min_observations else 1.0
+
+    def estimate(self, text: str) -> int:
+        """校准后的token估算"""
+        return math.ceil(estimate_tokens(text) * self.scale)
+
+    def estimate_chat(self, system: str, prompt: str) -> int:
+        """一次chat请求（system + user）的输入token估算"""
+        return self.estimate(system) + self.estimate(prompt) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+    def to_raw(self, tokens: int) -> int:
+        """把校准后的token数换算回未校准单位（供段落选择按estimate_tokens计费）"""
+        return int(tokens / self.scale)
+
+    def observe(self, provider: str, estimated: int, actual: int):
+        """记录一次估算与实际输入token，更新校准系数"""
+        if estimated <= 0 or actual <= 0:
+            return
+        ratio = actual / estimated
+        with self._lock:
+            self._observations += 1
+            self._ratio = ratio if self._observations == 1 else (
+                self.alpha * ratio + (1 - self.alpha) * self._ratio
+            )
+            p = self._providers.setdefault(
+                provider, {"observations": 0, "estimated": 0, "actual": 0, "abs_error": 0}
+            )
+            p["observations"] += 1
+            p["estimated"] += estimated
+            p["actual"] += actual
+            p["abs_error"] += abs(actual - estimated)
+        logger.debug(f"Token估算[{provider}]: 估算{estimated} / 实际{actual} (比值{ratio:.2f}, 校准系数{self._ratio:.2f})")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "scale": round(self.scale, 3),
+                "observations": self._observations,
+                "providers": {
+                    provider: {
+                        "observations": p["observations"],
+                        "estimated_tokens": p["estimated"],
+                        "actual_tokens": p["actual"],
+                        "actual_to_estimated": round(p["actual"] / p["estimated"], 3) if p["estimated"] else 0,
+                        "mean_abs_error_pct": round(p["abs_error"] / p["actual"], 3) if p["actual"] else 0,
+                    }
+                    for provider, p in self._providers.items()
+                },
+            }
+
+
+def fit_prompt_budget(target_tokens: int, available_tokens: int, min_tokens: int) -> Optional[int]:
+    """
+    按剩余预算确定prompt目标token数
+
+    Returns:
+        预算充足时为target_tokens；不足但不少于min_tokens时收缩为available_tokens；否则None（拒绝调用）
+    """
+    if available_tokens >= target_tokens:
+        return target_tokens
+    if available_tokens >= min_tokens:
+        return available_tokens
+    return None
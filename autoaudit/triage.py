@@ -0,0 +1,337 @@
+"""
+UNCERTAIN规则本地分诊
+在调用LLM复核前，用纯CPU的轻量分类器（关键词/TF-IDF特征 + softmax线性模型）判断：
+明显的情况（如站点几乎没有内容时的no_pages_matched）直接在本地定论，只有模糊的情况才交给review_uncertain_rule
+
+训练数据来自历次AI复核：RuleEngine把每次复核的特征与AI结论追加到 runs/<batch_id>/ai_review_samples.jsonl，
+用 `python -m autoaudit.triage train` 汇总所有批次训练模型（默认保存到 data/triage_model.json）
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .passage_selector import PassageSelector, build_query_terms, tokenize
+from .storage import DATA_DIR, RUNS_DIR, write_json
+
+logger = logging.getLogger(__name__)
+
+CLASSES = ["PASS", "FAIL", "UNCERTAIN"]
+DEFAULT_MODEL_PATH = DATA_DIR / "triage_model.json"
+SAMPLES_FILENAME = "ai_review_samples.jsonl"
+ADOPT_CONFIDENCE = 0.8  # 与RuleEngine采纳AI结论的阈值一致
+
+_selector = PassageSelector(chunk_chars=200)
+
+
+def _bucket(value: float, edges: List[float]) -> str:
+    for edge in edges:
+        if value < edge:
+            return f"<{edge:g}"
+    return f">={edges[-1]:g}"
+
+
+def extract_features(rule: Dict, reason: str, page_texts: List[str]) -> Dict[str, float]:
+    """
+    规则 + UNCERTAIN原因 + 页面文本 → 稀疏特征
+
+    结构特征（原因、类别、页面数、内容量、关键词命中）取值1.0；
+    与规则最相关的少量段落分词后作为 w: 文本特征（训练后按IDF加权）
+    """
+    text_len = sum(len(t) for t in page_texts)
+    keywords = [k.lower() for k in
+                rule.get("locator", {}).get("keywords", []) + rule.get("evaluator", {}).get("keywords", [])]
+    joined = "\n".join(page_texts).lower()
+    hits = [k for k in keywords if k and k in joined]
+    coverage = len(hits) / len(keywords) if keywords else 0.0
+
+    features = {
+        "bias": 1.0,
+        f"reason={reason}": 1.0,
+        f"class={rule.get('class')}": 1.0,
+        f"rule={rule.get('rule_id')}": 1.0,
+        f"pages={_bucket(len(page_texts), [1, 3, 10, 30])}": 1.0,
+        f"text={_bucket(text_len, [200, 1000, 5000, 20000])}": 1.0,
+        f"kw_hits={_bucket(len(hits), [1, 2, 4])}": 1.0,
+        f"kw_cov={round(coverage * 4) / 4:g}": 1.0,
+        f"reason={reason}|kw_hits={min(len(hits), 2)}": 1.0,
+    }
+    if page_texts:
+        terms = build_query_terms(rule=rule, expand_synonyms=False)
+        passages = _selector.select(page_texts, terms, 200)
+        for token, count in Counter(tokenize(" ".join(passages))).items():
+            features[f"w:{token}"] = float(count)
+    return features
+
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+class TriageModel:
+    """稀疏特征上的多类logistic回归（纯Python，SGD训练）"""
+
+    def __init__(self, weights: Optional[Dict[str, List[float]]] = None, idf: Optional[Dict[str, float]] = None,
+                 meta: Optional[Dict] = None):
+        self.weights = weights or {}
+        self.idf = idf or {}
+        self.meta = meta or {}
+
+    def _vectorize(self, features: Dict[str, float]) -> Dict[str, float]:
+        """文本特征做 (1+log tf)·idf 加权并L2归一化，结构特征保持1.0"""
+        vec = {}
+        norm = 0.0
+        for name, value in features.items():
+            if name.startswith("w:"):
+                idf = self.idf.get(name)
+                if idf is None:
+                    continue
+                value = (1 + math.log(value)) * idf
+                norm += value * value
+            vec[name] = value
+        if norm:
+            scale = 1 / math.sqrt(norm)
+            for name in vec:
+                if name.startswith("w:"):
+                    vec[name] *= scale
+        return vec
+
+    def predict_proba(self, features: Dict[str, float]) -> Dict[str, float]:
+        return dict(zip(CLASSES, self.predict_proba_vec(self._vectorize(features))))
+
+    @classmethod
+    def fit(cls, samples: List[Tuple[Dict[str, float], str]], epochs: int = 30, lr: float = 0.2,
+            l2: float = 1e-4, min_df: int = 2, seed: int = 42) -> "TriageModel":
+        """
+        训练模型
+
+        Args:
+            samples: [(特征, 标签)]，标签为CLASSES之一
+            min_df: 文本特征最少出现的样本数（过滤偶发词）
+        """
+        df = Counter()
+        for features, _ in samples:
+            df.update(name for name in features if name.startswith("w:"))
+        n = len(samples)
+        idf = {name: math.log((1 + n) / (1 + c)) + 1 for name, c in df.items() if c >= min_df}
+
+        model = cls(idf=idf)
+        data = [(model._vectorize(features), CLASSES.index(label)) for features, label in samples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            step = lr / (1 + epoch * 0.1)
+            for vec, y in data:
+                probs = model.predict_proba_vec(vec)
+                for name, value in vec.items():
+                    w = model.weights.setdefault(name, [0.0] * len(CLASSES))
+                    for k in range(len(CLASSES)):
+                        grad = (probs[k] - (1.0 if k == y else 0.0)) * value + l2 * w[k]
+                        w[k] -= step * grad
+        model.meta = {"samples": n, "label_counts": dict(Counter(label for _, label in samples))}
+        return model
+
+    def predict_proba_vec(self, vec: Dict[str, float]) -> List[float]:
+        scores = [0.0] * len(CLASSES)
+        for name, value in vec.items():
+            w = self.weights.get(name)
+            if w:
+                for k in range(len(CLASSES)):
+                    scores[k] += w[k] * value
+        return _softmax(scores)
+
+    def save(self, path: Path):
+        write_json(path, {"classes": CLASSES, "idf": self.idf, "weights": self.weights, "meta": self.meta})
+
+    @classmethod
+    def load(cls, path: Path) -> "TriageModel":
+        with Path(path).open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(weights=data["weights"], idf=data["idf"], meta=data.get("meta"))
+
+
+class TriageClassifier:
+    """UNCERTAIN规则分诊：本地定论或转交LLM（线程安全，可在批次内跨站点共享）"""
+
+    def __init__(
+        self,
+        model_path: Optional[Path] = DEFAULT_MODEL_PATH,
+        samples_path: Optional[Path] = None,
+        threshold: float = 0.9,
+        min_content_chars: int = 200,
+        est_tokens_per_review: int = 2300
+    ):
+        """
+        Args:
+            model_path: 训练好的模型（不存在时只使用内容量规则）
+            samples_path: AI复核样本输出路径（如 runs/<batch_id>/ai_review_samples.jsonl）
+            threshold: 模型最高类别概率达到该值才本地定论
+            min_content_chars: 站点全部页面文本少于该值时直接判定UNCERTAIN（LLM也无从判断）
+            est_tokens_per_review: 每次LLM复核的估算token（用于统计节省）
+        """
+        self.threshold = threshold
+        self.min_content_chars = min_content_chars
+        self.est_tokens_per_review = est_tokens_per_review
+        self.samples_path = Path(samples_path) if samples_path else None
+        self.model: Optional[TriageModel] = None
+        if model_path and Path(model_path).exists():
+            try:
+                self.model = TriageModel.load(model_path)
+                logger.info(f"已加载分诊模型: {model_path}（{self.model.meta.get('samples', '?')}条样本）")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"分诊模型加载失败: {e}")
+
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def decide(self, rule: Dict, reason: str, page_texts: List[str]) -> Tuple[Optional[Dict], Dict[str, float]]:
+        """
+        Returns:
+            (本地结论或None, 特征)；本地结论形如 {"status", "confidence", "source"}
+        """
+        features = extract_features(rule, reason, page_texts)
+        decision = None
+        content_chars = sum(len(t.strip()) for t in page_texts)
+        if content_chars < self.min_content_chars:
+            decision = {"status": "UNCERTAIN", "confidence": 1.0, "source": "insufficient_content"}
+        elif self.model is not None:
+            probs = self.model.predict_proba(features)
+            label, confidence = max(probs.items(), key=lambda x: x[1])
+            if confidence >= self.threshold:
+                decision = {"status": label, "confidence": round(confidence, 3), "source": "model"}
+
+        with self._lock:
+            if decision:
+                self.stats[f"local_{decision['status']}"] += 1
+            else:
+                self.stats["forwarded"] += 1
+        return decision, features
+
+    def record_sample(self, rule: Dict, reason: str, features: Dict[str, float], ai_result: Dict):
+        """追加一条AI复核样本（供后续训练）"""
+        if not self.samples_path or ai_result.get("reasoning") in (None, "AI复核失败"):
+            return
+        if ai_result.get("suggested_action") == "increase_token_limit":
+            return
+        sample = {
+            "rule_id": rule.get("rule_id"),
+            "reason": reason,
+            "features": features,
+            "ai_status": ai_result.get("status"),
+            "ai_confidence": ai_result.get("confidence"),
+        }
+        line = json.dumps(sample, ensure_ascii=False)
+        with self._lock:
+            try:
+                self.samples_path.parent.mkdir(parents=True, exist_ok=True)
+                with self.samples_path.open("a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.debug(f"分诊样本写入失败: {e}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            local = sum(v for k, v in self.stats.items() if k.startswith("local_"))
+            forwarded = self.stats["forwarded"]
+            total = local + forwarded
+            return {
+                "model_loaded": self.model is not None,
+                "triaged": total,
+                "settled_locally": local,
+                "forwarded_to_llm": forwarded,
+                "llm_calls_saved_rate": round(local / total, 3) if total else 0.0,
+                "estimated_tokens_saved": local * self.est_tokens_per_review,
+                "by_status": {k[len("local_"):]: v for k, v in self.stats.items() if k.startswith("local_")},
+            }
+
+    def render_section(self) -> List[str]:
+        """审计报告：本地分诊"""
+        s = self.snapshot()
+        if not s["triaged"]:
+            return []
+        md = ["## 🩺 UNCERTAIN本地分诊\n\n"]
+        md.append(f"- **分诊规则数**: {s['triaged']}（模型{'已加载' if s['model_loaded'] else '未加载，仅内容量规则'}）\n")
+        md.append(f"- **本地定论**: {s['settled_locally']}（节省LLM调用{s['llm_calls_saved_rate']:.1%}，约{s['estimated_tokens_saved']} tokens）\n")
+        md.append(f"- **转交LLM复核**: {s['forwarded_to_llm']}\n")
+        for status, count in s["by_status"].items():
+            md.append(f"- 本地判定 `{status}`: {count}\n")
+        md.append("\n")
+        return md
+
+
+def sample_label(sample: Dict) -> Optional[str]:
+    """AI结论 → 训练标签：置信度达到采纳阈值的PASS/FAIL，其余视为UNCERTAIN"""
+    status = sample.get("ai_status")
+    if status not in CLASSES:
+        return None
+    if status != "UNCERTAIN" and (sample.get("ai_confidence") or 0) <= ADOPT_CONFIDENCE:
+        return "UNCERTAIN"
+    return status
+
+
+def load_samples(runs_dir: Path = RUNS_DIR) -> Iterable[Tuple[Dict[str, float], str]]:
+    """逐行读取所有批次的AI复核样本"""
+    for path in sorted(Path(runs_dir).glob(f"*/{SAMPLES_FILENAME}")):
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                label = sample_label(sample)
+                if label and sample.get("features"):
+                    yield sample["features"], label
+
+
+def evaluate(model: TriageModel, samples: List[Tuple[Dict[str, float], str]], threshold: float) -> Dict:
+    """在留出集上评估：覆盖率（本地定论比例）与定论准确率"""
+    settled = correct = 0
+    for features, label in samples:
+        probs = model.predict_proba(features)
+        pred, confidence = max(probs.items(), key=lambda x: x[1])
+        if confidence >= threshold:
+            settled += 1
+            correct += int(pred == label)
+    return {
+        "holdout": len(samples),
+        "coverage": round(settled / len(samples), 3) if samples else 0.0,
+        "precision": round(correct / settled, 3) if settled else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="UNCERTAIN规则分诊模型")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_train = sub.add_parser("train", help="用历次AI复核样本训练分诊模型")
+    p_train.add_argument("--runs", type=Path, default=RUNS_DIR, help="批次输出目录")
+    p_train.add_argument("--out", type=Path, default=DEFAULT_MODEL_PATH, help="模型输出路径")
+    p_train.add_argument("--threshold", type=float, default=0.9, help="评估用的本地定论阈值")
+    p_train.add_argument("--holdout", type=float, default=0.2, help="留出评估比例")
+    args = parser.parse_args()
+
+    samples = list(load_samples(args.runs))
+    if len(samples) < 10:
+        print(f"样本不足（{len(samples)}条），请先开启ENABLE_AI_REVIEW运行若干批次")
+        return
+
+    random.Random(42).shuffle(samples)
+    cut = int(len(samples) * (1 - args.holdout))
+    metrics = evaluate(TriageModel.fit(samples[:cut]), samples[cut:], args.threshold)
+    print(f"留出评估: {metrics}")
+
+    model = TriageModel.fit(samples)
+    model.meta["holdout_metrics"] = metrics
+    model.save(args.out)
+    print(f"模型已保存: {args.out}（{len(samples)}条样本，标签分布 {model.meta['label_counts']}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -127,6 +127,25 @@ def get_batch(batch_id: str):
     except Exception as e:
         return {"error": str(e)}
 
+@app.get("/batch/{batch_id}/ai_budget")
+def get_batch_ai_budget(batch_id: str):
+    """获取批次AI token预算实时指标"""
+    budget_file = project_root / "runs" / batch_id / "ai_budget.json"
+    if not budget_file.exists():
+        return {"error": "Budget metrics not found"}
+    import json
+    with open(budget_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+@app.get("/batch/{batch_id}/ai_metrics")
+def get_batch_ai_metrics(batch_id: str):
+    """流式汇总批次AI调用流水账（滚动p50/p95、tokens/min、错误率）"""
+    ledger_file = project_root / "runs" / batch_id / "ai_invocations.jsonl"
+    if not ledger_file.exists():
+        return {"error": "AI invocation ledger not found"}
+    from autoaudit.ai_ledger import summarize_ledger
+    return summarize_ledger(ledger_file)
+
 if __name__ == "__main__":
     import uvicorn
     print(f"项目根目录: {project_root}")
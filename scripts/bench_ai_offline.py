@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+AI路径离线压测
+启动本地OpenAI兼容模拟服务，测量AIExtractor的吞吐、并发、预算与Provider降级
+（无需ModelScope Key，结果可复现）
+
+用法:
+    python scripts/bench_ai_offline.py --requests 200 --concurrency 8
+    python scripts/bench_ai_offline.py --config mock_llm.json --budget 20000
+    python scripts/bench_ai_offline.py --same-page   # 所有请求使用同一页面，测量进行中请求合并
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+# 页面不含可被本地正则提取的联系方式，保证每次都走LLM
+# 默认每个请求的页面带不同编号，prompt各不相同，测得的是AIExtractor与路由本身而非请求合并
+SAMPLE_HTML = """
+<html><body>
+<h1>政府信息公开（第{index}页）</h1>
+<p>本机关依法主动公开政府信息，公开方式包括政府网站、政务新媒体等。</p>
+<p>如需依申请公开，请前往政务服务中心窗口办理。</p>
+</body></html>
+"""
+
+SAMPLE_RULE = {
+    "rule_id": "bench_rule",
+    "description": "政府信息公开指南应包含申请渠道",
+    "class": 2,
+    "locator": {"keywords": ["信息公开指南"]},
+    "evaluator": {"keywords": ["申请渠道", "受理机构"]},
+}
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI路径离线压测")
+    parser.add_argument("--config", help="模拟服务配置JSON")
+    parser.add_argument("--requests", type=int, default=100, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发数")
+    parser.add_argument("--review-ratio", type=float, default=0.3, help="复核请求占比")
+    parser.add_argument("--budget", type=int, default=1000000, help="批次token预算")
+    parser.add_argument("--hedge", action="store_true", help="启用对冲请求")
+    parser.add_argument("--same-page", action="store_true", help="所有请求使用相同页面（测量请求合并效果）")
+    args = parser.parse_args()
+
+    from autoaudit.mock_llm_server import MockLLMServer
+
+    config = {}
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+    with MockLLMServer(config) as server:
+        os.environ["AI_BASE_URL"] = server.base_url
+        os.environ.setdefault("DEEPSEEK_API_KEY", "mock")
+        if args.hedge:
+            os.environ["AI_HEDGE_ENABLED"] = "true"
+
+        from autoaudit.ai_extractor import AIExtractor
+        from autoaudit.token_budget import TokenBudget
+
+        budget = TokenBudget(args.budget)
+        extractor = AIExtractor(primary_provider="deepseek", fallback_provider="qwen", budget=budget)
+
+        review_every = int(1 / args.review_ratio) if args.review_ratio > 0 else 0
+
+        def one(i):
+            start = time.time()
+            html = SAMPLE_HTML.format(index=0 if args.same_page else i)
+            if review_every and i % review_every == 0:
+                result = extractor.review_uncertain_rule(SAMPLE_RULE, [{"body": html}], "bench")
+                ok = result.get("suggested_action") != "increase_token_limit" and result.get("reasoning") != "AI复核失败"
+            else:
+                result = extractor.extract_fields(html, ["phone", "address"])
+                ok = any(result.values())
+            return (time.time() - start) * 1000, ok
+
+        print(f"\n模拟服务: {server.base_url}")
+        print(f"请求数: {args.requests}, 并发: {args.concurrency}, 对冲: {args.hedge}, 相同页面: {args.same_page}")
+
+        wall_start = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            outcomes = list(pool.map(one, range(args.requests)))
+        wall = time.time() - wall_start
+
+        latencies = [lat for lat, _ in outcomes]
+        succeeded = sum(1 for _, ok in outcomes if ok)
+        stats = extractor.get_invocation_stats()
+
+        print("\n" + "=" * 60)
+        print("结果")
+        print("=" * 60)
+        print(f"  耗时: {wall:.2f}s, 吞吐: {args.requests / wall:.1f} req/s")
+        print(f"  成功: {succeeded}/{args.requests}")
+        print(f"  端到端延迟 p50: {_percentile(latencies, 50):.0f}ms, p95: {_percentile(latencies, 95):.0f}ms")
+        print(f"  AI调用: {stats.get('total_invocations', 0)} 次, 成功率 {stats.get('success_rate', 0):.0%}")
+        coalesce = stats.get("coalesce_stats", {})
+        print(f"  请求合并: 实际执行 {coalesce.get('executed', 0)} 次, 合并 {coalesce.get('coalesced', 0)} 次")
+        print(f"  Token: 已用 {budget.used}, 剩余 {budget.remaining}, 拒绝预留 {budget.snapshot()['denied_reservations']}")
+        print(f"  Provider分布: {stats.get('provider_stats', {})}")
+        print(f"  路由决策: {extractor.router.snapshot()['decisions']}")
+        print(f"  模拟服务统计: {dict(server.stats)}")
+        if args.hedge:
+            print(f"  对冲: {stats.get('hedge_stats', {})}")
+
+
+if __name__ == "__main__":
+    main()
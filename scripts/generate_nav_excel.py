@@ -5,6 +5,7 @@
 import json
 import os
 import sys
+from pathlib import Path
 
 # 确保openpyxl已安装
 try:
@@ -92,7 +93,7 @@ def generate_navigation_report(batch_id, site_id="site_suqian_gov_zwgk"):
         
         step_name = "入口页" if step == "entry" else "深度导航"
         page_name = extract_page_name(url)
-        screenshot = f"screenshot_{idx-1}.jpg"
+        screenshot = Path(item["screenshot"]).name if item.get("screenshot") else ""
         
         ws.cell(row=row, column=1, value=idx).border = border
         ws.cell(row=row, column=2, value=step_name).border = border
@@ -29,6 +29,7 @@ async def test_highlight_selector():
         test_url = "http://localhost:8000/pass"  # 需要先启动sandbox
         
         result = await worker.fetch(test_url, "test", rule_hints)
+        await worker.encoder.wait(result.screenshot)  # 截图在后台编码，等待落盘
         
         print(f"  ✅ 截图已保存: {result.screenshot}")
         print(f"  ℹ️  文件大小: {Path(result.screenshot).stat().st_size} bytes")
@@ -56,6 +57,7 @@ async def test_highlight_keywords():
         test_url = "http://localhost:8000/pass"
         
         result = await worker.fetch(test_url, "test", rule_hints)
+        await worker.encoder.wait(result.screenshot)  # 截图在后台编码，等待落盘
         
         print(f"  ✅ 截图已保存: {result.screenshot}")
         print(f"  ℹ️  文件大小: {Path(result.screenshot).stat().st_size} bytes")
@@ -79,6 +81,7 @@ async def test_no_highlight():
         test_url = "http://localhost:8000/pass"
         
         result = await worker.fetch(test_url, "test", None)
+        await worker.encoder.wait(result.screenshot)  # 截图在后台编码，等待落盘
         
         print(f"  ✅ 截图已保存: {result.screenshot}")
         print(f"  👉 此截图应该没有红框（对照组）")
@@ -68,7 +68,7 @@ def test_invocation_logging():
         total_tokens=100,
         success=True
     )
-    extractor.invocations.append(inv)
+    extractor._record_invocation(inv)
     
     stats = extractor.get_invocation_stats()
     
@@ -89,7 +89,7 @@ def test_audit_report():
     extractor = AIExtractor()
     
     # 添加一些模拟记录
-    extractor.invocations.append(AiInvocation(
+    extractor._record_invocation(AiInvocation(
         invocation_id="test_1",
         provider="gemini",
         model="gemini-pro",
@@ -97,7 +97,7 @@ def test_audit_report():
         total_tokens=120,
         success=True
     ))
-    extractor.invocations.append(AiInvocation(
+    extractor._record_invocation(AiInvocation(
         invocation_id="test_2",
         provider="deepseek",
         model="deepseek-chat",
@@ -23,6 +23,8 @@ async def test_webp_compression():
     try:
         # 测试截图
         result = await worker.fetch("https://www.baidu.com", "test")
+        # 截图在后台编码，等待落盘后再检查文件
+        await worker.encoder.wait(result.screenshot)
         
         if result.screenshot and Path(result.screenshot).exists():
             size = Path(result.screenshot).stat().st_size